@@ -1,39 +1,68 @@
 import csv
+import hashlib
 import re
 import os
+import shutil
 import traceback
 import subprocess
+import sys
 import json
 import tarfile
 from datetime import datetime
 from collections import defaultdict
+from contextlib import contextmanager
 from requests.exceptions import RequestException
 import concurrent.futures
-from time import time, sleep
+from time import time, sleep, perf_counter
 from configparser import ConfigParser
 
 from iox import api, ioxclient
+from iox.catalog import ResourceDescriptorStore
+from iox.device_resolver import DeviceResolver
 from logs import log
+from utils import archive, manifest
+from utils.deadline import DeviceTimeoutError
+from utils.result_store import ResultStore
+from utils.tracing import Tracer
 
 logger = log.get_logger("App Migration:: ")
 
+# Phases of an app migration, traced as spans and reported as `<phase>_seconds` columns
+PHASE_EXPORT_DATA = 'export_data'
+PHASE_EXTRACT_DATA = 'extract_data'
+PHASE_UNINSTALL = 'uninstall'
+PHASE_DEPLOY = 'deploy'
+PHASE_UPLOAD_DATA = 'upload_data'
+PHASE_VERIFY = 'verify'
+PHASES = [PHASE_EXPORT_DATA, PHASE_EXTRACT_DATA, PHASE_UNINSTALL, PHASE_DEPLOY, PHASE_UPLOAD_DATA, PHASE_VERIFY]
+
+# Columns of the app migration report, the first five are the summary table printed at the end of a run
+REPORT_COLUMNS = [('serial_number', 'str'), ('app_name', 'str'), ('app_version', 'str'), ('app_status', 'str'),
+                  ('error', 'str'), ('deploy_status', 'str')] + [(f'{phase}_seconds', 'd') for phase in PHASES]
+REPORT_HEADER = ['Device Serial#', 'App Name', 'App Version', 'App Status', 'Error']
+
 
 class Application:
+    # Slots keep the per app memory small on runs with hundreds of thousands of installed apps
+    __slots__ = ('app_id', 'imported_app_id', 'app_name', 'gmm_formatted_app_name', 'app_type', 'app_version',
+                 'exported_package_name', 'app_data_file_name', 'app_config_file_name', 'image_url', 'status',
+                 'app_config', 'resource_config', 'need_uninstall', 'deploy_status', 'deploy_error',
+                 'operational_status', 'deploy_status_msg', 'phase_seconds', 'phase_bytes')
+
     def __init__(self, app_id: str, gmm_formatted_app_name: str, app_name: str, app_type: str, app_version: str,
                  status: str):
+        # App names, versions and status repeat on every device so share a single string instance
         self.app_id = app_id
         self.imported_app_id = app_id
-        self.app_name = app_name
-        self.gmm_formatted_app_name = gmm_formatted_app_name
-        self.app_type = app_type
-        self.app_version = app_version
+        self.app_name = intern_string(app_name)
+        self.gmm_formatted_app_name = intern_string(gmm_formatted_app_name)
+        self.app_type = intern_string(app_type)
+        self.app_version = intern_string(app_version)
         self.exported_package_name = None
-        self.import_package_name = app_name + '_V' + app_version.replace('.', '_') + '.tar.gz'
-        self.app_data_file_name = app_name + '-datamount.tar.gz'
+        self.app_data_file_name = intern_string(app_name + '-datamount.tar.gz')
         self.app_config_file_name = 'package_config.ini'
         self.image_url = None
-        self.image_tag = app_version
-        self.status = status
+        self.status = intern_string(status)
         self.app_config = None
         self.resource_config = None
         self.need_uninstall = False
@@ -41,19 +70,38 @@ class Application:
         self.deploy_error = ""
         self.operational_status = None
         self.deploy_status_msg = ""
+        # Seconds spent in each migration phase, created on the first timed phase
+        self.phase_seconds = None
+        # Bytes moved by the app-data phases, created on the first transfer
+        self.phase_bytes = None
+
+    @property
+    def import_package_name(self):
+        return self.app_name + '_V' + self.app_version.replace('.', '_') + '.tar.gz'
+
+    @property
+    def image_tag(self):
+        return self.app_version
 
 
 class Device:
+    __slots__ = ('device_id', 'device_ip', 'device_name', 'device_status', 'port', 'serial_number', 'profile_name',
+                 'applications', 'installed_apps', 'model')
+
     def __init__(self, device_id: str, device_ip: str, port: int, serial_number: str, device_name: str,
                  device_status: str, profile_name: str):
         self.device_id = device_id
         self.device_ip = device_ip
         self.device_name = device_name
-        self.device_status = device_status
+        self.device_status = intern_string(device_status)
         self.port = port
         self.serial_number = serial_number
         self.profile_name = profile_name
         self.applications = []
+        # App records reported by IoT-OD on the device, used to find the apps which are already migrated
+        self.installed_apps = []
+        # Hardware model of the device, e.g. IR829, which selects the bandwidth cap of its app-data transfers
+        self.model = None
 
 
 class AppMigration:
@@ -108,7 +156,37 @@ class AppMigration:
         self.skip_managed_apps = skip_managed_apps
         self.gmm_api_key = gmm_api_key
         self.gmm_org_id = gmm_org_id
-        self.migration_report_data = []
+        self.migration_report_data = ResultStore(REPORT_COLUMNS)
+        # Optional ReportSink, when set every report row is also written to the report file as soon as it is known
+        self.report_sink = None
+        # Times the migration phases, replace it with a Tracer writing a trace file to keep the spans
+        self.tracer = Tracer()
+        # Snapshot of the IoT-OD app catalog, when loaded the app lookups are answered without api calls
+        self.catalog = None
+        # Frozen app descriptor resources, looked up once per app version and overlaid with the GMM resources
+        self.resource_descriptors = ResourceDescriptorStore(self.find_app_info)
+        # Index of the IoT-OD device inventory, when loaded the devices are resolved without api calls
+        self.device_resolver = None
+        # Number of apps of a device imported at the same time by `import_app`
+        self.app_concurrency = 1
+        # Optional callable(app, apps) returning the apps of the device which must be imported before `app`
+        self.app_dependencies = None
+        # Skip the GMM apps which are already installed on the device in the state the migration would leave them
+        self.skip_migrated_apps = False
+        # Optional VerificationSweep, when set the operational status of the deployed apps is checked in bulk after
+        # the device instead of polling every app right after its deploy
+        self.verification_sweep = None
+        # Optional Deadline of the current device, its polls and steps raise DeviceTimeoutError once it is spent
+        self.deadline = None
+        # Optional BandwidthShaper pacing the app-data uploads and downloads of the devices
+        self.bandwidth_shaper = None
+        # Optional TimingStore recording the phase durations of the reported devices for the later estimates
+        self.timing_store = None
+        try:
+            app_migration_data_dir = os.path.join(os.environ['APP_MIGRATION_DATA_DIR'])
+        except KeyError as e:
+            app_migration_data_dir = os.path.abspath('./archive')
+        self.upload_manifests = manifest.UploadManifestStore(os.path.join(app_migration_data_dir, 'upload_manifests'))
         self.api = api.ApiConnection(self.api_server, self.api_prefix, self.api_user, self.api_password, self.auth_type,
                                      self.use_https, self.ssl_verify, self.port, log_id='AppMigration')
 
@@ -131,8 +209,12 @@ class AppMigration:
                     logger.info(f'\tFound device IP{row[0]} with device name {row[1]}')
                     device_ip = row[0] if row[0] != "" else None
                     device_name = row[1] if row[1] != "" else None
-                    device_details = self.api.fetch_device_details(device_ip=device_ip, device_name=device_name,
-                                                                   device_tag=None)
+                    if self.device_resolver is not None:
+                        device = self.device_resolver.resolve(device_ip=device_ip, device_name=device_name)
+                        device_details = {'data': [device] if device else []}
+                    else:
+                        device_details = self.api.fetch_device_details(device_ip=device_ip, device_name=device_name,
+                                                                       device_tag=None)
                     self.parse_device_details(device_details)
                     line_count += 1
                     print(f'Processed {line_count} lines.')
@@ -190,6 +272,51 @@ class AppMigration:
                 return app
         return None
 
+    def find_migrated_app(self, app: Application):
+        """Returns the IoT-OD record of the app when it is already installed on the current device in the state the
+        migration would leave it: the managed app of the same version, running unless the apps are not started, with
+        the GMM app config when the device reports its config.
+
+        :return: dict or None
+        """
+        managed_app_id = None
+        for installed_app in self.device.installed_apps:
+            if installed_app.get('name') != app.app_name or installed_app.get('version') != app.app_version:
+                continue
+            managed_app_id = managed_app_id or self.get_imported_app_id(app.app_name)
+            if not is_migrated_app(installed_app, app.app_name, app.app_version, managed_app_id,
+                                   self.skip_starting_app):
+                continue
+            try:
+                app_details = self.api.get_app_details_from_device(self.device.device_id, installed_app.get('appId'),
+                                                                   app.app_version) or {}
+            except Exception as err:
+                logger.warning(f"Could not read the application {app.app_name} on the device "
+                               f"{self.device.serial_number}, it will be migrated again: {err}")
+                continue
+            if app_details.get('config') is not None and not same_app_config(app_details['config'], app.app_config):
+                logger.info(f"The application {app.app_name} on the device {self.device.serial_number} does not "
+                            f"have the GMM app config")
+                continue
+            return installed_app
+        return None
+
+    def skip_if_migrated(self, app: Application):
+        """ Mark the app as skipped when it is already migrated on the current device
+
+        :return: True if the app is skipped
+        """
+        installed_app = self.find_migrated_app(app)
+        if installed_app is None:
+            return False
+        logger.info(f"The application {app.app_name} version {app.app_version} is already migrated on the device "
+                    f"{self.device.serial_number}, skipping it")
+        app.imported_app_id = installed_app.get('appId')
+        app.deploy_status = "Skipped"
+        app.deploy_status_msg = "Already migrated"
+        app.operational_status = installed_app.get('status')
+        return True
+
     def parse_gmm_device_info(self, gmm_device_info):
         logger.info(f"Parsing GMM device json file {self.device.serial_number}.json...")
         # Get the gmm-data tar package
@@ -204,6 +331,8 @@ class AppMigration:
         gmm_apps_dir = os.path.join(gmm_data_file_dir, 'apps')
 
         for data in gmm_device_info:
+            if not self.device.model:
+                self.device.model = (data.get('gate_way') or {}).get('model')
             app = data.get('fog_application')
             if app:
                 app_obj = self.get_app_present_in_device(app)
@@ -234,6 +363,8 @@ class AppMigration:
                                             f"so make sure you have already imported the app in IOT-OD!")
                         application.app_config, application.resource_config = self.get_and_format_gmm_config(data,
                                                                                                              application)
+                        if self.skip_migrated_apps:
+                            self.skip_if_migrated(application)
                         self.device.applications.append(application)
                     except NameError as err:
                         logger.error(f"Managed application not found for the app {application.gmm_formatted_app_name}!")
@@ -246,6 +377,8 @@ class AppMigration:
             self.device = Device(device_info['deviceId'], device_info['ipAddress'], device_info['port'],
                                  device_info['serialNumber'], device_info['hostname'], device_info['status'],
                                  profile_name=profile_name)
+            self.device.installed_apps = device_info.get('apps') or []
+            self.device.model = device_info.get('deviceType') or device_info.get('model')
             for app in device_info['apps']:
                 application = Application(app['appId'], app['name'], self.format_app_name(app['name']), 'docker',
                                           app['version'], app['status'])
@@ -274,8 +407,20 @@ class AppMigration:
             # Reset the current migration device record
             self.device = None
 
+    def load_catalog(self, catalog):
+        """ Use an IoT-OD app catalog snapshot for all app lookups instead of searching the apps one by one """
+        self.catalog = catalog
+        # The snapshot does not change during the run, an app missing from it stays missing
+        self.resource_descriptors.clear(miss_ttl=None)
+
+    def load_device_resolver(self, device_resolver):
+        """ Use an index of the IoT-OD device inventory to find the devices instead of searching them one by one """
+        self.device_resolver = device_resolver
+
     def is_managed_app_exists(self, app_name):
         """ Look for managed app with respect to an unmanaged app in IOT-OD if not present then return False"""
+        if self.catalog is not None:
+            return self.catalog.is_managed(app_name)
         app_details = self.api.search_app_details(app_name)
         if len(app_details['data']):
             for app in app_details['data']:
@@ -285,6 +430,8 @@ class AppMigration:
 
     def is_unmanaged_app(self, app_name):
         """ Check that an app is unmanaged in the device or not """
+        if self.catalog is not None:
+            return self.catalog.is_unmanaged(app_name)
         app_details = self.api.search_app_details(app_name)
         if len(app_details['data']):
             for app in app_details['data']:
@@ -340,15 +487,12 @@ class AppMigration:
 
         gmm_app_details_dir = os.path.join(gmm_data_dir, 'gmm_app_details')
         logger.info(f"GMM export details data directory: {gmm_app_details_dir}")
-        gmm_devices = []
-        for file_name in os.listdir(os.path.join(gmm_app_details_dir, 'devices')):
-            serial_no = file_name.strip('.json')
-            devices = self.api.fetch_device_details(device_ip=None, device_name=None, device_tag=None,
-                                                    serial_number=serial_no)
-            for device in devices.get('data', []):
-                if device['serialNumber'] == serial_no:
-                    gmm_devices.append(device)
-                    break
+        serial_numbers = [file_name[:-len('.json')] for file_name in
+                          os.listdir(os.path.join(gmm_app_details_dir, 'devices')) if file_name.endswith('.json')]
+        if self.device_resolver is None:
+            self.load_device_resolver(DeviceResolver.from_api(self.api))
+        gmm_devices, unmatched = self.device_resolver.resolve_serial_numbers(serial_numbers)
+        logger.info(f"Found {len(gmm_devices)} of the {len(serial_numbers)} GMM exported devices in IOT-OD")
         return gmm_devices
 
     def get_target_devices(self, device_ip=None, device_name=None, device_tag=None, device_csv=None):
@@ -386,9 +530,12 @@ class AppMigration:
             a `list` of all devices where application need to installed
         """
         if device_ip or serial_number:
-            device_details = self.api.fetch_device_details(device_ip=device_ip, device_name=None,
-                                                           device_tag=None, port=port, serial_number=serial_number)
-            device = device_details.get('data')[0] if len(device_details.get('data')) else None
+            if self.device_resolver is not None:
+                device = self.device_resolver.resolve(serial_number=serial_number, device_ip=device_ip, port=port)
+            else:
+                device_details = self.api.fetch_device_details(device_ip=device_ip, device_name=None,
+                                                               device_tag=None, port=port, serial_number=serial_number)
+                device = device_details.get('data')[0] if len(device_details.get('data')) else None
             if device is None:
                 logger.info(f"No device found with ip {device_ip} or serial number {serial_number}!")
             self.parse_device_info(device, profile_name)
@@ -418,10 +565,10 @@ class AppMigration:
 
         logger.info(f"App Migration Data Directory: {gmm_data_dir}")
         safe_makedirs(gmm_data_dir)
-        logger.info('Executing the command: tar -xzvf {0} -C {1}'.format(gmm_app_tar, gmm_data_dir))
-        exit_code = os.system('tar -xzvf {0} -C {1}'.format(gmm_app_tar, gmm_data_dir))
-        if exit_code:
-            logger.error(f"Error occurred on extracting the gmm-data tar file: {gmm_data_dir}")
+        try:
+            archive.extract_tarfile(gmm_app_tar, gmm_data_dir)
+        except (IOError, tarfile.TarError) as err:
+            logger.error(f"Error occurred on extracting the gmm-data tar file: {gmm_data_dir}\n {err}")
             raise Exception("File Extract error!")
 
     def read_app_config(self, app_config_file: str, device_id: str, application: Application):
@@ -457,7 +604,7 @@ class AppMigration:
             logger.warning(f"No application config found for the app {application.gmm_formatted_app_name}")
         return config_data
 
-    def build_deploy_payload(self, resource, policy, app_config_data={}, start_app=True):
+    def build_deploy_payload(self, resource, policy, app_config_data={}, start_app=True, device_ids=None):
         policy.update({
             "_valid": True,
             "_childScope": "$SCOPE",
@@ -479,21 +626,21 @@ class AppMigration:
                 "startApp": start_app,
                 "devices": [
                     {
-                        "deviceId": self.device.device_id,
+                        "deviceId": device_id,
                         "resourceAsk": {
                             "resources": resource,
                             "startup": {
                                 "runtime_options": "--rm"
                             }
                         }
-                    }
+                    } for device_id in (device_ids or [self.device.device_id])
                 ]
             },
             "policy": policy
         }
         return deploy_payload
 
-    def build_undeploy_payload(self, policy):
+    def build_undeploy_payload(self, policy, device_ids=None):
         policy.update({
             "_valid": True,
             "_childScope": "$SCOPE",
@@ -505,9 +652,7 @@ class AppMigration:
         })
         deploy_payload = {
             "undeploy": {
-                "devices": [
-                    self.device.device_id
-                ]
+                "devices": device_ids or [self.device.device_id]
             },
             "policy": policy
         }
@@ -553,9 +698,23 @@ class AppMigration:
                 self.ioxclient.clear_working_dir(app.app_name)
                 self.ioxclient.disconnect()
 
-    def export_app_data(self):
-        """ Exporting the app data from each unmanaged applications in IOT-OD """
-        for app in self.device.applications:
+    def scope_app_data_to_device(self, device=None):
+        """ Name the app-data files of the current or given device after its serial number so that the exported data
+        of several devices can be kept on disk at the same time """
+        device = device or self.device
+        for app in device.applications:
+            app.app_data_file_name = f'{app.app_name}-{device.serial_number}-datamount.tar.gz'
+
+    def export_app_data(self, device=None):
+        """ Exporting the app data from each unmanaged applications in IOT-OD
+
+        :param device: device whose app data is exported, by default the current device
+        :return: number of bytes written
+        """
+        device = device or self.device
+        throttle = self.bandwidth_shaper.throttle_for(device) if self.bandwidth_shaper else None
+        size_bytes = 0
+        for app in device.applications:
             try:
                 app_data_dir = os.path.join(os.environ['APP_MIGRATION_DATA_DIR'], app.app_name)
             except KeyError as e:
@@ -564,16 +723,36 @@ class AppMigration:
             try:
                 logger.info(f"App Migration Data Directory: {app_data_dir}")
                 logger.info(f"Starting app data export for the application {app.gmm_formatted_app_name}...")
-                data = self.api.download_app_data(self.device.device_id, app.app_id, app.app_version)
-                if data:
-                    with open(os.path.join(app_data_dir, app.app_data_file_name), 'wb') as f:
-                        f.write(data)
+                with self.trace_phase(PHASE_EXPORT_DATA, [app], serial_number=device.serial_number,
+                                      app_name=app.app_name, app_version=app.app_version):
+                    data = self.api.download_app_data(device.device_id, app.app_id, app.app_version,
+                                                      throttle=throttle)
+                    if data:
+                        with open(os.path.join(app_data_dir, app.app_data_file_name), 'wb') as f:
+                            f.write(data)
+                        size_bytes += len(data)
+                        add_phase_bytes(app, PHASE_EXPORT_DATA, len(data))
             except IOError as err:
                 logger.error("Not able to create app data tar file due to IO error!")
             except Exception as err:
                 logger.error("Some error occurred while downloading the app data!")
 
-        pass
+        return size_bytes
+
+    @staticmethod
+    def remove_app_data(device):
+        """ Delete the exported app-data files of a device and their extracted copies once it has been migrated """
+        for app in device.applications:
+            try:
+                app_data_dir = os.path.join(os.environ['APP_MIGRATION_DATA_DIR'], app.app_name)
+            except KeyError as e:
+                app_data_dir = os.path.abspath(os.path.join('./archive/apps', app.app_name))
+            shutil.rmtree(os.path.join(app_data_dir, 'app_data', app.app_data_file_name.replace('.tar.gz', '')),
+                          ignore_errors=True)
+            try:
+                os.remove(os.path.join(app_data_dir, app.app_data_file_name))
+            except FileNotFoundError:
+                pass
 
     def get_imported_app_id(self, imported_app_name: str):
         """ Get the newly imported application id which can be used when deploy the app
@@ -582,24 +761,52 @@ class AppMigration:
 
         :return: str
         """
+        if self.catalog is not None:
+            app = self.catalog.find_app(imported_app_name)
+            return app['appId'] if app else None
         search_result = self.api.search_app_details(imported_app_name)
         if len(search_result['data']):
             for app in search_result['data']:
                 if app['name'] == imported_app_name:
                     return app['appId']
 
-    def find_app_info(self, app_name: str):
+    def find_app_info(self, app_name: str, app_version: str = None):
         """ Get the managed app details which can be used when deploy the app
 
         :param app_name: search with application name in all existing apps
+        :param app_version: prefer the app record of this version, the first record of the name is returned otherwise
 
-        :return: dict
+        :return: dict, shared with the app catalog so it must not be changed
         """
-        search_result = self.api.search_app_details(app_name)
-        if len(search_result['data']):
-            for app in search_result['data']:
-                if app['name'] == app_name:
+        if self.catalog is not None:
+            apps = self.catalog.apps_by_name.get(app_name, [])
+        else:
+            apps = [app for app in self.api.search_app_details(app_name)['data'] if app['name'] == app_name]
+        if app_version:
+            for app in apps:
+                if app.get('version') == app_version:
                     return app
+        return apps[0] if apps else None
+
+    def poll_before_deadline(self, executor, step, function, *args):
+        """ Run one poll request in the executor and wait for it until the deadline of the current device at most,
+        a hung request is abandoned once the deadline is spent """
+        future = executor.submit(function, *args)
+        if self.deadline is None:
+            return future.result()
+        try:
+            return future.result(timeout=self.deadline.remaining())
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.deadline.check(step)
+            raise DeviceTimeoutError(f"Poll request of the {step} did not answer before the device deadline")
+
+    def wait_before_poll(self, seconds, step):
+        """ Sleep between two polls, raise DeviceTimeoutError as soon as the deadline of the current device is spent """
+        if self.deadline is None:
+            sleep(seconds)
+        else:
+            self.deadline.wait(seconds, step)
 
     def track_job_status(self, job_id: int):
         """ Poll a job every 5 secs to check the status of the job and return the status.
@@ -608,14 +815,17 @@ class AppMigration:
 
         :return: status
         """
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        # Not a context manager, leaving it would wait for a poll request abandoned at the device deadline
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
             tick = time()
             while int(time() - tick) < self.MAX_TIMEOUT:
-                future = executor.submit(self.api.get_job_details, job_id)
-                job_details = future.result()
+                job_details = self.poll_before_deadline(executor, f'job {job_id}', self.api.get_job_details, job_id)
                 if job_details['status'] == 'COMPLETED':
                     return job_details['status']
-                sleep(10)
+                self.wait_before_poll(10, f'job {job_id}')
+        finally:
+            executor.shutdown(wait=False)
 
         return 'TIMEOUT'
 
@@ -627,16 +837,19 @@ class AppMigration:
 
         :return: status
         """
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
             tick = time()
             while int(time() - tick) < wait_timeout:
-                future = executor.submit(self.get_app_operational_status, app)
-                app_details = future.result()
+                app_details = self.poll_before_deadline(executor, f'verification of {app.app_name}',
+                                                        self.get_app_operational_status, app)
                 if app_details.get('operationalStatus', 'UNKNOWN') not in ['DEPLOYED', 'UNKNOWN']:
                     if app_details.get('status') != "RUNNING":
                         app.deploy_status_msg = app_details.get('message', '')
                     return app_details.get('status')
-                sleep(5)
+                self.wait_before_poll(5, f'verification of {app.app_name}')
+        finally:
+            executor.shutdown(wait=False)
         app.deploy_status_msg = app_details.get('message', '')
         return 'DEPLOY_FAILED'
 
@@ -654,16 +867,18 @@ class AppMigration:
         logger.info(f"App Migration Data Directory: {app_data_dir}")
         app_data_tar = os.path.join(app_data_dir, application.app_data_file_name)
         logger.info(f'looking for app-data tar file for application {application.app_name} is {app_data_tar}')
-        safe_makedirs(os.path.join(app_data_dir, 'app_data'))
-        logger.info('Executing the command: tar -xzvf {0} -C {1}'.format(app_data_tar, os.path.join(app_data_dir,
-                                                                                                    'app_data')))
-        exit_code = os.system('tar -xzvf {0} -C {1}'.format(app_data_tar, os.path.join(app_data_dir, 'app_data')))
-        if exit_code:
-            logger.error(f"Error occurred on extracting the app-data tar file: {app_data_tar}")
+        # Extract every data tar in its own clean directory so files of a previous device are never uploaded again
+        extract_path = os.path.join(app_data_dir, 'app_data', application.app_data_file_name.replace('.tar.gz', ''))
+        shutil.rmtree(extract_path, ignore_errors=True)
+        safe_makedirs(extract_path)
+        try:
+            archive.extract_tarfile(app_data_tar, extract_path)
+        except (IOError, tarfile.TarError) as err:
+            logger.error(f"Error occurred on extracting the app-data tar file: {app_data_tar}\n {err}")
             raise Exception("File Extract error!")
 
-        logger.info(f"The app-data tar {app_data_tar} has been extracted to {os.path.join(app_data_dir, 'app_data')}")
-        return os.path.join(app_data_dir, 'app_data')
+        logger.info(f"The app-data tar {app_data_tar} has been extracted to {extract_path}")
+        return extract_path
 
     @staticmethod
     def find_app_data_path(app_path: str):
@@ -675,25 +890,20 @@ class AppMigration:
 
     def get_and_format_gmm_config(self, app_detail, app):
         logger.info("Formatting gmm app config to IOx api compatible format...")
-        app_config = defaultdict(dict)
+        app_config = format_gmm_app_config(app_detail)
         resource_config = dict()
-        if 'app_specific_params' in app_detail:
-            for config_data in app_detail['app_specific_params']:
-                app_config[config_data['section']].update({
-                    config_data['key']: config_data['value']
-                })
-        logger.info(f"Gmm app config has been successfully formatted as bellow: \n {dict(app_config)}")
+        logger.info(f"Gmm app config has been successfully formatted as bellow: \n {app_config}")
         logger.info("Formatting gmm resource config to IOx api compatible format...")
-        response = self.find_app_info(app.app_name)
-        if response:
-            app_info = response['descriptor']['app']
-            resource_config = app_info.get('resources')
+        descriptor_resources = self.resource_descriptors.get(app.app_name, app.app_version)
+        if descriptor_resources is not None:
+            # Only the GMM overrides are built here, the descriptor itself is shared by all the installs of the app
+            resource_config = {}
             if 'resources' in app_detail:
                 resource_config['profile'] = app_detail['resources'].get('resource_profile',
-                                                                         resource_config.get('profile'))
-                resource_config['cpu'] = app_detail['resources'].get('resource_cpu', resource_config.get('cpu'))
+                                                                         descriptor_resources.get('profile'))
+                resource_config['cpu'] = app_detail['resources'].get('resource_cpu', descriptor_resources.get('cpu'))
                 resource_config['memory'] = app_detail['resources'].get('resource_memory',
-                                                                        resource_config.get('memory'))
+                                                                        descriptor_resources.get('memory'))
 
                 if 'interface_name' in app_detail['resources']:
                     resource_config['interface-name'] = app_detail['resources'].get('interface_name')
@@ -719,6 +929,7 @@ class AppMigration:
                                         interface.get('udp', [])}
                             }
                         })
+            resource_config = self.resource_descriptors.overlay(descriptor_resources, resource_config)
 
         return dict(app_config), resource_config
 
@@ -756,14 +967,15 @@ class AppMigration:
             app_config, resource_config = self.get_and_format_gmm_config(json.load(data_file), app)
             return app_config, resource_config
 
-    def import_app(self, **kwargs):
-        """Import the application to iot-od with app-config and app data.
+    def prepare_import(self):
+        """Read the GMM exported installation json file of the current device and add the GMM app config and resource
+        config to the device applications.
 
-        :return: None
+        :return: False if there is no current device
         """
         if self.device is None:
             logger.info(f"As no devices present so stopping migration...")
-            return
+            return False
         if self.device and len(self.device.applications) == 0:
             logger.info(f"There is no application installed in the device with device serial# {self.device.serial_number}")
 
@@ -781,99 +993,29 @@ class AppMigration:
         logger.info(f"Gmm exported devices details directory: {gmm_device_dir}")
         with open(os.path.join(gmm_device_dir, f"{self.device.serial_number}.json")) as device_file:
             self.parse_gmm_device_info(json.load(device_file))
+        return True
+
+    def import_app(self, **kwargs):
+        """Import the application to iot-od with app-config and app data.
+
+        :return: None
+        """
+        if not self.prepare_import():
+            return
+        if self.app_concurrency > 1 or self.app_dependencies:
+            self.import_apps_concurrently(self.device.applications, **kwargs)
+            logger.info("Import Finished!")
+            return
 
         for app in self.device.applications:
+            if app.deploy_status == "Skipped":
+                continue
+            if self.deadline:
+                self.deadline.check(f'the import of {app.app_name}')
             try:
-                # Get the app tar package
-                try:
-                    gmm_data_dir = os.path.join(os.environ['APP_MIGRATION_DATA_DIR'], 'gmm_app_details')
-                    app_data_dir = os.path.join(os.environ['APP_MIGRATION_DATA_DIR'], app.app_name)
-                except KeyError as e:
-                    # logger.warning(str(e) + " is non-existent")
-                    gmm_data_dir = os.path.join(os.path.abspath('./archive'), 'gmm_app_details')
-                    app_data_dir = os.path.abspath(os.path.join('./archive/apps', app.app_name))
-                app_tar_package = os.path.join(app_data_dir, app.import_package_name)
-                # app_config_file = os.path.join(app_data_dir, app.app_config_file_name)
-                # app_config_data = self.read_app_config(app_config_file, self.device.device_id, app)
-                app_config_data, resource_config = app.app_config, app.resource_config if app.resource_config else \
-                    self.get_gmm_resource_config_for_app(app)
-                app_data_path = None
-                try:
-                    if not self.skip_data_migration:
-                        app_data_extract_path = self.extract_app_data(app)
-                        app_data_path = self.find_app_data_path(app_data_extract_path)
-                        logger.info(f"Found app-data for the application {app.app_name} in: {app_data_path}")
-
-                except FileExistsError as err:
-                    logger.warning(f'Tar file does not exists for the application {app.app_name}')
-                    logger.exception(traceback.format_exc())
-                except OSError as e:
-                    logger.warning(f'App data not found for the application {app.app_name}')
-                    logger.exception(traceback.format_exc())
-
-                # response = self.api.upload_app(app.app_type, app_tar_package)
-                response = self.find_app_info(app.app_name)
-                # Form the payload for deploying the application
-                if response:
-                    # app_info = response['descriptor']['app']
-                    policy = self.api.get_default_policy()
-                    if len(policy):
-                        policy = policy[0]
-                        if app.need_uninstall:
-                            logger.info("Unmanaged app is founded in the device.")
-                            logger.info("Uninstalling the unmanaged app from device...")
-                            undeploy_payload = self.build_undeploy_payload(policy)
-                            undeploy_response = self.api.undeploy_app(app.app_id, app.app_version, undeploy_payload)
-                            undeploy_status = self.track_job_status(undeploy_response['jobId'])
-                            if undeploy_status == 'TIMEOUT':
-                                logger.error('Uninstallation timeout error occurred with max time limit of 30 minutes '
-                                             f'for the app {app.gmm_formatted_app_name}')
-                                app.deploy_status = "Failed"
-                                app.deploy_error = "Timeout error happened on uninstall"
-                                raise TimeoutError("Timeout error occurred!")
-                            logger.info(f'Uninstallation successful for the application {app.gmm_formatted_app_name}')
-
-                        logger.info("Being ready for installation...")
-                        deploy_payload = self.build_deploy_payload(resource_config, policy, app_config_data,
-                                                                   not self.skip_starting_app)
-                        # Get the new imported app id
-                        app.imported_app_id = self.get_imported_app_id(app.app_name)
-                        deploy_response = self.api.deploy_app(app.imported_app_id, app.app_version, deploy_payload)
-                        # track the deployment status
-                        deploy_status = self.track_job_status(deploy_response['jobId'])
-                        if deploy_status == 'TIMEOUT':
-                            logger.error('Deployment timeout error occurred with max time limit of 30 minutes for '
-                                         f'the app {app.app_name}')
-                            app.deploy_status = "Failed"
-                            app.deploy_error = "Timeout error happened on install!"
-                            raise TimeoutError("Timeout error occurred!")
-                        logger.info(f'Deployment successful for the application {app.app_name}')
-                        if not self.skip_data_migration and app_data_path:
-                            logger.info(f"Starting data migration for the application {app.app_name}...")
-                            logger.info(f"Starting app-data upload for the application {app.app_name}")
-                            logger.info(f"App-data file path: {app_data_path}")
-                            for dir_path, dir_names, file_names in os.walk(app_data_path):
-                                for filename in file_names:
-                                    logger.info(f'Uploading the file {os.path.join(dir_path, filename)}..')
-                                    file_path = dir_path.replace(app_data_path, './').replace("\\", "/")
-                                    self.api.upload_app_data(self.device.device_id, app.imported_app_id, app.app_version,
-                                                             os.path.join(dir_path, filename),
-                                                             filepath=file_path if file_path != '' else None,
-                                                             new_file_name=filename)
-                            logger.info(f"App data upload completed for the application {app.app_name}")
-                        app.deploy_status = "Passed"
-                        app.operational_status = self.track_app_operational_status(app,
-                                                                                   wait_timeout=kwargs.get(
-                                                                                       'max_wait_time', 300))
-                    else:
-                        logger.error("No Fog director policy found!")
-                        app.deploy_status = "Failed"
-                        app.deploy_error = "No Fog director policy found!"
-                else:
-                    logger.error(f"Application details not found for the app {app.app_name}")
-                    app.deploy_status = "Failed"
-                    app.deploy_error = f"Managed application not found with the app name {app.app_name}"
-                    raise Exception("Import Error")
+                self.import_application(app, **kwargs)
+            except DeviceTimeoutError:
+                raise
             except NameError as e:
                 logger.error(f"Was not able to import the app with name {app.app_name}")
                 app.deploy_status = "Failed"
@@ -889,7 +1031,421 @@ class AppMigration:
                                     "is present")
         logger.info("Import Finished!")
 
-    def export_gmm_app(self):
+    def import_apps_concurrently(self, apps, **kwargs):
+        """Import the apps of the current device with up to `app_concurrency` apps in flight.
+
+        An app is started once the apps returned for it by the `app_dependencies` hook are imported, and fails
+        without being started when one of them failed. When an import fails and `continue_on_error` is not set no
+        other app is started and the error is raised once the running imports are done, the same goes for the
+        `DeviceTimeoutError` of the device deadline.
+
+        :param apps: applications of the current device
+        """
+        dependencies = {id(app): [dependency for dependency in self.app_dependencies(app, apps)
+                                  if dependency is not app] if self.app_dependencies else [] for app in apps}
+        pending = [app for app in apps if app.deploy_status != "Skipped"]
+        running, failed = {}, set()
+        finished = {id(app) for app in apps if app.deploy_status == "Skipped"}
+        fatal_app, timeout_error = None, None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.app_concurrency),
+                                                   thread_name_prefix='app-import') as executor:
+            while True:
+                for app in list(pending) if fatal_app is None and timeout_error is None else []:
+                    failed_dependencies = [dependency for dependency in dependencies[id(app)]
+                                           if id(dependency) in failed]
+                    if failed_dependencies:
+                        pending.remove(app)
+                        logger.error(f"Not importing the application {app.app_name} as the application "
+                                     f"{failed_dependencies[0].app_name} it depends on failed")
+                        app.deploy_status = "Failed"
+                        app.deploy_error = f"Dependency {failed_dependencies[0].app_name} failed"
+                        failed.add(id(app))
+                    elif all(id(dependency) in finished for dependency in dependencies[id(app)]):
+                        pending.remove(app)
+                        running[executor.submit(self.import_application, app, **kwargs)] = app
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    app = running.pop(future)
+                    finished.add(id(app))
+                    error = future.exception()
+                    if isinstance(error, DeviceTimeoutError):
+                        timeout_error = timeout_error or error
+                        continue
+                    if isinstance(error, NameError):
+                        logger.error(f"Was not able to import the app with name {app.app_name}")
+                        app.deploy_status = "Failed"
+                        app.deploy_error = "Was not able to import the app"
+                    elif error is not None:
+                        logger.error(f"Error occurred on import of the application {app.app_name}")
+                        app.deploy_status = "Failed"
+                        app.deploy_error = f"Error occurred on import of the application {app.app_name}"
+                        if not self.continue_on_error and fatal_app is None:
+                            fatal_app = app
+                    if error is not None:
+                        logger.error(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+                    if app.deploy_status == "Failed":
+                        failed.add(id(app))
+        if timeout_error is not None:
+            raise timeout_error
+        if fatal_app is not None:
+            raise Exception("Error occurred during application data import! make sure that exported data "
+                            "is present")
+        for app in pending:
+            logger.error(f"Not importing the application {app.app_name} as its dependencies form a cycle")
+            app.deploy_status = "Failed"
+            app.deploy_error = "Dependency cycle"
+
+    def get_app_import_config(self, app: Application):
+        """ Returns the app config and resource config used to deploy the application """
+        # app_config_file = os.path.join(app_data_dir, app.app_config_file_name)
+        # app_config_data = self.read_app_config(app_config_file, self.device.device_id, app)
+        app_config_data, resource_config = app.app_config, app.resource_config if app.resource_config else \
+            self.get_gmm_resource_config_for_app(app)
+        return app_config_data, resource_config
+
+    def get_app_data_path(self, app: Application):
+        """ Extract the exported app-data of the application and return the `appdata` directory path if present """
+        app_data_path = None
+        try:
+            if not self.skip_data_migration:
+                with self.trace_phase(PHASE_EXTRACT_DATA, [app]):
+                    app_data_extract_path = self.extract_app_data(app)
+                    app_data_path = self.find_app_data_path(app_data_extract_path)
+                logger.info(f"Found app-data for the application {app.app_name} in: {app_data_path}")
+
+        except FileExistsError as err:
+            logger.warning(f'Tar file does not exists for the application {app.app_name}')
+            logger.exception(traceback.format_exc())
+        except OSError as e:
+            logger.warning(f'App data not found for the application {app.app_name}')
+            logger.exception(traceback.format_exc())
+        return app_data_path
+
+    def import_application(self, app: Application, **kwargs):
+        """ Uninstall the unmanaged copy, deploy the managed app, upload the app data and wait for the app status """
+        app_config_data, resource_config = self.get_app_import_config(app)
+        app_data_path = self.get_app_data_path(app)
+
+        # response = self.api.upload_app(app.app_type, app_tar_package)
+        # Form the payload for deploying the application
+        if self.resource_descriptors.get(app.app_name, app.app_version) is not None:
+            # app_info = response['descriptor']['app']
+            policy = self.api.get_default_policy()
+            if len(policy):
+                policy = policy[0]
+                managed_app_id, deployment = self.find_unfinished_deployment(app, app_config_data, resource_config)
+                if app.need_uninstall and deployment is None:
+                    logger.info("Unmanaged app is founded in the device.")
+                    logger.info("Uninstalling the unmanaged app from device...")
+                    with self.trace_phase(PHASE_UNINSTALL, [app]):
+                        undeploy_status = self.undeploy_on_devices(app.app_id, app.app_version, policy,
+                                                                   [self.device.device_id])
+                    if undeploy_status == 'TIMEOUT':
+                        logger.error('Uninstallation timeout error occurred with max time limit of 30 minutes '
+                                     f'for the app {app.gmm_formatted_app_name}')
+                        app.deploy_status = "Failed"
+                        app.deploy_error = "Timeout error happened on uninstall"
+                        raise TimeoutError("Timeout error occurred!")
+                    logger.info(f'Uninstallation successful for the application {app.gmm_formatted_app_name}')
+
+                if deployment is None:
+                    logger.info("Being ready for installation...")
+                    with self.trace_phase(PHASE_DEPLOY, [app]):
+                        app.imported_app_id, deploy_status, job_id = self.deploy_on_devices(
+                            app, policy, app_config_data, resource_config, [self.device.device_id],
+                            imported_app_id=managed_app_id)
+                    if deploy_status == 'TIMEOUT':
+                        logger.error('Deployment timeout error occurred with max time limit of 30 minutes for '
+                                     f'the app {app.app_name}')
+                        app.deploy_status = "Failed"
+                        app.deploy_error = "Timeout error happened on install!"
+                        raise TimeoutError("Timeout error occurred!")
+                    logger.info(f'Deployment successful for the application {app.app_name}')
+                if not self.skip_data_migration and app_data_path:
+                    if deployment is None:
+                        # A new deployment starts with empty app data
+                        self.upload_manifests.start(self.device.device_id, app.imported_app_id, app.app_version,
+                                                    deployment_id(job_id, app_config_data, resource_config))
+                    with self.trace_phase(PHASE_UPLOAD_DATA, [app]):
+                        self.upload_application_data(app, app_data_path)
+                    self.upload_manifests.complete(self.device.device_id, app.imported_app_id, app.app_version)
+                app.deploy_status = "Passed"
+                if self.verification_sweep is None:
+                    with self.trace_phase(PHASE_VERIFY, [app]):
+                        app.operational_status = self.track_app_operational_status(app,
+                                                                                   wait_timeout=kwargs.get(
+                                                                                       'max_wait_time', 300))
+            else:
+                logger.error("No Fog director policy found!")
+                app.deploy_status = "Failed"
+                app.deploy_error = "No Fog director policy found!"
+        else:
+            logger.error(f"Application details not found for the app {app.app_name}")
+            app.deploy_status = "Failed"
+            app.deploy_error = f"Managed application not found with the app name {app.app_name}"
+            raise Exception("Import Error")
+
+    @contextmanager
+    def trace_phase(self, phase, apps, **attributes):
+        """Time a migration phase as a tracer span and add its duration to the phase times of the given apps.
+
+        :param phase: one of the `PHASE_*` names
+        :param apps: applications the phase is done for, a grouped job counts its full duration for every app
+        :param attributes: span attributes, by default the serial number of the current device and the app
+        """
+        if not attributes:
+            if self.device:
+                attributes['serial_number'] = self.device.serial_number
+            if len(apps) == 1:
+                attributes.update(app_name=apps[0].app_name, app_version=apps[0].app_version)
+        tick = perf_counter()
+        try:
+            with self.tracer.span(phase, **attributes) as span:
+                yield span
+        finally:
+            elapsed = perf_counter() - tick
+            for app in apps:
+                if app.phase_seconds is None:
+                    app.phase_seconds = {}
+                app.phase_seconds[phase] = app.phase_seconds.get(phase, 0.0) + elapsed
+
+    def count_running_jobs(self):
+        """ Number of IoT-OD jobs which are still running, the backlog of the uninstall and deploy actions """
+        response = self.api.list_jobs(status='RUNNING', limit=100) or {}
+        return response.get('totalCount', len(response.get('data', [])))
+
+    def undeploy_on_devices(self, app_id: str, app_version: str, policy, device_ids: list):
+        """ Submit one uninstall action of the app for all the given devices and wait for the job to finish """
+        undeploy_payload = self.build_undeploy_payload(policy, device_ids)
+        undeploy_response = self.api.undeploy_app(app_id, app_version, undeploy_payload)
+        return self.track_job_status(undeploy_response['jobId'])
+
+    def deploy_on_devices(self, app: Application, policy, app_config_data, resource_config, device_ids: list,
+                          imported_app_id=None):
+        """Submit one deploy action of the managed app for all the given devices and wait for the job to finish.
+
+        :param imported_app_id: id of the managed app when it was already looked up, searched by name otherwise
+
+        :return: imported app id, the job status and the job id
+        """
+        deploy_payload = self.build_deploy_payload(resource_config, policy, app_config_data,
+                                                   not self.skip_starting_app, device_ids=device_ids)
+        # Get the new imported app id
+        imported_app_id = imported_app_id or self.get_imported_app_id(app.app_name)
+        deploy_response = self.api.deploy_app(imported_app_id, app.app_version, deploy_payload)
+        # track the deployment status
+        return imported_app_id, self.track_job_status(deploy_response['jobId']), deploy_response['jobId']
+
+    def find_unfinished_deployment(self, app: Application, app_config_data, resource_config):
+        """Returns the deployment of the app on the current device whose app-data upload was started by an earlier
+        attempt or run and did not finish, when the app is still deployed there with the same config, so the upload
+        resumes without deploying the app again.
+
+        :return: id of the managed app when it was looked up, None otherwise, and the deployment id of the upload
+            manifest or None
+        """
+        # Nothing to resume, the managed app id is searched only when the device has upload manifests
+        if self.skip_data_migration or not self.upload_manifests.has_manifests(self.device.device_id):
+            return None, None
+        managed_app_id = self.get_imported_app_id(app.app_name)
+        if not managed_app_id:
+            return None, None
+        deployment = self.upload_manifests.deployment(self.device.device_id, managed_app_id, app.app_version)
+        if deployment is None or deployment.get('config') != config_digest(app_config_data, resource_config):
+            return managed_app_id, None
+        try:
+            if not self.api.get_app_details_from_device(self.device.device_id, managed_app_id, app.app_version):
+                return managed_app_id, None
+        except Exception as err:
+            logger.warning(f"The application {app.app_name} of the unfinished upload is not on the device "
+                           f"{self.device.serial_number}, it will be deployed again: {err}")
+            return managed_app_id, None
+        logger.info(f"Resuming the app-data upload of the application {app.app_name} to its deployment "
+                    f"{deployment.get('job_id')} on the device {self.device.serial_number}")
+        app.imported_app_id = managed_app_id
+        return managed_app_id, deployment
+
+    def upload_application_data(self, app: Application, app_data_path: str):
+        """Upload the files of the extracted `appdata` directory to the app on the current device.
+
+        Files whose hash and size match the manifest of a previous upload to the same deployment are skipped, so
+        retries and reruns only send the files that are missing or have changed.
+        """
+        logger.info(f"Starting data migration for the application {app.app_name}...")
+        logger.info(f"Starting app-data upload for the application {app.app_name}")
+        logger.info(f"App-data file path: {app_data_path}")
+        app_data_manifest = manifest.build_manifest(app_data_path)
+        uploaded = self.upload_manifests.load(self.device.device_id, app.imported_app_id, app.app_version)
+        throttle = self.bandwidth_shaper.throttle_for(self.device) if self.bandwidth_shaper else None
+        skipped_files, skipped_bytes, uploaded_files, uploaded_bytes = 0, 0, 0, 0
+        for dir_path, dir_names, file_names in os.walk(app_data_path):
+            for filename in file_names:
+                if self.deadline:
+                    self.deadline.check(f'the app-data upload of {app.app_name}')
+                relative_path = os.path.relpath(os.path.join(dir_path, filename), app_data_path).replace("\\", "/")
+                entry = app_data_manifest[relative_path]
+                if uploaded.get(relative_path) == entry:
+                    logger.info(f'Skipping the file {os.path.join(dir_path, filename)}, it is already uploaded')
+                    skipped_files += 1
+                    skipped_bytes += entry['size']
+                    continue
+                logger.info(f'Uploading the file {os.path.join(dir_path, filename)}..')
+                file_path = dir_path.replace(app_data_path, './').replace("\\", "/")
+                self.api.upload_app_data(self.device.device_id, app.imported_app_id, app.app_version,
+                                         os.path.join(dir_path, filename),
+                                         filepath=file_path if file_path != '' else None,
+                                         new_file_name=filename, throttle=throttle)
+                self.upload_manifests.record(self.device.device_id, app.imported_app_id, app.app_version,
+                                             relative_path, entry)
+                uploaded_files += 1
+                uploaded_bytes += entry['size']
+                add_phase_bytes(app, PHASE_UPLOAD_DATA, entry['size'])
+        logger.info(f"App data upload completed for the application {app.app_name}: uploaded {uploaded_files} files "
+                    f"({uploaded_bytes} bytes), skipped {skipped_files} unchanged files ({skipped_bytes} bytes)")
+
+    def import_apps_grouped(self, devices: list, group_size=50, **kwargs):
+        """Install the applications of several prepared devices with one job per group of identical installs.
+
+        The devices must have been prepared with `prepare_import` (and `export_app_data` when the data is migrated).
+        Uninstalls are grouped by (app id, version) and deploys by (app, version, app config, resource config), each
+        group is submitted as one action for up to `group_size` devices and its single job is tracked. The app-data
+        upload and the operational status are then handled per device so the results are still reported per device.
+
+        :param devices: list of prepared `Device` instances
+        :param group_size: maximum number of devices in one uninstall or deploy action
+        """
+        policy = self.api.get_default_policy()
+        installs = []
+        for device in devices:
+            self.device = device
+            for app in device.applications:
+                if app.deploy_status == "Skipped":
+                    continue
+                if not len(policy or []):
+                    logger.error("No Fog director policy found!")
+                    app.deploy_status = "Failed"
+                    app.deploy_error = "No Fog director policy found!"
+                    continue
+                try:
+                    app_config_data, resource_config = self.get_app_import_config(app)
+                    managed_app_id, deployment = self.find_unfinished_deployment(app, app_config_data,
+                                                                                 resource_config)
+                    if deployment is None:
+                        installs.append((device, app, app_config_data, resource_config, managed_app_id))
+                except Exception as err:
+                    logger.error(f"Error occurred on import of the application {app.app_name}")
+                    logger.error(traceback.format_exc())
+                    app.deploy_status = "Failed"
+                    app.deploy_error = f"Error occurred on import of the application {app.app_name}"
+
+        # Uninstall the unmanaged copies
+        undeploy_groups = defaultdict(list)
+        for install in installs:
+            if install[1].need_uninstall:
+                undeploy_groups[(install[1].app_id, install[1].app_version)].append(install)
+        failed = set()
+        for (app_id, app_version), group in undeploy_groups.items():
+            for chunk in chunked(group, group_size):
+                logger.info(f"Uninstalling the unmanaged app {chunk[0][1].gmm_formatted_app_name} from "
+                            f"{len(chunk)} devices...")
+                error = None
+                try:
+                    with self.trace_phase(PHASE_UNINSTALL, [app for _, app, *_ in chunk],
+                                          app_name=chunk[0][1].app_name, app_version=app_version, devices=len(chunk)):
+                        undeploy_status = self.undeploy_on_devices(app_id, app_version, dict(policy[0]),
+                                                                   [device.device_id for device, *_ in chunk])
+                    if undeploy_status == 'TIMEOUT':
+                        error = "Timeout error happened on uninstall"
+                except Exception as err:
+                    logger.error(traceback.format_exc())
+                    error = f"Error occurred on uninstall of the application {chunk[0][1].app_name}"
+                if error:
+                    logger.error(f"{error} for the app {chunk[0][1].gmm_formatted_app_name} on {len(chunk)} devices")
+                    for _, app, *_ in chunk:
+                        app.deploy_status = "Failed"
+                        app.deploy_error = error
+                        failed.add(id(app))
+
+        # Deploy the managed apps
+        deploy_groups = defaultdict(list)
+        for install in installs:
+            if id(install[1]) not in failed:
+                deploy_groups[(install[1].app_name, install[1].app_version, json.dumps(install[2], sort_keys=True),
+                               json.dumps(install[3], sort_keys=True))].append(install)
+        # Deployment id of every deployed app, its upload manifest is started with the app data
+        deployments = {}
+        for (app_name, app_version, *_), group in deploy_groups.items():
+            for chunk in chunked(group, group_size):
+                device, app, app_config_data, resource_config, _ = chunk[0]
+                logger.info(f"Deploying the application {app_name} version {app_version} on {len(chunk)} devices...")
+                error = None
+                try:
+                    if self.resource_descriptors.get(app_name, app_version) is None:
+                        error = f"Managed application not found with the app name {app_name}"
+                    else:
+                        with self.trace_phase(PHASE_DEPLOY, [chunk_app for _, chunk_app, *_ in chunk],
+                                              app_name=app_name, app_version=app_version, devices=len(chunk)):
+                            imported_app_id, deploy_status, job_id = self.deploy_on_devices(
+                                app, dict(policy[0]), app_config_data, resource_config,
+                                [device.device_id for device, *_ in chunk],
+                                imported_app_id=next((app_id for *_, app_id in chunk if app_id), None))
+                        if deploy_status == 'TIMEOUT':
+                            error = "Timeout error happened on install!"
+                        for _, chunk_app, *_ in chunk:
+                            chunk_app.imported_app_id = imported_app_id
+                            deployments[id(chunk_app)] = deployment_id(job_id, app_config_data, resource_config)
+                except Exception as err:
+                    logger.error(traceback.format_exc())
+                    error = f"Error occurred on import of the application {app_name}"
+                if error:
+                    logger.error(f"{error} for the app {app_name} on {len(chunk)} devices")
+                    for _, chunk_app, *_ in chunk:
+                        chunk_app.deploy_status = "Failed"
+                        chunk_app.deploy_error = error
+                        failed.add(id(chunk_app))
+
+        # App data and operational status are per device
+        for device in devices:
+            self.device = device
+            for app in device.applications:
+                if app.deploy_status in ("Failed", "Skipped") or id(app) in failed:
+                    continue
+                try:
+                    app_data_path = self.get_app_data_path(app)
+                    if not self.skip_data_migration and app_data_path:
+                        if id(app) in deployments:
+                            # A new deployment starts with empty app data
+                            self.upload_manifests.start(device.device_id, app.imported_app_id, app.app_version,
+                                                        deployments[id(app)])
+                        with self.trace_phase(PHASE_UPLOAD_DATA, [app]):
+                            self.upload_application_data(app, app_data_path)
+                        self.upload_manifests.complete(device.device_id, app.imported_app_id, app.app_version)
+                    app.deploy_status = "Passed"
+                    if self.verification_sweep is None:
+                        with self.trace_phase(PHASE_VERIFY, [app]):
+                            app.operational_status = self.track_app_operational_status(
+                                app, wait_timeout=kwargs.get('max_wait_time', 300))
+                except Exception as err:
+                    logger.error(f"Error occurred on import of the application {app.app_name}")
+                    logger.error(traceback.format_exc())
+                    app.deploy_status = "Failed"
+                    app.deploy_error = f"Error occurred on import of the application {app.app_name}"
+        logger.info(f"Grouped import finished for {len(devices)} devices!")
+
+    def export_gmm_app(self, compression=archive.GZIP, compression_level=None, compression_threads=None):
+        """Export the GMM apps, installations, templates and policies into json files and a compressed archive.
+
+        Every json record is added to the archive as soon as it has been fetched, so the compression runs while the
+        GMM api calls are still in progress instead of in a single pass at the end.
+
+        :param compression: archive compression, `gzip` (multi-threaded) or `zstd`
+        :param compression_level: compression level, defaults to the codec default
+        :param compression_threads: number of compression threads, defaults to the cpu count
+
+        :return: path of the created archive
+        """
         try:
             output_path = os.environ['APP_MIGRATION_DATA_DIR']
             export_data_dir = os.path.join(os.environ['APP_MIGRATION_DATA_DIR'], 'gmm_app_details')
@@ -914,68 +1470,121 @@ class AppMigration:
         safe_makedirs(gmm_device_dir)
         safe_makedirs(gmm_template_dir)
         safe_makedirs(gmm_policies_dir)
+
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        tar_file_name = os.path.join(output_path, f'gmm_org_{self.gmm_org_id}_{timestamp}'
+                                                  f'{archive.FILE_EXTENSIONS[compression]}')
+        logger.info(f"Streaming the GMM export into {tar_file_name}...")
+        try:
+            with archive.StreamingTarWriter(tar_file_name, compression, compression_level,
+                                            compression_threads) as tar:
+                self._export_gmm_app_records(tar, export_data_dir)
+        except Exception:
+            logger.error(f"GMM export failed, removing the incomplete archive {tar_file_name}")
+            if os.path.exists(tar_file_name):
+                os.remove(tar_file_name)
+            raise
+        logger.info(f"GMM Apps details has been successfully exported in {tar_file_name}")
+        return tar_file_name
+
+    def _export_gmm_app_records(self, tar, export_data_dir):
+        """ Fetch every GMM export record, write it under `export_data_dir` and add it to the `tar` stream """
         gmm_app_dict = defaultdict(list)
-        response = self.gmm_api.get_gmm_fog_application(self.gmm_org_id)
+        with self.tracer.span('gmm_list_apps', gmm_org_id=self.gmm_org_id):
+            response = self.gmm_api.get_gmm_fog_application(self.gmm_org_id)
         if response:
             for fd_app in response['fog_applications']:
                 # Generate app details json file for each gmm app
-                with open(os.path.join(gmm_app_dir, f'{fd_app["name"]}_V{fd_app["version"].replace(".", "_")}.json'), 'w') as file:
-                    logger.info("Writing apps details in a json file...")
+                logger.info("Writing apps details in a json file...")
+                with self.tracer.span('gmm_app_details', app_name=fd_app['name'], app_version=fd_app['version']):
                     app_detail = self.gmm_api.get_gmm_fog_app_details(self.gmm_org_id, fd_app['id'])
-                    json.dump(app_detail, file)
-                    logger.info(f"Apps details has been written in Json file {file.name}")
+                    app_file_name = f'{fd_app["name"]}_V{fd_app["version"].replace(".", "_")}.json'
+                    file_name = write_export_json(tar, export_data_dir, 'apps', app_file_name, app_detail)
+                logger.info(f"Apps details has been written in Json file {file_name}")
 
                 logger.info(f"Finding fog installations for app_id {fd_app.get('id', 0)}")
-                installations = self.gmm_api.get_gmm_fog_installation(fd_app.get('id', 0))
-                for installation in installations['fog_installations']:
-                    installation_detail = self.gmm_api.get_gmm_fog_installation_detail(installation.get('id'))
-                    gmm_app_dict[installation['gate_way']['uuid']].append(installation_detail)
-                    # Save the full app installation details in a json file with device serial number
-                    with open(os.path.join(gmm_device_dir,
-                                           f'{installation["gate_way"]["uuid"]}.json'),
-                              'w') as file:
-                        logger.info("Writing app installation details in a json file...")
-                        json.dump(gmm_app_dict[installation['gate_way']['uuid']], file)
-                        logger.info(f"App installation details has been written in Json file {file.name}")
-
-        # Save GMM apps details in a json file
-        with open(os.path.join(export_data_dir, 'gmm_app_details.json'), 'w') as outfile:
+                with self.tracer.span('gmm_installations', app_name=fd_app['name'],
+                                      app_version=fd_app['version']) as span:
+                    installations = self.gmm_api.get_gmm_fog_installation(fd_app.get('id', 0))
+                    for installation in installations['fog_installations']:
+                        installation_detail = self.gmm_api.get_gmm_fog_installation_detail(installation.get('id'))
+                        gmm_app_dict[installation['gate_way']['uuid']].append(installation_detail)
+                    span.attributes['installations'] = len(installations['fog_installations'])
+
+        # Save the full app installation details in a json file with device serial number. A gateway collects the
+        # installations of several apps so its file is only complete once every app has been visited.
+        logger.info("Writing app installation details in json files...")
+        with self.tracer.span('gmm_write_devices', devices=len(gmm_app_dict)):
+            for serial_number, installation_details in gmm_app_dict.items():
+                file_name = write_export_json(tar, export_data_dir, 'devices', f'{serial_number}.json',
+                                              installation_details)
+                logger.info(f"App installation details has been written in Json file {file_name}")
+
+            # Save GMM apps details in a json file
             logger.info("Writing GMM apps details in a json file...")
-            json.dump(gmm_app_dict, outfile)
-            logger.info("GMM apps details has been written in Json file gmm_app_details.json")
+            write_export_json(tar, export_data_dir, '', 'gmm_app_details.json', gmm_app_dict)
+        logger.info("GMM apps details has been written in Json file gmm_app_details.json")
 
         # Get all application templates and save them in json files
         logger.info(f"Finding application templates for the organization {self.gmm_org_id}...")
-        gmm_templates = self.gmm_api.get_gmm_templates(self.gmm_org_id)
-        if gmm_templates:
-            for template in gmm_templates['application_templates']:
-                with open(os.path.join(gmm_template_dir, f'template_{template["id"]}.json'), 'w') as outfile:
+        with self.tracer.span('gmm_templates', gmm_org_id=self.gmm_org_id):
+            gmm_templates = self.gmm_api.get_gmm_templates(self.gmm_org_id)
+            if gmm_templates:
+                for template in gmm_templates['application_templates']:
                     template_detail = self.gmm_api.get_gmm_template_detail(template['id'])
-                    json.dump(template_detail, outfile)
+                    write_export_json(tar, export_data_dir, 'templates', f'template_{template["id"]}.json',
+                                      template_detail)
 
         # Get all application deploy policies and save them in json files
         logger.info(f"Finding application policies for the organization {self.gmm_org_id}...")
-        gmm_deploy_policies = self.gmm_api.get_gmm_policies(self.gmm_org_id)
-        if gmm_deploy_policies:
-            for policy in gmm_deploy_policies['application_deploy_policies']:
-                with open(os.path.join(gmm_policies_dir, f'policy_{policy["id"]}.json'), 'w') as outfile:
+        with self.tracer.span('gmm_policies', gmm_org_id=self.gmm_org_id):
+            gmm_deploy_policies = self.gmm_api.get_gmm_policies(self.gmm_org_id)
+            if gmm_deploy_policies:
+                for policy in gmm_deploy_policies['application_deploy_policies']:
                     policy_detail = self.gmm_api.get_gmm_policy_detail(policy['id'])
-                    json.dump(policy_detail, outfile)
+                    write_export_json(tar, export_data_dir, 'policies', f'policy_{policy["id"]}.json',
+                                      policy_detail)
+
+    def finish_device(self):
+        """ Report the results of the current device, once the verification sweep checked its deployed apps when the
+        verification is deferred """
+        if self.verification_sweep is None:
+            self.make_app_migration_report()
+        else:
+            self.verification_sweep.add(self.device, [app for app in self.device.applications
+                                                      if app.deploy_status == "Passed" and
+                                                      app.operational_status is None])
 
-        # Create a tar.gz file containing all the dumped Json files
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        tar_file_name = os.path.join(output_path, f'gmm_org_{self.gmm_org_id}_{timestamp}.tar.gz')
-        make_tarfile(tar_file_name, export_data_dir)
-        logger.info(f"GMM Apps details has been successfully exported in {tar_file_name}")
+    def record_timeout(self, error):
+        """ Fail the apps of the current device which were not finished when its deadline was spent, the apps
+        finished before keep their result """
+        for app in self.device.applications:
+            if app.deploy_status not in ("Passed", "Failed", "Skipped"):
+                app.deploy_status = "Failed"
+                app.deploy_error = f"Device timed out: {error}"
 
-    def make_app_migration_report(self):
-        """ Generate app migration report summary in tabular format on the console
+    def make_app_migration_report(self, device=None):
+        """ Add the results of the current or given device to the app migration report
 
         :return:
         """
-        for app in self.device.applications:
-            self.migration_report_data.append([self.device.serial_number, app.app_name, app.app_version,
-                                               app.operational_status, app.deploy_error + ' ' + app.deploy_status_msg])
+        device = device or self.device
+        for app in device.applications:
+            phase_seconds = app.phase_seconds or {}
+            row = (device.serial_number, app.app_name, app.app_version, app.operational_status,
+                   app.deploy_error + ' ' + app.deploy_status_msg, app.deploy_status,
+                   *(round(phase_seconds.get(phase, 0.0), 3) for phase in PHASES))
+            self.migration_report_data.append(*row)
+            if self.report_sink:
+                self.report_sink.write(dict(zip(self.migration_report_data.column_names, row)))
+        if self.report_sink:
+            self.report_sink.flush()
+            self.report_sink.log_progress()
+        if self.timing_store:
+            try:
+                self.timing_store.record_device(device)
+            except Exception as err:
+                logger.warning(f"Could not record the timings of the device {device.serial_number}: {err}")
 
     def show_profile(self):
         self.ioxclient.ssh_client = self.ioxclient.connection
@@ -983,6 +1592,66 @@ class AppMigration:
         self.ioxclient.disconnect()
 
 
+def config_digest(app_config_data, resource_config):
+    """ sha256 of the app and resource config an app is deployed with """
+    config = json.dumps([normalize_app_config(app_config_data), resource_config], sort_keys=True, default=str)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
+def deployment_id(job_id, app_config_data, resource_config):
+    """ Id of a deployment in the upload manifests, its deploy job and the digest of the config it was deployed with """
+    return {'job_id': job_id, 'config': config_digest(app_config_data, resource_config)}
+
+
+def normalize_app_config(app_config):
+    """ App config as {section: {key: str value}}, to compare the GMM config with the one reported by a device """
+    return {str(section): {str(key): str(value) for key, value in (values or {}).items()}
+            for section, values in (app_config or {}).items()}
+
+
+def same_app_config(device_app_config, gmm_app_config):
+    return normalize_app_config(device_app_config) == normalize_app_config(gmm_app_config)
+
+
+def format_gmm_app_config(app_detail):
+    """ App config of a GMM app installation as {section: {key: value}}, the format of the IOx api """
+    app_config = defaultdict(dict)
+    for config_data in app_detail.get('app_specific_params') or []:
+        app_config[config_data['section']][config_data['key']] = config_data['value']
+    return dict(app_config)
+
+
+def is_migrated_app(installed_app, app_name, app_version, managed_app_id, skip_starting_app):
+    """True when an app record reported by IoT-OD on a device is the managed app of the same version in the state the
+    migration leaves it, running unless the apps are not started. Shared by the installer and the planner, the app
+    config is compared separately with `same_app_config` when the device reports it.
+
+    :param installed_app: IoT-OD app record of the device
+    :param managed_app_id: app id of the managed app in IoT-OD, None when unknown
+    """
+    return (installed_app.get('name') == app_name and installed_app.get('version') == app_version and
+            (not managed_app_id or installed_app.get('appId') == managed_app_id) and
+            (skip_starting_app or installed_app.get('status') == 'RUNNING'))
+
+
+def app_dependencies_from_mapping(mapping):
+    """ `AppMigration.app_dependencies` hook from a dict of app name to the app names it must be imported after """
+    def app_dependencies(app, apps):
+        names = set(mapping.get(app.app_name, ()))
+        return [other for other in apps if other.app_name in names]
+    return app_dependencies
+
+
+def add_phase_bytes(app: Application, phase, size_bytes):
+    if app.phase_bytes is None:
+        app.phase_bytes = {}
+    app.phase_bytes[phase] = app.phase_bytes.get(phase, 0) + size_bytes
+
+
+def intern_string(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 def safe_makedirs(*args):
     try:
         return os.makedirs(*args)
@@ -990,6 +1659,20 @@ def safe_makedirs(*args):
         pass  # Ignore errors; for example if the paths already exist!
 
 
-def make_tarfile(output_filename, source_dir):
-    with tarfile.open(output_filename, "w:gz") as tar:
+def chunked(items: list, size: int):
+    """ Split a list in consecutive chunks of at most `size` items """
+    return [items[index:index + size] for index in range(0, len(items), max(size, 1))]
+
+
+def make_tarfile(output_filename, source_dir, compression=archive.GZIP, level=None, threads=None):
+    with archive.StreamingTarWriter(output_filename, compression, level, threads) as tar:
         tar.add(source_dir, arcname=os.path.basename(source_dir))
+
+
+def write_export_json(tar, export_data_dir, sub_dir, file_name, data):
+    """ Write a json record to the export directory and add the same bytes to the export archive """
+    content = json.dumps(data).encode('utf-8')
+    with open(os.path.join(export_data_dir, sub_dir, file_name), 'wb') as file:
+        file.write(content)
+    tar.add_bytes('/'.join(part for part in (os.path.basename(export_data_dir), sub_dir, file_name) if part), content)
+    return file.name
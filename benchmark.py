@@ -0,0 +1,259 @@
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tarfile
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from time import perf_counter
+
+from app_migration import AppMigration, Application, Device, write_export_json
+from iox.catalog import AppCatalog
+from logs import log
+from synthetic_export import (app_name, serial_number, synthetic_app_detail, synthetic_catalog_app,
+                              synthetic_installation)
+from utils import archive
+from utils.form_data_encoder import MultipartEncoder
+from utils.profiling import current_rss
+
+logger = log.get_logger("Benchmark:: ")
+
+BENCHMARK_VERSION = 1
+READ_SIZE = 8192
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function is called once per benchmark run with the options and a scratch directory and returns
+    `(run, items, size_bytes)`: the callable to time, the number of items and the number of bytes processed by one
+    call. Everything done before returning is setup and is not timed.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def write_random_file(file_name, size_bytes, chunk_size=1024 * 1024):
+    with open(file_name, 'wb') as file:
+        while size_bytes > 0:
+            chunk = os.urandom(min(chunk_size, size_bytes))
+            file.write(chunk)
+            size_bytes -= len(chunk)
+
+
+def make_bench_migration(catalog_apps=()):
+    """ AppMigration with a local app catalog so the lookups never reach the api server """
+    app_migration = AppMigration(None, None, None, None, 'https://localhost', None, None)
+    app_migration.load_catalog(AppCatalog(list(catalog_apps)))
+    return app_migration
+
+
+@benchmark('format_app_name')
+def bench_format_app_name(options, work_dir):
+    names = [f'2414.{app_name(index % 50)}.{index + 1}' for index in range(options['size'])]
+
+    def run():
+        for name in names:
+            AppMigration.format_app_name(name)
+    return run, len(names), 0
+
+
+@benchmark('get_and_format_gmm_config')
+def bench_get_and_format_gmm_config(options, work_dir):
+    app_count = min(options['size'], 100)
+    app_migration = make_bench_migration(synthetic_catalog_app(index) for index in range(app_count))
+    details = [synthetic_app_detail(index % app_count, options['params']) for index in range(options['size'])]
+    apps = [Application(f'id{index % app_count}', f'2414.{app_name(index % app_count)}.1', app_name(index % app_count),
+                        'docker', '1.0.0', 'RUNNING') for index in range(options['size'])]
+
+    def run():
+        for app_detail, app in zip(details, apps):
+            app_migration.get_and_format_gmm_config(app_detail, app)
+    return run, len(details), 0
+
+
+@benchmark('build_deploy_payload')
+def bench_build_deploy_payload(options, work_dir):
+    app_migration = make_bench_migration()
+    app_migration.device = Device('device-0', '10.0.0.1', 8443, 'FOC0000', 'gw-0', 'DISCOVERED', 'default')
+    app_config, _ = app_migration.get_and_format_gmm_config(synthetic_app_detail(0, options['params']),
+                                                            Application('id0', '', 'x', 'docker', '1', ''))
+    resource = {'profile': 'custom', 'cpu': 200, 'memory': 128}
+
+    def run():
+        for _ in range(options['size']):
+            # Payloads are sent as json so the serialization is part of the cost
+            json.dumps(app_migration.build_deploy_payload(resource, {'id': 1}, app_config))
+    return run, options['size'], 0
+
+
+@benchmark('multipart_encoder')
+def bench_multipart_encoder(options, work_dir):
+    file_name = os.path.join(work_dir, 'app_data.bin')
+    size_bytes = options['data_mb'] * 1024 * 1024
+    write_random_file(file_name, size_bytes)
+
+    def run():
+        with open(file_name, 'rb') as file:
+            encoder = MultipartEncoder(fields={'file': (file_name, file), 'filepath': './', 'newfilename': 'data'})
+            while encoder.read(READ_SIZE):
+                pass
+    return run, 1, size_bytes
+
+
+@benchmark('export_json')
+def bench_export_json(options, work_dir):
+    records = [synthetic_installation(index, index % 50, options['params']) for index in range(options['size'])]
+    runs = iter(range(sys.maxsize))
+
+    def run():
+        export_dir = os.path.join(work_dir, f'export_{next(runs)}')
+        os.makedirs(os.path.join(export_dir, 'devices'))
+        with archive.StreamingTarWriter(export_dir + '.tar.gz', archive.GZIP) as tar:
+            for record in records:
+                write_export_json(tar, export_dir, 'devices', f"{record['gate_way']['uuid']}.json", [record])
+        shutil.rmtree(export_dir)
+        os.remove(export_dir + '.tar.gz')
+    return run, len(records), 0
+
+
+def _extract_benchmark(work_dir, tar_name, members):
+    """ Build a tar.gz of the given (name, bytes) members and return the timed extraction of it """
+    tar_file_name = os.path.join(work_dir, tar_name)
+    size_bytes = 0
+    with tarfile.open(tar_file_name, 'w:gz') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            size_bytes += len(data)
+    runs = iter(range(sys.maxsize))
+
+    def run():
+        extract_path = os.path.join(work_dir, f'extract_{next(runs)}')
+        archive.extract_tarfile(tar_file_name, extract_path)
+        shutil.rmtree(extract_path)
+    return run, size_bytes
+
+
+@benchmark('extract_gmm_data')
+def bench_extract_gmm_data(options, work_dir):
+    members = ((f'gmm_app_details/devices/{serial_number(index)}.json',
+                json.dumps([synthetic_installation(index, index % 50, options['params'])]).encode())
+               for index in range(options['size']))
+    run, size_bytes = _extract_benchmark(work_dir, 'gmm_export.tar.gz', members)
+    return run, options['size'], size_bytes
+
+
+@benchmark('extract_app_data')
+def bench_extract_app_data(options, work_dir):
+    file_count = 8
+    file_size = options['data_mb'] * 1024 * 1024 // file_count
+    members = ((f'appdata/data_{index}.bin', os.urandom(file_size)) for index in range(file_count))
+    run, size_bytes = _extract_benchmark(work_dir, 'bench_app-datamount.tar.gz', members)
+    return run, file_count, size_bytes
+
+
+def _migrate_module():
+    """ The migrate module, which imports this module for the bench command """
+    # `python migrate.py` runs it as __main__ and importing it again would add its log handlers a second time
+    main_module = sys.modules.get('__main__')
+    if hasattr(main_module, 'read_device_csv'):
+        return main_module
+    import migrate
+    return migrate
+
+
+@benchmark('read_device_csv')
+def bench_read_device_csv(options, work_dir):
+    read_device_csv = _migrate_module().read_device_csv
+    device_file = os.path.join(work_dir, 'devices.csv')
+    with open(device_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['device_ip', 'port', 'serial_number', 'network_ip', 'network_grp', 'skip_vpn_trust',
+                         'vpn_user', 'vpn_pwd'])
+        for index in range(options['size']):
+            writer.writerow([f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}', 8443,
+                             f'FOC{index:07d}', '', '', 'n', '', ''])
+
+    def run():
+        read_device_csv(device_file)
+    return run, options['size'], os.path.getsize(device_file)
+
+
+def run_benchmarks(names=None, size=1000, params=20, data_mb=16, repeat=5, with_logging=False):
+    """Run the registered benchmarks on synthetic data.
+
+    :param names: benchmarks to run, by default all
+    :param size: number of items (apps, devices, records) of the synthetic data sets
+    :param params: number of app specific params of every synthetic app
+    :param data_mb: size in MB of the synthetic app-data files
+    :param repeat: number of timed runs of every benchmark
+    :param with_logging: keep the info logs of the benchmarked code, they are disabled by default
+
+    :return: json serializable dict of the results
+    """
+    options = {'size': size, 'params': params, 'data_mb': data_mb}
+    results = OrderedDict()
+    for name in names or BENCHMARKS:
+        logger.info(f"Running benchmark {name}...")
+        work_dir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+        try:
+            run, items, size_bytes = BENCHMARKS[name](options, work_dir)
+            timings = []
+            for _ in range(repeat):
+                # The benchmarked code logs and prints on every item, keep that out of the measurement
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if not with_logging:
+                        logging.disable(logging.INFO)
+                    try:
+                        tick = perf_counter()
+                        run()
+                        timings.append(perf_counter() - tick)
+                    finally:
+                        logging.disable(logging.NOTSET)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        best = min(timings)
+        rss = current_rss()
+        results[name] = {
+            'items': items,
+            'bytes': size_bytes,
+            'best_seconds': round(best, 6),
+            'mean_seconds': round(statistics.mean(timings), 6),
+            'stdev_seconds': round(statistics.stdev(timings), 6) if len(timings) > 1 else 0.0,
+            'items_per_second': round(items / best, 1) if best else None,
+            'mb_per_second': round(size_bytes / 1024 / 1024 / best, 1) if best and size_bytes else None,
+            'rss_mb': round(rss / 1024 / 1024, 1) if rss else None,
+        }
+        logger.info(f"{name}: best {best:.4f}s over {repeat} runs, {results[name]['items_per_second']} items/s")
+    return {
+        'version': BENCHMARK_VERSION,
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': dict(options, repeat=repeat, with_logging=with_logging),
+        'results': results,
+    }
+
+
+def compare_results(baseline, current):
+    """ Rows of (benchmark, baseline best seconds, current best seconds, current / baseline) """
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base:
+            rows.append((name, base['best_seconds'], result['best_seconds'],
+                         round(result['best_seconds'] / base['best_seconds'], 2) if base['best_seconds'] else None))
+    return rows
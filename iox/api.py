@@ -9,8 +9,10 @@ from datetime import datetime
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from requests.exceptions import HTTPError, RequestException
+from utils.bandwidth import DOWNLOAD_CHUNK_BYTES, ThrottledReader
 from utils.encoding_utils import add_auth_header, rainier_login
 from utils.form_data_encoder import MultipartEncoder
+from utils.metrics import metrics
 
 # from core.utilities import raine_access_token
 from logs import log
@@ -68,6 +70,16 @@ class ApiConnection:
         self.ssl_verify = ssl_verify
 
     def do_request(self, url, method, **kwargs):
+        """ Send a request and record its latency and outcome in the run metrics of the live dashboard """
+        tick = time.perf_counter()
+        response = None
+        try:
+            response = self._send_request(url, method, **kwargs)
+            return response
+        finally:
+            metrics.record_request(time.perf_counter() - tick, failed=response is None or response.status_code >= 400)
+
+    def _send_request(self, url, method, **kwargs):
         try:
             # request_url = "%s://%s:%u/api/%s/%s" % (self.protocol, self.address, self.port, self.api_version, url)
             file_arg_pattern = re.compile(r'files?')
@@ -116,6 +128,10 @@ class ApiConnection:
                 )
                 client.headers['Content-Type'] = multipart_data.content_type
 
+            if multipart_data is not None and kwargs.get('throttle'):
+                # Pace the multipart stream, requests sends it in the blocks read from the body
+                multipart_data = ThrottledReader(multipart_data, kwargs['throttle'])
+
             request_body = None
             if 'data' in kwargs:
                 request_body = json.dumps(kwargs['data'])
@@ -149,8 +165,13 @@ class ApiConnection:
                     client.put(request_url, params=request_params, verify=self.ssl_verify)
                 self.logger.info(response.text)
             elif method == "GET":
-                response = client.get(request_url, params=request_params, verify=self.ssl_verify)
-                self.logger.info(response.text)
+                response = client.get(request_url, params=request_params, verify=self.ssl_verify,
+                                      stream=kwargs.get('stream', False))
+                if kwargs.get('stream'):
+                    # Reading the text would load the whole body, the caller reads it in throttled chunks
+                    self.logger.info(f"Streamed response: {response.status_code} {dict(response.headers)}")
+                else:
+                    self.logger.info(response.text)
             elif method == "DELETE":
                 response = client.delete(request_url, params=request_params,json=json.loads(request_body),
                                          verify=self.ssl_verify) if request_body else \
@@ -205,6 +226,16 @@ class ApiConnection:
         logging.info(response.text)
         return response.json() if response.text != '' else None
 
+    def list_apps(self, offset=0, limit=100):
+        self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
+            else self.authenticate()
+        query_params = {
+            'offset': offset,
+            'limit': limit
+        }
+        response = self.do_request(f'{self.api_root}/apps', 'GET', params=query_params)
+        return response.json() if response.text != '' else None
+
     def upload_app(self, app_type, app_tar_package):
         self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
             else self.authenticate()
@@ -238,20 +269,20 @@ class ApiConnection:
         self.logger.info(f"Application with app-id {app_id} is uninstalling...")
         return response.json() if response.text != '' else None
 
-    def upload_app_data(self, device_id, app_id, app_version, file, filepath=None, new_file_name=None):
+    def upload_app_data(self, device_id, app_id, app_version, file, filepath=None, new_file_name=None, throttle=None):
         self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
             else self.authenticate()
         if self.auth_type == 'Basic':
             response = self.do_request(f'appmgr/devices/{device_id}/apps/{app_id}/{app_version}/appdata', 'POST',
-                                       files=file, filepaths=filepath, newfilenames=new_file_name)
+                                       files=file, filepaths=filepath, newfilenames=new_file_name, throttle=throttle)
         else:
             response = self.do_request(f'{self.api_root}/devices/{device_id}/apps/{app_id}/{app_version}/appdata', 'POST',
-                                       file=file, filepath=filepath, newfilename=new_file_name)
+                                       file=file, filepath=filepath, newfilename=new_file_name, throttle=throttle)
         if response.status_code != 200 and response.text != 'File uploaded':
             raise Exception(f'File upload error occurred for file {file}!')
         self.logger.info(f"File: {file} Successfully uploaded")
 
-    def download_app_data(self, device_id, app_id, app_version):
+    def download_app_data(self, device_id, app_id, app_version, throttle=None):
         self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
             else self.authenticate()
 
@@ -263,9 +294,16 @@ class ApiConnection:
         response_data = response.json()
         download_api_url = response_data['_link'].get('href')
         self.logger.info(f"File download url: {download_api_url} Successfully uploaded")
-        download_response = self.do_request(f'{download_api_url.replace("/api/v1", "")}', 'GET')
-        data = download_response.content
-        return data
+        if throttle is None:
+            download_response = self.do_request(f'{download_api_url.replace("/api/v1", "")}', 'GET')
+            return download_response.content
+        # Stream the download so it is paced chunk by chunk
+        download_response = self.do_request(f'{download_api_url.replace("/api/v1", "")}', 'GET', stream=True)
+        chunks = []
+        for chunk in download_response.iter_content(DOWNLOAD_CHUNK_BYTES):
+            throttle(len(chunk))
+            chunks.append(chunk)
+        return b''.join(chunks)
 
     def get_app_details_from_device(self, device_id, app_id, app_version):
         self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
@@ -290,6 +328,17 @@ class ApiConnection:
         response = self.do_request(f'{self.api_root}/devices', 'GET', params=query_params)
         return response.json() if response.text != '' else None
 
+    def list_devices(self, offset=0, limit=100, detail='app'):
+        self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
+            else self.authenticate()
+        query_params = {
+            'detail': detail,
+            'offset': offset,
+            'limit': limit
+        }
+        response = self.do_request(f'{self.api_root}/devices', 'GET', params=query_params)
+        return response.json() if response.text != '' else None
+
     def get_device_detail(self, device_id):
         self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
             else self.authenticate()
@@ -314,6 +363,17 @@ class ApiConnection:
         logging.info(response.text)
         return response.json() if response.text != '' else None
 
+    def list_jobs(self, status='RUNNING', offset=0, limit=1):
+        self.x_access_token = self.x_access_token if self.token_expiry_time and self.token_expiry_time > time.time() \
+            else self.authenticate()
+        query_params = {
+            'status': status,
+            'offset': offset,
+            'limit': limit
+        }
+        response = self.do_request(f'{self.api_root}/jobs', 'GET', params=query_params)
+        return response.json() if response.text != '' else None
+
     # GMM API Calls
 
     def get_gmm_fog_application(self, org_id: int, limit=100):
@@ -0,0 +1,189 @@
+import concurrent.futures
+import copy
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+from logs import log
+
+logger = log.get_logger("Catalog:: ")
+
+PAGE_SIZE = 100
+MAX_WORKERS = 8
+# Seconds a live search remembers that an app is missing in IoT-OD, it may be imported there during the run
+MISS_TTL_SECONDS = 60
+
+
+def fetch_all_pages(fetch_page, page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+    """Fetch every record of a paginated IoT-OD listing api.
+
+    The first page tells the effective page size, the server may return less records than requested when it caps
+    the page size. The following pages are then requested `max_workers` at a time in parallel until a page comes back
+    shorter than the effective page size.
+
+    :param fetch_page: callable taking `offset` and `limit` keyword arguments and returning the api json response
+    :param page_size: number of records requested per page
+    :param max_workers: number of pages requested in parallel
+
+    :return: list of records in offset order
+    """
+    records = list((fetch_page(offset=0, limit=page_size) or {}).get('data', []))
+    request_count = 1
+    if len(records) < page_size:
+        # Either the last page or a server side cap of the page size, one more request tells them apart
+        page_size = len(records)
+        data = (fetch_page(offset=page_size, limit=page_size) or {}).get('data', []) if page_size else []
+        request_count += 1 if page_size else 0
+        records.extend(data)
+        if len(data) < page_size or not page_size:
+            logger.info(f"Fetched {len(records)} records in {request_count} requests")
+            return records
+    offset = len(records)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            offsets = [offset + index * page_size for index in range(max_workers)]
+            pages = list(executor.map(lambda page_offset: fetch_page(offset=page_offset, limit=page_size), offsets))
+            request_count += len(pages)
+            for page in pages:
+                data = (page or {}).get('data', [])
+                records.extend(data)
+                if len(data) < page_size:
+                    logger.info(f"Fetched {len(records)} records in {request_count} requests")
+                    return records
+            offset = offsets[-1] + page_size
+
+
+class AppCatalog:
+    """Snapshot of the applications available in IoT-OD app management, indexed by application name.
+
+    It answers the managed/unmanaged lookups of AppMigration from memory so that parsing thousands of devices does
+    not issue one `searchByName` request per app per device.
+
+    :param apps: list of app records as returned by the IoT-OD apps api
+    """
+
+    def __init__(self, apps=None):
+        self.apps_by_name = OrderedDict()
+        for app in apps or []:
+            self.apps_by_name.setdefault(app['name'], []).append(app)
+
+    @classmethod
+    def from_api(cls, api_connection, page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+        """ Build the catalog with one parallel paginated pass over the IoT-OD apps api """
+        logger.info("Fetching the IoT-OD application catalog...")
+        catalog = cls(fetch_all_pages(api_connection.list_apps, page_size, max_workers))
+        logger.info(f"Application catalog contains {len(catalog)} application names")
+        return catalog
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([app for apps in data.get('apps', {}).values() for app in apps])
+
+    def to_dict(self, app_names=None):
+        """ Serializable form of the catalog, optionally restricted to the given app names """
+        return {
+            'apps': {name: apps for name, apps in self.apps_by_name.items()
+                     if app_names is None or name in app_names}
+        }
+
+    def __len__(self):
+        return len(self.apps_by_name)
+
+    def __contains__(self, app_name):
+        return app_name in self.apps_by_name
+
+    def find_app(self, app_name: str):
+        """ Returns the first app record with exactly the given name or None """
+        apps = self.apps_by_name.get(app_name)
+        return apps[0] if apps else None
+
+    def is_managed(self, app_name: str):
+        return any(app.get('appType') != 'UNMANAGED' for app in self.apps_by_name.get(app_name, []))
+
+    def is_unmanaged(self, app_name: str):
+        return any(app.get('appType') == 'UNMANAGED' for app in self.apps_by_name.get(app_name, []))
+
+
+class ResourceDescriptorStore:
+    """Memoized read-only resource descriptors of the IoT-OD apps, keyed by app name and version.
+
+    The descriptor `app.resources` of an app is looked up once, copied and frozen, then every install gets an
+    `overlay`: a new shallow dict of the frozen resources with its own GMM overrides. Thousands of installs of the
+    same app version cost one lookup, and no install can change the resources of another one.
+
+    The nested values of an overlay which are not overridden, e.g. a descriptor `network` list, are shared by all the
+    overlays and must be replaced instead of being changed in place.
+
+    The lookups run outside the lock, the concurrent imports of the same app wait for the one lookup in progress and
+    the imports of other apps are not blocked. An app missing in IoT-OD is searched again after `miss_ttl` seconds.
+
+    :param find_app: callable taking the app name and version and returning the IoT-OD app record or None
+    :param miss_ttl: seconds a missing app is remembered, None for the whole run, e.g. when the apps are found in a
+        catalog snapshot, and 0 to search it again every time
+    """
+
+    def __init__(self, find_app, miss_ttl=MISS_TTL_SECONDS):
+        self.find_app = find_app
+        self.miss_ttl = miss_ttl
+        self.hits = 0
+        self.misses = 0
+        # (resources, monotonic expiry time or None) by (app name, app version)
+        self._descriptors = {}
+        # Future of the lookup in progress by (app name, app version)
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+    def get(self, app_name, app_version=None):
+        """ Read-only resources of the app descriptor, an empty mapping when the app has no resources and None when
+        the app is not in IoT-OD """
+        key = (app_name, app_version)
+        with self._lock:
+            cached = self._descriptors.get(key)
+            if cached is not None and (cached[1] is None or cached[1] > time.monotonic()):
+                self.hits += 1
+                return cached[0]
+            lookup = self._lookups.get(key)
+            if lookup is not None:
+                self.hits += 1
+                owner = False
+            else:
+                self.misses += 1
+                lookup = self._lookups[key] = concurrent.futures.Future()
+                owner = True
+        if not owner:
+            return lookup.result()
+        try:
+            app = self.find_app(app_name, app_version)
+            resources = None
+            if app:
+                resources = MappingProxyType(copy.deepcopy(app['descriptor']['app'].get('resources') or {}))
+        except BaseException as err:
+            with self._lock:
+                del self._lookups[key]
+            lookup.set_exception(err)
+            raise
+        with self._lock:
+            if resources is not None or self.miss_ttl is None:
+                self._descriptors[key] = (resources, None)
+            elif self.miss_ttl > 0:
+                self._descriptors[key] = (resources, time.monotonic() + self.miss_ttl)
+            del self._lookups[key]
+        lookup.set_result(resources)
+        return resources
+
+    @staticmethod
+    def overlay(resources, overrides=None):
+        """ New resources dict of read-only descriptor resources updated with the overrides of one install """
+        overlay = dict(resources)
+        overlay.update(overrides or {})
+        return overlay
+
+    def clear(self, miss_ttl=MISS_TTL_SECONDS):
+        """ Forget the descriptors, e.g. when the apps are looked up in another catalog
+
+        :param miss_ttl: seconds the missing apps of the next lookups are remembered, see `ResourceDescriptorStore`
+        """
+        with self._lock:
+            self._descriptors.clear()
+            self.miss_ttl = miss_ttl
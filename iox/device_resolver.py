@@ -0,0 +1,76 @@
+from iox.catalog import fetch_all_pages
+from logs import log
+
+logger = log.get_logger("Device Resolver:: ")
+
+INVENTORY_PAGE_SIZE = 1000
+
+
+class DeviceResolver:
+    """In-memory index of the IoT-OD device inventory.
+
+    The inventory is paged through once and indexed by serial number, ip address, ip address and port and host
+    name, so the devices of a GMM export or of a device csv are matched with a local hash join instead of one
+    `searchByAnyMatch` request per device.
+
+    :param devices: list of IoT-OD device records, fetched with the app details
+    """
+
+    def __init__(self, devices=None):
+        self.devices = []
+        self.by_serial = {}
+        self.by_ip = {}
+        self.by_ip_port = {}
+        self.by_name = {}
+        for device in devices or []:
+            self.add(device)
+
+    @classmethod
+    def from_api(cls, api_connection, page_size=INVENTORY_PAGE_SIZE, max_workers=8):
+        """ Build the index with one parallel paginated pass over the IoT-OD device inventory """
+        logger.info("Fetching the IoT-OD device inventory...")
+        resolver = cls(fetch_all_pages(api_connection.list_devices, page_size, max_workers))
+        logger.info(f"Device inventory contains {len(resolver)} devices")
+        return resolver
+
+    def __len__(self):
+        return len(self.devices)
+
+    def add(self, device):
+        self.devices.append(device)
+        if device.get('serialNumber'):
+            self.by_serial.setdefault(device['serialNumber'], device)
+        if device.get('ipAddress'):
+            self.by_ip.setdefault(device['ipAddress'], device)
+            self.by_ip_port.setdefault((device['ipAddress'], str(device.get('port'))), device)
+        if device.get('hostname'):
+            self.by_name.setdefault(device['hostname'], device)
+
+    def resolve(self, serial_number=None, device_ip=None, port=None, device_name=None):
+        """ Returns the device record matching the most specific given key or None """
+        if serial_number:
+            return self.by_serial.get(serial_number)
+        if device_ip and port:
+            return self.by_ip_port.get((device_ip, str(port)))
+        if device_ip:
+            return self.by_ip.get(device_ip)
+        if device_name:
+            return self.by_name.get(device_name)
+        return None
+
+    def resolve_serial_numbers(self, serial_numbers):
+        """Match serial numbers against the inventory.
+
+        :return: list of matched device records in input order and list of the unmatched serial numbers
+        """
+        matched, unmatched = [], []
+        for serial_number in serial_numbers:
+            device = self.by_serial.get(serial_number)
+            if device is None:
+                unmatched.append(serial_number)
+            else:
+                matched.append(device)
+        if unmatched:
+            logger.warning(f"{len(unmatched)} serial numbers were not found in the IoT-OD inventory: "
+                           f"{', '.join(unmatched)}")
+        return matched, unmatched
@@ -5,9 +5,18 @@ from logging.handlers import TimedRotatingFileHandler
 FORMATTER = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 LOG_FILE = "migration.log"
 
+# Names of the loggers writing to LOG_FILE, so the file can be changed after they have been created
+_file_logger_names = set()
+# Cleared while a live dashboard owns the terminal, the console handlers then drop their records
+_console_enabled = True
+
+def _console_filter(record):
+	return _console_enabled
+
 def get_console_handler():
 	console_handler = logging.StreamHandler(sys.stdout)
 	console_handler.setFormatter(FORMATTER)
+	console_handler.addFilter(_console_filter)
 	return console_handler
 
 def get_file_handler():
@@ -22,8 +31,30 @@ def get_logger(logger_name):
 
 	logger.addHandler(get_console_handler())
 	logger.addHandler(get_file_handler())
+	_file_logger_names.add(logger_name)
 
 	# with this pattern, it's rarely necessary to propagate the error up to parent
 	logger.propagate = False
 
 	return logger
+
+def set_log_file(log_file):
+	"""Write the file logs of all the loggers, including the ones already created, to `log_file`."""
+	global LOG_FILE
+	LOG_FILE = log_file
+	for logger_name in _file_logger_names:
+		logger = logging.getLogger(logger_name)
+		for handler in list(logger.handlers):
+			if isinstance(handler, TimedRotatingFileHandler):
+				logger.removeHandler(handler)
+				handler.close()
+		logger.addHandler(get_file_handler())
+
+def set_console_enabled(enabled):
+	"""Show or hide the console logs of all the loggers, the file logs are kept."""
+	global _console_enabled
+	_console_enabled = enabled
+	# The root logger may also print to the console, e.g. after a `logging.basicConfig`
+	for handler in logging.getLogger().handlers:
+		if type(handler) is logging.StreamHandler:
+			handler.addFilter(_console_filter)
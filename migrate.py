@@ -1,14 +1,37 @@
 import csv
+import json
 import sys
 import os
 import argparse
 import traceback
+from datetime import datetime
 from tabulate import tabulate
 import click
 
-from app_migration import AppMigration
+import benchmark
+import migration_planner
+import preflight as device_preflight
+import synthetic_export
+from verification_sweep import VerificationSweep
+from wave_scheduler import WaveResult, WaveScheduler
+from app_migration import AppMigration, REPORT_COLUMNS, REPORT_HEADER, app_dependencies_from_mapping, chunked
 from core.config import get_config_data as config
+from iox.catalog import AppCatalog
+from iox.device_resolver import DeviceResolver
 from logs import log
+from utils import archive, profiling
+from utils.bandwidth import BandwidthShaper
+from utils import journal as journal_events, sharding
+from utils.dashboard import LiveDashboard
+from utils.deadline import Deadline, DeferredRetryQueue, DeviceTimeoutError
+from utils.journal import DeviceJournal, read_journal
+from utils.metrics import metrics
+from utils.prefetch import AppDataPrefetcher
+from utils import work_queue as work_queue_states
+from utils.work_queue import DeviceWorkQueue, default_worker_name
+from utils.report_sink import ReportSink, merge_reports, print_report_table
+from utils.timing_store import TimingStore
+from utils.tracing import Tracer
 
 logger = log.get_logger("Migrate::")
 
@@ -70,11 +93,75 @@ def read_device_serial_no(device_file, **kwargs):
         return devices
 
 
+def get_gmm_data_dir():
+    """ Directory where the GMM export tar is extracted """
+    try:
+        gmm_data_dir = os.path.join(os.environ['APP_MIGRATION_DATA_DIR'])
+    except KeyError as e:
+        gmm_data_dir = os.path.abspath('./archive')
+    return os.path.join(gmm_data_dir, 'gmm_app_details')
+
+
+def device_serial_number(device):
+    """ Serial number of a device detail of the device file or of an IOT-OD device record """
+    return device.get('serial_number') or device.get('serialNumber')
+
+
+def use_run_dir(name):
+    """ Run in the `name` sub directory of the app migration data directory and log to `migration.<name>.log`, so the
+    export extraction, app data, journal and reports never collide with the other processes running on the host """
+    os.environ['APP_MIGRATION_DATA_DIR'] = os.path.join(os.path.dirname(get_gmm_data_dir()), name)
+    os.makedirs(os.environ['APP_MIGRATION_DATA_DIR'], exist_ok=True)
+    log.set_log_file(f'migration.{name}.log')
+
+
+def get_app_data_root():
+    """ Directory holding the exported app-data directory of every app """
+    try:
+        return os.path.join(os.environ['APP_MIGRATION_DATA_DIR'])
+    except KeyError as e:
+        return os.path.abspath('./archive/apps')
+
+
+def create_app_migration(**kwargs):
+    """ Create an AppMigration instance from config.yml, keyword arguments override the config values """
+    options = dict(iox_client_host=config.app_migration_vars.get('iox_client_host'),
+                   iox_user=config.app_migration_vars.get('iox_user'),
+                   iox_password=config.app_migration_vars.get('iox_password'),
+                   ssh_key_path=config.app_migration_vars.get('ssh_key_path'),
+                   api_server=config.app_migration_vars.get('base_url'),
+                   port=config.app_migration_vars.get('port'),
+                   api_user=config.app_migration_vars.get('api_user'),
+                   api_password=config.app_migration_vars.get('api_password'),
+                   api_prefix=config.app_migration_vars.get('api_prefix'),
+                   auth_type=os.getenv('auth_type', config.app_migration_vars.get('auth_type')),
+                   platform=os.getenv('platform', config.app_migration_vars.get('platform')),
+                   gmm_api_server=config.gmm_server.get('base_url'),
+                   gmm_api_key=config.app_migration_vars.get('GMM_API_KEY'),
+                   gmm_org_id=config.app_migration_vars.get('GMM_ORG_ID'))
+    options.update(kwargs)
+    return AppMigration(**options)
+
+
 @click.group('migrate')
-def migrate():
+@click.option('-profile', '--profile', default=os.getenv('profile', None), type=click.Choice(profiling.PROFILERS),
+              help='Profile the command with `cprofile` or with the low overhead `sample` profiler, the pstats or '
+                   'collapsed stacks, the hot functions and the RSS and open files over the run are written in '
+                   '--profile-dir')
+@click.option('-profile_dir', '--profile-dir', default=os.getenv('profile_dir', None), type=click.Path(),
+              help='Directory of the profile files, default is <data dir>/profiles')
+@click.option('-profile_top', '--profile-top', default=int(os.getenv('profile_top', 30)), type=int,
+              help='Number of functions in the hot function summary of the profile, default is 30')
+@click.pass_context
+def migrate(ctx, profile, profile_dir, profile_top):
     # args, sys.argv[1:] = parser.parse_known_args(sys.argv[1:])
     # device_file = args.device_file
-    pass
+    if profile:
+        profile_dir = profile_dir or os.path.join(os.path.dirname(get_gmm_data_dir()), 'profiles')
+        profiler = profiling.CommandProfiler(ctx.invoked_subcommand or 'migrate', profile_dir, profile, profile_top)
+        profiler.start()
+        # Called once the subcommand has returned or failed
+        ctx.call_on_close(lambda: print(profiler.stop()))
 
 # *********************** Command Line Utility For App Migration ************************ #
 
@@ -107,9 +194,111 @@ def migrate():
 @click.option('-wait_time', '--max-wait-time', default=300, type=int,
               help='Set the maximum wait time in seconds if any request taking time to fetch the response, '
                    'default is 300 secs')
-@click.argument('gmm_export_tar', type=click.Path(exists=True), required=True)
+@click.option('-plan', '--plan', 'plan_file', default=None, type=click.Path(exists=True),
+              help='Execute a plan file created by the `plan` command instead of looking up the devices and apps '
+                   'one by one, the GMM export tar argument defaults to the export the plan was built from')
+@click.option('-group_size', '--deploy-group-size', default=int(os.getenv('deploy_group_size', 1)), type=int,
+              help='Submit one uninstall/deploy job for up to this many devices running the same app version with '
+                   'identical app and resource config, default is 1 which runs one job per app per device')
+@click.option('-bulk_lookup', '--bulk-device-lookup', default=os.getenv('bulk_device_lookup', True), type=bool,
+              help='Resolve the devices of the device file from one paginated pass over the IOT-OD device inventory '
+                   'instead of one search request per device, set this to False for a handful of devices')
+@click.option('-page_size', '--inventory-page-size', default=int(os.getenv('inventory_page_size', 1000)), type=int,
+              help='Number of devices requested per page of the IOT-OD device inventory, default is 1000')
+@click.option('-report_file', '--report-file', default=os.getenv('report_file', None), type=click.Path(),
+              help='File where the result of every app is written as soon as its device is done, a .jsonl file name '
+                   'writes json lines and any other name csv, default is '
+                   '<data dir>/reports/migration_report_<timestamp>.csv')
+@click.option('-trace_file', '--trace-file', default=os.getenv('trace_file', None), type=click.Path(),
+              help='Chrome trace json file where the timing of every migration phase is written, default is the '
+                   'report file name with the extension .trace.json')
+@click.option('-waves', '--waves', default=os.getenv('waves', False), type=bool,
+              help='Set this to True to migrate the devices in waves which start with a canary wave and grow while '
+                   'the error rate, the job duration and the IOT-OD job backlog stay healthy')
+@click.option('-canary_size', '--canary-size', default=int(os.getenv('canary_size', 5)), type=int,
+              help='Number of devices of the first wave, default is 5')
+@click.option('-max_wave_size', '--max-wave-size', default=int(os.getenv('max_wave_size', 200)), type=int,
+              help='Maximum number of devices of a wave, default is 200')
+@click.option('-max_error_rate', '--max-error-rate', default=float(os.getenv('max_error_rate', 0.05)), type=float,
+              help='Failed apps ratio of a wave above which the next wave shrinks, default is 0.05')
+@click.option('-max_job_backlog', '--max-job-backlog', default=os.getenv('max_job_backlog'), type=int,
+              help='Number of running IOT-OD jobs above which the next wave shrinks, not checked by default')
+@click.option('-wave_pause', '--wave-pause', default=int(os.getenv('wave_pause', 300)), type=int,
+              help='Seconds to pause when half of the apps of a wave failed, default is 300')
+@click.option('-device_order', '--device-order', default=os.getenv('device_order', migration_planner.ORDER_FILE),
+              type=click.Choice(migration_planner.DEVICE_ORDERS),
+              help='Order of the devices, `file` keeps the order of the device file, plan or export and '
+                   '`longest-first` starts with the devices estimated to take the longest, default is `file`')
+@click.option('-timings', '--timings', 'timings_file', default=None, type=click.Path(exists=True),
+              help='Json file or timing database with the historical average step durations used to estimate the '
+                   'device durations, default is the --timing-db of the previous runs')
+@click.option('-timing_db', '--timing-db', default=os.getenv('timing_db'), type=click.Path(),
+              help='Database recording the step durations of every run, default is timings.db in the app migration '
+                   'data directory')
+@click.option('-shard', '--shard', default=os.getenv('shard'), type=str,
+              help='Migrate only the shard i/N of the devices (i from 1 to N) selected by hashing the serial numbers, '
+                   'every shard uses its own data directory, journal, log and report files')
+@click.option('-work_queue', '--work-queue', 'work_queue_file', default=os.getenv('work_queue'), type=click.Path(),
+              help='SQLite work queue shared by several installer processes, the devices are added to it when missing '
+                   'and every process leases the next devices until the queue is empty')
+@click.option('-lease_seconds', '--lease-seconds', default=int(os.getenv('lease_seconds', 600)), type=int,
+              help='Seconds after which the devices of a worker which stopped renewing its leases are handed to '
+                   'another worker, default is 600')
+@click.option('-app_concurrency', '--app-concurrency', default=int(os.getenv('app_concurrency', 1)), type=int,
+              help='Number of apps of a device imported at the same time, default is 1 which imports the apps one by '
+                   'one, not used with --deploy-group-size')
+@click.option('-app_dependencies', '--app-dependencies', 'app_dependencies_file', default=None,
+              type=click.Path(exists=True),
+              help='Json file mapping an app name to the app names which must be imported before it on a device')
+@click.option('-skip_migrated_apps', '--skip-migrated-apps', default=os.getenv('skip_migrated_apps', True), type=bool,
+              help='Skip the apps which are already installed on the device with the same version, status and config, '
+                   'so a rerun only migrates what is missing, set this to False to deploy every app again')
+@click.option('-bulk_verify', '--bulk-verify', default=os.getenv('bulk_verify', False), type=bool,
+              help='Set this to True to move on to the next app right after its deploy and check the operational '
+                   'status of the deployed apps of many devices at once with periodic sweeps')
+@click.option('-verify_interval', '--verify-interval', default=int(os.getenv('verify_interval', 30)), type=int,
+              help='Seconds between two verification sweeps of --bulk-verify, default is 30')
+@click.option('-prefetch', '--prefetch', default=int(os.getenv('prefetch', 0)), type=int,
+              help='Number of upcoming devices whose app data is exported while the current device is migrated, '
+                   'default is 0 which exports the app data of every device right before its import')
+@click.option('-prefetch_budget_mb', '--prefetch-budget-mb', default=int(os.getenv('prefetch_budget_mb', 2048)),
+              type=int, help='Disk space in MB the prefetched app data may use, default is 2048')
+@click.option('-device_timeout', '--device-timeout', default=int(os.getenv('device_timeout', 0)), type=int,
+              help='Time budget in seconds of the migration of one device, a device exceeding it is cancelled and '
+                   'retried at the end of the run, default is 0 for no budget')
+@click.option('-device_retries', '--device-retries', default=int(os.getenv('device_retries', 2)), type=int,
+              help='Number of retries of a device which exceeded --device-timeout, default is 2')
+@click.option('-retry_backoff', '--retry-backoff', default=int(os.getenv('retry_backoff', 60)), type=int,
+              help='Seconds before the first retry of a timed out device, doubled on every retry, default is 60')
+@click.option('-shape_bandwidth', '--shape-bandwidth', default=os.getenv('shape_bandwidth', True), type=bool,
+              help='Pace the app-data uploads and downloads with a cap per device model, default is True')
+@click.option('-model_caps', '--device-model-caps', 'device_model_caps_file', default=None,
+              type=click.Path(exists=True),
+              help='Json file of the transfer caps in kbps by device model prefix, e.g. {"IR829": 512}, replacing '
+                   'the built-in caps of the cellular IR800 and IR1100 gateways')
+@click.option('-max_device_kbps', '--max-device-kbps', default=int(os.getenv('max_device_kbps', 0)), type=int,
+              help='Transfer cap in kbps of the devices whose model has no cap, default is 0 for no cap')
+@click.option('-max_total_kbps', '--max-total-kbps', default=int(os.getenv('max_total_kbps', 0)), type=int,
+              help='Cap in kbps of all the app-data transfers together, default is 0 for no cap')
+@click.option('-preflight', '--preflight', default=os.getenv('preflight', False), type=bool,
+              help='Set this to True to skip upfront the devices which are not in IoT-OD with a ready status')
+@click.option('-preflight_tcp', '--preflight-tcp', default=os.getenv('preflight_tcp', False), type=bool,
+              help='Set this to True to also skip the devices whose ip address and port do not accept a TCP '
+                   'connection within --connect-timeout seconds, used with --preflight')
+@click.option('-connect_timeout', '--connect-timeout', default=float(os.getenv('connect_timeout', 3)), type=float,
+              help='Timeout in seconds of the preflight TCP connections, default is 3')
+@click.option('-dashboard', '--dashboard', default=os.getenv('dashboard', False), type=bool,
+              help='Set this to True to show a live dashboard of the devices, request rate, stage queues, latency '
+                   'and ETA instead of the logs, which then only go to the log file')
+@click.argument('gmm_export_tar', type=click.Path(exists=True), required=False)
 def migrate_gmm_app(auth_type, ssl_verify, platform, continue_on_error, skip_data_import, skip_starting_app,
-                    skip_managed_app, device_file, max_wait_time, gmm_export_tar):
+                    skip_managed_app, device_file, max_wait_time, plan_file, deploy_group_size, bulk_device_lookup,
+                    inventory_page_size, report_file, trace_file, waves, canary_size, max_wave_size, max_error_rate,
+                    max_job_backlog, wave_pause, device_order, timings_file, timing_db, shard, work_queue_file,
+                    lease_seconds, app_concurrency, app_dependencies_file, skip_migrated_apps, bulk_verify,
+                    verify_interval, prefetch, prefetch_budget_mb, device_timeout, device_retries, retry_backoff,
+                    shape_bandwidth, device_model_caps_file, max_device_kbps, max_total_kbps, preflight, preflight_tcp,
+                    connect_timeout, dashboard, gmm_export_tar):
     """
     This command will do install all the applications which were previously installed on the given devices in GMM.
     This command needs the output of export-gmm-app-details command. This command should be executed once the selected
@@ -123,77 +312,772 @@ def migrate_gmm_app(auth_type, ssl_verify, platform, continue_on_error, skip_dat
 
         python migrate.py install-gmm-app-to-iod --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
 
+        python migrate.py install-gmm-app-to-iod --plan=migration_plan.json
+
+        python migrate.py install-gmm-app-to-iod --deploy-group-size=100 --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --app-concurrency=4 --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --shard=2/4 --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --work-queue=./archive/queue.db --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --device-timeout=900 --device-retries=2 --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --waves=True --canary-size=5 --max-wave-size=500 --deploy-group-size=100 --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --dashboard=True --device-file=device_file_test.csv ./archive/gmm_org_2414.tar.gz
+
     """
-    app_migration = AppMigration(iox_client_host=config.app_migration_vars.get('iox_client_host'),
-                                 iox_user=config.app_migration_vars.get('iox_user'),
-                                 iox_password=config.app_migration_vars.get('iox_password'),
-                                 ssh_key_path=config.app_migration_vars.get('ssh_key_path'),
-                                 api_server=config.app_migration_vars.get('base_url'),
-                                 port=config.app_migration_vars.get('port'),
-                                 api_user=config.app_migration_vars.get('api_user'),
-                                 api_password=config.app_migration_vars.get('api_password'),
-                                 api_prefix=config.app_migration_vars.get('api_prefix'),
-                                 auth_type=os.getenv('auth_type', auth_type),
-                                 platform=os.getenv('platform', platform),
-                                 ssl_verify=os.getenv('ssl_verify', ssl_verify),
-                                 continue_on_error=continue_on_error,
-                                 skip_data_migration=skip_data_import,
-                                 skip_starting_app=skip_starting_app,
-                                 skip_managed_apps=skip_managed_app,
-                                 gmm_api_server=config.gmm_server.get('base_url'),
-                                 gmm_api_key=config.app_migration_vars.get('GMM_API_KEY'),
-                                 gmm_org_id=config.app_migration_vars.get('GMM_ORG_ID'))
+    plan = None
+    if plan_file:
+        plan = migration_planner.load_plan(plan_file)
+        gmm_export_tar = gmm_export_tar or plan.get('gmm_export')
+        for option, value in (('skip_data_import', skip_data_import), ('skip_managed_app', skip_managed_app),
+                              ('continue_on_error', continue_on_error), ('skip_starting_app', skip_starting_app)):
+            if plan['options'].get(option) != value:
+                logger.warning(f"The plan was built with {option}={plan['options'].get(option)} but the "
+                               f"installer runs with {option}={value}")
+    if not gmm_export_tar or not os.path.exists(gmm_export_tar):
+        raise click.UsageError("Missing or not existing argument GMM_EXPORT_TAR")
+    # Resolved before the data directory of a shard or worker is set, so all the processes of a host share it
+    timing_db = os.path.abspath(timing_db or os.path.join(os.path.dirname(get_gmm_data_dir()), 'timings.db'))
+    if shard:
+        try:
+            shard_index, shard_count = sharding.parse_shard(shard)
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint='--shard')
+        use_run_dir(f'shard_{shard_index}_of_{shard_count}')
+        logger.info(f"Running shard {shard_index} of {shard_count} in {os.environ['APP_MIGRATION_DATA_DIR']}")
+    if work_queue_file:
+        if waves or shard:
+            raise click.UsageError("--work-queue can not be combined with --waves or --shard")
+        # The queue path is resolved before the data directory is changed for the worker
+        work_queue_file = os.path.abspath(work_queue_file)
+        use_run_dir(f'worker_{default_worker_name()}')
+        logger.info(f"Running as a worker of the queue {work_queue_file} in {os.environ['APP_MIGRATION_DATA_DIR']}")
+
+    app_migration = create_app_migration(auth_type=os.getenv('auth_type', auth_type),
+                                         platform=os.getenv('platform', platform),
+                                         ssl_verify=os.getenv('ssl_verify', ssl_verify),
+                                         continue_on_error=continue_on_error,
+                                         skip_data_migration=skip_data_import,
+                                         skip_starting_app=skip_starting_app,
+                                         skip_managed_apps=skip_managed_app)
+    if not report_file:
+        report_file = os.path.join(os.path.dirname(get_gmm_data_dir()), 'reports',
+                                   f"migration_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    app_migration.report_sink = ReportSink(report_file, [name for name, _ in REPORT_COLUMNS])
+    app_migration.tracer = Tracer(trace_file or os.path.splitext(report_file)[0] + '.trace.json')
+    app_migration.app_concurrency = app_concurrency
+    app_migration.timing_store = TimingStore(timing_db)
+    app_migration.skip_migrated_apps = skip_migrated_apps
+    if bulk_verify:
+        app_migration.verification_sweep = VerificationSweep(app_migration.api,
+                                                             app_migration.make_app_migration_report,
+                                                             interval=verify_interval, wait_timeout=max_wait_time,
+                                                             page_size=inventory_page_size)
+    if app_dependencies_file:
+        with open(app_dependencies_file) as file:
+            app_migration.app_dependencies = app_dependencies_from_mapping(json.load(file))
+    if shape_bandwidth and not skip_data_import:
+        model_caps = None
+        if device_model_caps_file:
+            with open(device_model_caps_file) as file:
+                model_caps = json.load(file)
+        app_migration.bandwidth_shaper = BandwidthShaper(max_total_kbps or None, max_device_kbps or None, model_caps)
+        logger.info(f"App-data transfer caps: {app_migration.bandwidth_shaper.describe()}")
+    journal = DeviceJournal(os.path.join(os.path.dirname(get_gmm_data_dir()), 'journal.jsonl'))
+
     # Extract gmm data tar file
     app_migration.extract_gmm_data(gmm_export_tar)
 
-    if device_file and device_file != "":
+    if plan:
+        app_migration.load_catalog(AppCatalog.from_dict(plan['catalog']))
+        devices = []
+        for device_plan in plan['devices']:
+            if device_plan['status'] == migration_planner.DEVICE_READY:
+                devices.append(device_plan['device'])
+            else:
+                logger.warning(f"Skipping device {device_plan['serial_number']} as per plan: {device_plan['reason']}")
+        logger.info(f"Executing the migration plan {plan_file} for {len(devices)} devices, estimated duration "
+                    f"{plan['summary']['estimated_seconds'] / 60:.1f} minutes")
+        device_file = None
+
+    elif device_file and device_file != "":
         logger.info(f"Found device file with name {device_file}")
         devices = read_device_serial_no(device_file)
+        if bulk_device_lookup:
+            app_migration.load_device_resolver(DeviceResolver.from_api(app_migration.api,
+                                                                       page_size=inventory_page_size))
+            # Report the serial numbers of the device file which are not in IOT-OD upfront
+            app_migration.device_resolver.resolve_serial_numbers([device_detail.get('serial_number')
+                                                                  for device_detail in devices])
 
     else:
         logger.info("Device file not found! Calling the device api to find the migrated devices...")
+        app_migration.load_device_resolver(DeviceResolver.from_api(app_migration.api, page_size=inventory_page_size))
         devices = app_migration.get_migrated_gmm_devices()
 
-    for device_detail in devices:
+    if shard:
+        shard_devices = sharding.select_shard(devices, shard_index, shard_count, device_serial_number)
+        logger.info(f"Shard {shard_index}/{shard_count} migrates {len(shard_devices)} of the {len(devices)} devices")
+        devices = shard_devices
+
+    if preflight:
+        if app_migration.device_resolver is None:
+            app_migration.load_device_resolver(DeviceResolver.from_api(app_migration.api,
+                                                                       page_size=inventory_page_size))
+        devices, not_ready = device_preflight.DevicePreflight(
+            app_migration.device_resolver, tcp_check=preflight_tcp,
+            connect_timeout=connect_timeout).partition(devices, device_serial_number)
+        for result in not_ready:
+            journal.record(result['serial_number'], journal_events.SKIPPED, reason=result['reason'])
+
+    if plan:
+        plan_seconds = {device_plan['serial_number']: device_plan['estimated_seconds']
+                        for device_plan in plan['devices']}
+        device_cost = lambda serial_number: plan_seconds.get(serial_number, 0.0)
+    else:
+        device_cost = migration_planner.DeviceCostEstimator(
+            get_gmm_data_dir(),
+            migration_planner.StepDurationEstimator.from_file(timings_file) if timings_file else
+            migration_planner.StepDurationEstimator.from_timings(app_migration.timing_store.timings()),
+            app_migration.device_resolver, skip_data_import, get_app_data_root()).estimate
+    device_seconds = {device_serial_number(device_detail): device_cost(device_serial_number(device_detail))
+                      for device_detail in devices}
+    if device_order == migration_planner.ORDER_LONGEST_FIRST:
+        devices = migration_planner.order_longest_first(devices, device_seconds.get, device_serial_number)
+    # The work queue reports the ETA of the whole queue instead
+    eta = None if work_queue_file else migration_planner.EtaPredictor(device_seconds)
+    if not work_queue_file:
+        metrics.devices_total = len(devices)
+        metrics.eta = eta.remaining_seconds
+
+    def device_failed(device):
+        return device is None or any(app.deploy_status == 'Failed' for app in device.applications)
+
+    def resolve_device(device_detail):
+        """ Make the device the current device of the app migration and return it """
+        if device_file and device_file != "":
+            app_migration.network_ip = device_detail.get('network_ip')
+            app_migration.network_grp = device_detail.get('network_grp')
+            app_migration.skip_vpn_trust = device_detail.get('skip_vpn_trust')
+            app_migration.vpn_user = device_detail.get('vpn_user')
+            app_migration.vpn_pwd = device_detail.get('vpn_pwd')
+
+            # app_migration.import_app('iox_app.tar', 'iox_app.ini', './')
+            # app_migration.show_profile()
+            app_migration.get_target_device_details(device_ip=device_detail.get('device_ip'),
+                                                    profile_name=config.app_migration_vars.get('iox_profile_name'),
+                                                    port=device_detail.get('port'),
+                                                    serial_number=device_detail.get('serial_number'))
+        else:
+            app_migration.parse_device_info(device_detail,
+                                            profile_name=config.app_migration_vars.get('iox_profile_name'))
+        return app_migration.device
+
+    def load_device(device_detail):
+        """ Make the device the current device of the app migration and export the app data of its apps """
+        resolve_device(device_detail)
+        if not app_migration.skip_data_migration:
+            if deploy_group_size > 1 and app_migration.device:
+                # Data of the whole group is exported before the first uninstall so keep one file per device
+                app_migration.scope_app_data_to_device()
+            app_migration.export_app_data()
+
+        logger.debug(f"Skip_data_import: {app_migration.skip_data_migration}\n "
+                     f"skip_managed_app : {app_migration.skip_managed_apps}\n "
+                     f"continue_on_error : {app_migration.continue_on_error}\n "
+                     f"skip_starting_app : {app_migration.skip_starting_app}")
+
+    def install_window(device_window):
+        """ Install the apps of the devices of the window with grouped jobs and return the migrated devices """
+        migrated_devices, prepared_devices = [], []
+        metrics.device_started(len(device_window))
+        for device_detail in device_window:
+            app_migration.device = None
+            try:
+                logger.info(f"Preparing app import for device with serial number "
+                            f"{device_detail.get('serial_number')}...")
+                load_device(device_detail)
+                if app_migration.prepare_import():
+                    prepared_devices.append(app_migration.device)
+                    continue
+            except Exception as exp:
+                logger.error(traceback.format_exc())
+            if app_migration.device:
+                app_migration.finish_device()
+                migrated_devices.append(app_migration.device)
+        try:
+            app_migration.import_apps_grouped(prepared_devices, group_size=deploy_group_size,
+                                              max_wait_time=max_wait_time)
+        except Exception as exp:
+            logger.error(traceback.format_exc())
+        finally:
+            for device in prepared_devices:
+                app_migration.device = device
+                app_migration.finish_device()
+        for device in migrated_devices + prepared_devices:
+            metrics.device_finished(failed=device_failed(device))
+        if len(device_window) > len(migrated_devices) + len(prepared_devices):
+            metrics.device_finished(failed=True, count=len(device_window) - len(migrated_devices) -
+                                    len(prepared_devices))
+        return migrated_devices + prepared_devices
+
+    def resolve_upcoming_device(device_detail):
+        """ Load an upcoming device for the prefetcher, with app-data file names of its own """
+        app_migration.device = None
+        device = resolve_device(device_detail)
+        if device:
+            app_migration.scope_app_data_to_device(device)
+        return device
+
+    prefetcher = None
+    if prefetch and not skip_data_import and deploy_group_size <= 1:
+        prefetcher = AppDataPrefetcher(resolve_upcoming_device, app_migration.export_app_data,
+                                       app_migration.remove_app_data, device_serial_number, lookahead=prefetch,
+                                       max_bytes=prefetch_budget_mb * 1024 * 1024)
+        logger.info(f"Prefetching the app data of the next {prefetch} devices with a budget of "
+                    f"{prefetch_budget_mb} MB")
+    elif prefetch:
+        logger.warning("--prefetch is only used when the app data is migrated without --deploy-group-size")
+
+    retry_queue = DeferredRetryQueue(max_attempts=device_retries + 1, backoff_seconds=retry_backoff)
+    if device_timeout > 0 and deploy_group_size > 1:
+        logger.warning("--device-timeout is only used when the devices are installed without --deploy-group-size")
+
+    def install_device(device_detail, attempt=1):
+        """ Install the apps of one device within its time budget and return the migrated device, a device which
+        exceeded its budget is deferred to a later attempt and not returned """
+        app_migration.device = None
+        app_migration.deadline = Deadline(device_timeout) if device_timeout > 0 else None
+        deferred = False
+        metrics.device_started()
         try:
             logger.info(f"Starting app import for device with serial number {device_detail.get('serial_number')}...")
-            if device_file and device_file != "":
-                app_migration.network_ip = device_detail.get('network_ip')
-                app_migration.network_grp = device_detail.get('network_grp')
-                app_migration.skip_vpn_trust = device_detail.get('skip_vpn_trust')
-                app_migration.vpn_user = device_detail.get('vpn_user')
-                app_migration.vpn_pwd = device_detail.get('vpn_pwd')
-
-                # app_migration.import_app('iox_app.tar', 'iox_app.ini', './')
-                # app_migration.show_profile()
-                app_migration.get_target_device_details(device_ip=device_detail.get('device_ip'),
-                                                        profile_name=config.app_migration_vars.get('iox_profile_name'),
-                                                        port=device_detail.get('port'),
-                                                        serial_number=device_detail.get('serial_number'))
-            else:
-                app_migration.parse_device_info(device_detail,
-                                                profile_name=config.app_migration_vars.get('iox_profile_name'))
-            if not app_migration.skip_data_migration:
-                app_migration.export_app_data()
-
-            logger.debug(f"Skip_data_import: {app_migration.skip_data_migration}\n "
-                         f"skip_managed_app : {app_migration.skip_managed_apps}\n "
-                         f"continue_on_error : {app_migration.continue_on_error}\n "
-                         f"skip_starting_app : {app_migration.skip_starting_app}")
+            app_migration.device = prefetcher.take(device_detail) if prefetcher else None
+            if app_migration.device is None:
+                load_device(device_detail)
             app_migration.import_app(max_wait_time=max_wait_time)
             logger.info(f"End import for device with serial number {device_detail.get('serial_number')}")
+        except DeviceTimeoutError as err:
+            logger.error(f"Cancelled the import for device with serial number {device_detail.get('serial_number')} "
+                         f"in attempt {attempt}: {err}")
+            if app_migration.device:
+                app_migration.record_timeout(err)
+                deferred = retry_queue.defer(app_migration.device.serial_number, device_detail, attempt)
+                if deferred:
+                    journal.record(app_migration.device.serial_number, journal_events.TIMED_OUT, attempt=attempt,
+                                   passed=sum(app.deploy_status == 'Passed'
+                                              for app in app_migration.device.applications))
         except NameError as err:
             logger.error(traceback.format_exc())
         except Exception as exp:
             logger.error(traceback.format_exc())
         finally:
-            if app_migration.device:
-                app_migration.make_app_migration_report()
+            app_migration.deadline = None
+            if app_migration.device and not deferred:
+                app_migration.finish_device()
+            if deferred:
+                metrics.device_deferred()
+            else:
+                metrics.device_finished(failed=device_failed(app_migration.device))
+            if prefetcher:
+                prefetcher.release(app_migration.device)
+        return [app_migration.device] if app_migration.device and not deferred else []
+
+    def install_devices(device_list, upcoming=(), attempt=1):
+        for device_detail in device_list:
+            journal.record(device_serial_number(device_detail), journal_events.STARTED)
+        if deploy_group_size > 1:
+            migrated_devices = [device for device_window in chunked(device_list, deploy_group_size)
+                                for device in install_window(device_window)]
+        else:
+            migrated_devices = []
+            for index, device_detail in enumerate(device_list):
+                if prefetcher:
+                    prefetcher.prefetch(list(device_list[index + 1:]) + list(upcoming))
+                migrated_devices.extend(install_device(device_detail, attempt))
+        for device in migrated_devices:
+            journal.record(device.serial_number, journal_events.FINISHED,
+                           passed=sum(app.deploy_status == 'Passed' for app in device.applications),
+                           failed=sum(app.deploy_status == 'Failed' for app in device.applications))
+        migrated_serial_numbers = {device.serial_number for device in migrated_devices}
+        for device_detail in device_list:
+            serial_number = device_serial_number(device_detail)
+            if serial_number not in migrated_serial_numbers and serial_number not in retry_queue:
+                journal.record(serial_number, journal_events.SKIPPED)
+            if eta and serial_number not in retry_queue:
+                eta.finished(serial_number)
+        if eta:
+            eta.log_progress()
+        return migrated_devices
+
+    def retry_timed_out_devices():
+        """ Retry the devices which exceeded their time budget, with backoff, and return the serial number of every
+        retried device with its migrated device, None when its last attempt could not migrate it """
+        retried_devices = {}
+        if len(retry_queue):
+            logger.info(f"Retrying the {len(retry_queue)} devices which exceeded the device time budget...")
 
+        def retry(device_detail, attempt):
+            migrated_devices = install_devices([device_detail], attempt=attempt)
+            retried_devices[device_serial_number(device_detail)] = migrated_devices[0] if migrated_devices else None
+
+        retry_queue.drain(retry)
+        return list(retried_devices.items())
+
+    if deploy_group_size > 1:
+        logger.info(f"Installing the applications with grouped jobs of up to {deploy_group_size} devices")
+    live_dashboard = LiveDashboard(metrics, 'install-gmm-app-to-iod')
+    if dashboard:
+        live_dashboard.start()
+    try:
+        if waves:
+            scheduler = WaveScheduler(devices, canary_size=canary_size, max_wave_size=max_wave_size,
+                                      max_error_rate=max_error_rate, max_backlog=max_job_backlog,
+                                      pause_seconds=wave_pause, backlog_probe=app_migration.count_running_jobs)
+            for wave in scheduler.waves():
+                scheduler.record(WaveResult.from_devices(install_devices(wave)))
+            retry_timed_out_devices()
+        elif work_queue_file:
+            work_queue = DeviceWorkQueue(work_queue_file, lease_seconds=lease_seconds)
+            work_queue.enqueue(devices, device_serial_number)
+            work_queue.start_heartbeat()
+            try:
+                while True:
+                    device_window = work_queue.lease_next(max(deploy_group_size, 1))
+                    if not device_window:
+                        break
+                    migrated_devices = {device.serial_number: device for device in install_devices(device_window)}
+                    for device_detail in device_window:
+                        device = migrated_devices.get(device_serial_number(device_detail))
+                        if device:
+                            work_queue.complete(device.serial_number,
+                                                sum(app.deploy_status == 'Passed' for app in device.applications),
+                                                sum(app.deploy_status == 'Failed' for app in device.applications))
+                        elif device_serial_number(device_detail) not in retry_queue:
+                            work_queue.complete(device_serial_number(device_detail), status=work_queue_states.FAILED)
+                    work_queue.log_progress()
+                # The timed out devices stay leased to this worker, the heartbeat renews them until their retries
+                for serial_number, device in retry_timed_out_devices():
+                    if device:
+                        work_queue.complete(serial_number,
+                                            sum(app.deploy_status == 'Passed' for app in device.applications),
+                                            sum(app.deploy_status == 'Failed' for app in device.applications))
+                    else:
+                        work_queue.complete(serial_number, status=work_queue_states.FAILED)
+            finally:
+                work_queue.close()
+        else:
+            window_size = max(deploy_group_size, 1)
+            for start in range(0, len(devices), window_size):
+                install_devices(devices[start:start + window_size],
+                                upcoming=devices[start + window_size:start + window_size + prefetch])
+            retry_timed_out_devices()
+        if app_migration.verification_sweep:
+            logger.info(f"Waiting for the verification of {len(app_migration.verification_sweep)} devices...")
+            app_migration.verification_sweep.finish()
+    finally:
+        if prefetcher:
+            prefetcher.close()
+        live_dashboard.stop()
+        app_migration.report_sink.close()
+        app_migration.tracer.close()
+        app_migration.timing_store.close()
+        journal.close()
     logger.info("Finished application import for all devices!\n")
     print("****************** Summary ******************\n")
-    report_header = ['Device Serial#', 'App Name', 'App Version', 'App Status', 'Error']
-    print(tabulate(app_migration.migration_report_data, report_header, tablefmt="pretty"))
+    print_report_table(report_file, [name for name, _ in REPORT_COLUMNS][:len(REPORT_HEADER)], REPORT_HEADER)
+    aggregates = app_migration.report_sink.aggregates
+    print(f"\nDevices: {len(aggregates.devices)}, apps passed: {aggregates.passed}, apps failed: {aggregates.failed}")
+    print(f"Apps by deploy status: {dict(aggregates.by_status)}")
+    print(tabulate([(app, counts.get('Passed', 0), counts.get('Failed', 0)) for app, counts in
+                    sorted(aggregates.by_app.items())], ['App', 'Passed', 'Failed'], tablefmt="pretty"))
+    if aggregates.by_error:
+        print(tabulate(aggregates.by_error.most_common(), ['Error', 'Apps'], tablefmt="pretty"))
+    print(tabulate(app_migration.tracer.summary(), ['Phase', 'Count', 'Seconds', 'Share'], tablefmt="pretty"))
+    print(f"Full report: {report_file}\nPhase trace: {app_migration.tracer.trace_file}")
+
+
+@migrate.command('plan', short_help='Plan offline what install-gmm-app-to-iod will do and how long it will take')
+@click.option('-ssl', '--ssl-verify', default=False, type=bool,
+              help='ssl_verify should be always true for production cluster')
+@click.option('-ignore_error', '--continue-on-error', default=os.getenv('continue_on_error', False), type=bool,
+              help='Set this to True if want to ignore errors')
+@click.option('-skip_app_data', '--skip-data-import', default=os.getenv('skip_data_import', True), type=bool,
+              help='Set this option to False if you want to plan the data import for installed apps')
+@click.option('-skip_managed_app', '--skip-managed-app', default=os.getenv('skip_managed_app', True), type=bool,
+              help='Set this to False if want to do migration for managed app as well')
+@click.option('-device_file', '--device-file', default=os.getenv('device_file'), type=click.STRING,
+              help='Plan only the devices of this serial number csv file, by default all devices of the GMM export')
+@click.option('-snapshot', '--snapshot', 'snapshot_file', default=None, type=click.Path(exists=True),
+              help='Plan fully offline from a IoT-OD catalog and device inventory snapshot file')
+@click.option('-save_snapshot', '--save-snapshot', default=None, type=click.Path(),
+              help='Save the fetched IoT-OD catalog and device inventory snapshot in this file')
+@click.option('-timings', '--timings', 'timings_file', default=None, type=click.Path(exists=True),
+              help='Json file or timing database with historical step durations in seconds used for the time '
+                   'estimates')
+@click.option('-workers', '--workers', default=8, type=int,
+              help='Number of parallel requests and parsing workers, default is 8')
+@click.option('-skip_migrated_apps', '--skip-migrated-apps', default=os.getenv('skip_migrated_apps', True), type=bool,
+              help='Plan the apps already running on the device with the same version as up to date, default is True')
+@click.option('-skip_app_start', '--skip-starting-app', default=os.getenv('skip_starting_app', False), type=bool,
+              help='Set this to True if the installer will not start the apps, the migrated apps then do not need '
+                   'to be running to be up to date')
+@click.option('-o', '--output', default='migration_plan.json', type=click.Path(),
+              help='Plan file to write, default is `migration_plan.json`')
+@click.argument('gmm_export_tar', type=click.Path(exists=True), required=True)
+def plan_gmm_app_migration(ssl_verify, continue_on_error, skip_data_import, skip_managed_app, device_file,
+                           snapshot_file, save_snapshot, timings_file, workers, skip_migrated_apps,
+                           skip_starting_app, output, gmm_export_tar):
+    """
+    This command computes, without changing anything, which steps install-gmm-app-to-iod will run for every device and
+    every application: uninstall of the unmanaged copy, deploy, data upload or skipped because the app is missing in
+    IOT-OD. It estimates the duration of the run from the historical step timings and writes a plan file which can be
+    executed with `install-gmm-app-to-iod --plan`.
+
+    The IOT-OD app catalog and device inventory are fetched once with a parallel paginated pass, or read from a
+    snapshot file.
+
+    Example:
+
+        python migrate.py plan --device-file=device_file_test.csv --output=plan.json ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --plan=plan.json
+
+    """
+    AppMigration.extract_gmm_data(gmm_export_tar)
+    if snapshot_file:
+        catalog, inventory = migration_planner.MigrationPlanner.load_snapshot(snapshot_file)
+    else:
+        app_migration = create_app_migration(ssl_verify=ssl_verify)
+        catalog, inventory = migration_planner.MigrationPlanner.fetch_snapshot(app_migration, max_workers=workers)
+        if save_snapshot:
+            migration_planner.MigrationPlanner.save_snapshot(save_snapshot, catalog, inventory)
+
+    estimator = migration_planner.StepDurationEstimator.from_file(timings_file) if timings_file else None
+    planner = migration_planner.MigrationPlanner(catalog, inventory, get_gmm_data_dir(),
+                                                 skip_data_migration=skip_data_import,
+                                                 skip_managed_apps=skip_managed_app,
+                                                 continue_on_error=continue_on_error, estimator=estimator,
+                                                 max_workers=workers, skip_migrated_apps=skip_migrated_apps,
+                                                 skip_starting_app=skip_starting_app)
+    serial_numbers = [device['serial_number'] for device in read_device_serial_no(device_file)] if device_file \
+        else None
+    plan = planner.plan(serial_numbers)
+    plan['gmm_export'] = os.path.abspath(gmm_export_tar)
+    migration_planner.write_plan(plan, output)
+
+    print("****************** Migration Plan ******************\n")
+    plan_header = ['Device Serial#', 'Status', 'App Name', 'App Version', 'Action', 'Steps', 'Estimate (s)']
+    plan_rows = []
+    for device_plan in plan['devices']:
+        if not device_plan['apps']:
+            plan_rows.append([device_plan['serial_number'], device_plan['status'], '', '', '', device_plan['reason'],
+                              0])
+        for app in device_plan['apps']:
+            plan_rows.append([device_plan['serial_number'], device_plan['status'], app['name'], app['version'],
+                              app['action'], ', '.join(app['steps']) or app['reason'], round(app['estimated_seconds'])])
+    print(tabulate(plan_rows, plan_header, tablefmt="pretty"))
+    summary = plan['summary']
+    print(f"\nDevices: {summary['devices_by_status']}\nApps: {summary['apps_by_action']}\nSteps: {summary['steps']}")
+    print(f"Estimated duration: {summary['estimated_seconds'] / 3600:.2f} hours")
+
+
+@migrate.command('capacity', short_help='Estimate the number of installer workers needed for a maintenance window')
+@click.option('-timing_db', '--timing-db', default=os.getenv('timing_db'), type=click.Path(exists=True),
+              help='Database of the step durations recorded by the previous runs, default is timings.db in the app '
+                   'migration data directory')
+@click.option('-devices', '--devices', default=None, type=int,
+              help='Number of devices to migrate, estimated with the average device of the previous runs when no '
+                   'GMM_EXPORT_TAR is given')
+@click.option('-device_file', '--device-file', default=os.getenv('device_file'), type=click.STRING,
+              help='Estimate only the devices of this serial number csv file, by default all devices of the GMM export')
+@click.option('-skip_app_data', '--skip-data-import', default=os.getenv('skip_data_import', True), type=bool,
+              help='Set this option to False if the app data is migrated')
+@click.option('-window_hours', '--window-hours', default=8.0, type=float,
+              help='Duration of the maintenance window in hours, default is 8')
+@click.option('-utilization', '--utilization', default=0.8, type=float,
+              help='Share of the window a worker spends migrating devices, the rest absorbs the variance, '
+                   'default is 0.8')
+@click.option('-since_days', '--since-days', default=None, type=int,
+              help='Only use the timings recorded in the last days, by default all the timings')
+@click.argument('gmm_export_tar', type=click.Path(exists=True), required=False)
+def capacity_plan(timing_db, devices, device_file, skip_data_import, window_hours, utilization, since_days,
+                  gmm_export_tar):
+    """
+    This command estimates, from the step durations recorded by the previous runs, how long the migration of the
+    given devices takes and how many installer workers (--shard or --work-queue processes) are needed to finish it
+    within a maintenance window.
+
+    Example:
+
+        python migrate.py capacity --devices=5000 --window-hours=8
+
+        python migrate.py capacity --device-file=device_file_test.csv --window-hours=8 ./archive/gmm_org_2414.tar.gz
+
+    """
+    timing_db = timing_db or os.path.join(os.path.dirname(get_gmm_data_dir()), 'timings.db')
+    if not os.path.exists(timing_db):
+        raise click.UsageError(f"No timing database {timing_db}, it is recorded by install-gmm-app-to-iod")
+    store = TimingStore(timing_db)
+    timings = store.timings(since_days)
+    device_stats = store.device_stats(since_days)
+    store.close()
+    if gmm_export_tar:
+        AppMigration.extract_gmm_data(gmm_export_tar)
+        serial_numbers = [device['serial_number'] for device in read_device_serial_no(device_file)] if device_file \
+            else [file_name[:-len('.json')] for file_name in
+                  sorted(os.listdir(os.path.join(get_gmm_data_dir(), 'devices'))) if file_name.endswith('.json')]
+        cost = migration_planner.DeviceCostEstimator(get_gmm_data_dir(),
+                                                     migration_planner.StepDurationEstimator.from_timings(timings),
+                                                     skip_data_migration=skip_data_import,
+                                                     app_data_root=get_app_data_root()).estimate
+        device_seconds = [cost(serial_number) for serial_number in serial_numbers]
+    elif devices:
+        if not device_stats['devices']:
+            raise click.UsageError("No device recorded in the timing database yet, give a GMM_EXPORT_TAR to "
+                                   "estimate the devices from their apps")
+        device_seconds = [device_stats['mean_seconds']] * devices
+    else:
+        raise click.UsageError("Give the number of devices with --devices or a GMM_EXPORT_TAR")
+
+    workers = migration_planner.workers_needed(device_seconds, window_hours * 3600, utilization)
+    print("****************** Capacity ******************\n")
+    print(tabulate(sorted((step, round(seconds, 1), round(timings['bytes_per_second'].get(step) or 0))
+                          for step, seconds in timings['steps'].items()),
+                   ['Step', 'Average (s)', 'Bytes/s'], tablefmt="pretty"))
+    print(f"\nRecorded devices: {device_stats['devices']}, average device "
+          f"{(device_stats['mean_seconds'] or 0) / 60:.1f} minutes")
+    print(f"Devices to migrate: {len(device_seconds)}, total {sum(device_seconds) / 3600:.2f} worker hours, "
+          f"longest device {max(device_seconds, default=0) / 60:.1f} minutes")
+    if workers is None:
+        print(f"The longest device does not fit in {window_hours * utilization:.1f} hours of the window")
+    else:
+        print(f"Workers needed for a {window_hours:g} hours window at {utilization:.0%} utilization: {workers}")
+
+
+@migrate.command('preflight', short_help='Check that the target devices are ready before the maintenance window')
+@click.option('-ssl', '--ssl-verify', default=False, type=bool,
+              help='ssl_verify should be always true for production cluster')
+@click.option('-device_file', '--device-file', default=os.getenv('device_file'), type=click.STRING,
+              help='Check the devices of this serial number csv file, by default all devices of the GMM export')
+@click.option('-tcp', '--tcp-check', default=False, type=bool,
+              help='Set this to True to also open a TCP connection to the ip address and port of every device')
+@click.option('-connect_timeout', '--connect-timeout', default=3.0, type=float,
+              help='Timeout in seconds of the TCP connections, default is 3')
+@click.option('-ready_status', '--ready-status', multiple=True, default=device_preflight.READY_DEVICE_STATUSES,
+              help='IoT-OD device status considered ready, can be given several times, default is DISCOVERED')
+@click.option('-workers', '--workers', default=64, type=int,
+              help='Number of TCP connections opened at the same time, default is 64')
+@click.option('-page_size', '--inventory-page-size', default=int(os.getenv('inventory_page_size', 1000)), type=int,
+              help='Page size of the IoT-OD device inventory pull, default is 1000')
+@click.option('-o', '--output', default='ready_devices.csv', type=click.Path(),
+              help='Device file of the ready devices for install-gmm-app-to-iod --device-file, default is '
+                   '`ready_devices.csv`')
+@click.option('-report', '--report', 'report_file', default='preflight_report.json', type=click.Path(),
+              help='Json report of the check of every device, default is `preflight_report.json`')
+@click.argument('gmm_export_tar', type=click.Path(exists=True), required=False)
+def preflight_devices(ssl_verify, device_file, tcp_check, connect_timeout, ready_status, workers,
+                      inventory_page_size, output, report_file, gmm_export_tar):
+    """
+    This command checks, without changing anything, that every target device is in IOT-OD with a ready status and
+    optionally that it accepts a TCP connection. The IOT-OD statuses come from one paginated inventory pull and the
+    TCP connections are opened in parallel. The ready devices are written to a device file for
+    install-gmm-app-to-iod and the reason of every device which is not ready to the report.
+
+    Example:
+
+        python migrate.py preflight --device-file=device_file_test.csv --tcp-check=True --output=ready_devices.csv
+
+        python migrate.py preflight --output=ready_devices.csv ./archive/gmm_org_2414.tar.gz
+
+        python migrate.py install-gmm-app-to-iod --device-file=ready_devices.csv ./archive/gmm_org_2414.tar.gz
+
+    """
+    if device_file:
+        devices = read_device_serial_no(device_file)
+    elif gmm_export_tar:
+        AppMigration.extract_gmm_data(gmm_export_tar)
+        devices = [{'serial_number': file_name[:-len('.json')]} for file_name in
+                   sorted(os.listdir(os.path.join(get_gmm_data_dir(), 'devices'))) if file_name.endswith('.json')]
+    else:
+        raise click.UsageError("Give the devices to check with --device-file or a GMM_EXPORT_TAR")
+    app_migration = create_app_migration(ssl_verify=ssl_verify)
+    checker = device_preflight.DevicePreflight(DeviceResolver.from_api(app_migration.api,
+                                                                       page_size=inventory_page_size),
+                                               ready_statuses=ready_status, tcp_check=tcp_check,
+                                               connect_timeout=connect_timeout, max_workers=workers)
+    results = checker.check(devices, device_serial_number)
+    device_preflight.write_ready_device_file(output, [result['serial_number'] for result in results
+                                                      if result['status'] == device_preflight.READY])
+    device_preflight.write_preflight_report(report_file, results)
+
+    print("****************** Preflight ******************\n")
+    print(tabulate([(result['serial_number'], result['status'], result['device_status'], result['address'],
+                     result['connect_ms'], result['reason']) for result in results
+                    if result['status'] != device_preflight.READY],
+                   ['Device Serial#', 'Status', 'IoT-OD Status', 'Address', 'Connect (ms)', 'Reason'],
+                   tablefmt="pretty"))
+    ready = sum(result['status'] == device_preflight.READY for result in results)
+    print(f"\nDevices ready: {ready}, not ready: {len(results) - ready}")
+    print(f"Ready device file: {output}\nPreflight report: {report_file}")
+
+
+@migrate.command('bench', short_help='Benchmark the local hot paths of the migration on synthetic data')
+@click.option('-only', '--only', multiple=True, type=click.Choice(list(benchmark.BENCHMARKS)),
+              help='Benchmark to run, can be given several times, default is all benchmarks')
+@click.option('-size', '--size', default=1000, type=int,
+              help='Number of apps, devices or records of the synthetic data sets, default is 1000')
+@click.option('-params', '--params', default=20, type=int,
+              help='Number of app specific params of every synthetic app, default is 20')
+@click.option('-data_mb', '--data-mb', default=16, type=int,
+              help='Size in MB of the synthetic app-data files, default is 16')
+@click.option('-repeat', '--repeat', default=5, type=int, help='Number of timed runs of every benchmark, default is 5')
+@click.option('-with_logging', '--with-logging', default=False, type=bool,
+              help='Set this to True to keep the info logs of the benchmarked code in the measurement')
+@click.option('-output', '--output', default=None, type=click.Path(),
+              help='Json file where the results are written')
+@click.option('-compare', '--compare', default=None, type=click.Path(exists=True),
+              help='Json results of a previous run to compare with')
+def bench(only, size, params, data_mb, repeat, with_logging, output, compare):
+    """
+    This command will time the CPU, disk and memory heavy parts of the migration which do not need a server: app name
+    and gmm config formatting, deploy payload building, multipart encoding of the app-data uploads, export json
+    writing, tar extraction and device csv parsing. The results are machine readable json so that versions can be
+    compared.
+
+    Example:
+
+        python migrate.py bench --size=10000 --output=bench_1.0.0.json
+
+        python migrate.py bench --only=get_and_format_gmm_config --compare=bench_1.0.0.json
+
+    """
+    results = benchmark.run_benchmarks(list(only) or None, size, params, data_mb, repeat, with_logging)
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        logger.info(f"Benchmark results have been written in {output}")
+    print(tabulate([(name, result['items'], result['best_seconds'], result['mean_seconds'],
+                     result['items_per_second'], result['mb_per_second'])
+                    for name, result in results['results'].items()],
+                   ['Benchmark', 'Items', 'Best s', 'Mean s', 'Items/s', 'MB/s'], tablefmt="pretty"))
+    if compare:
+        with open(compare) as file:
+            baseline = json.load(file)
+        print(tabulate(benchmark.compare_results(baseline, results), ['Benchmark', 'Baseline s', 'Current s', 'Ratio'],
+                       tablefmt="pretty"))
+
+
+@migrate.command('generate-synthetic-export', short_help='Generate a GMM export of any size for scale testing')
+@click.option('-apps', '--apps', default=10, type=int, help='Number of GMM apps, default is 10')
+@click.option('-gateways', '--gateways', default=100, type=int, help='Number of gateways, default is 100')
+@click.option('-fan_out', '--fan-out', default=3, type=int,
+              help='Number of apps installed on every gateway, default is 3')
+@click.option('-params', '--params', default=20, type=int,
+              help='Number of app specific params of every app and installation, default is 20')
+@click.option('-app_data_kb', '--app-data-kb', default=0, type=int,
+              help='Size in KB of every app-data tarball, default is 0 which writes no app data')
+@click.option('-app_data_files', '--app-data-files', default=4, type=int,
+              help='Number of files in every app-data tarball, default is 4')
+@click.option('-per_device_app_data', '--per-device-app-data', default=False, type=bool,
+              help='Set this to True to write one app-data tarball per app per gateway for grouped installs')
+@click.option('-org', '--org-id', default=2414, type=int, help='GMM organization id of the export')
+@click.option('-seed', '--seed', default=0, type=int, help='Seed of the app to gateway assignment')
+@click.option('-compression', '--compression', default=archive.GZIP, type=click.Choice(archive.COMPRESSIONS),
+              help='Compression of the export archive, default is `gzip`')
+@click.option('-output_dir', '--output-dir', default=None, type=click.Path(),
+              help='Directory where the export is written, default is the app migration data directory')
+def generate_synthetic_export(apps, gateways, fan_out, params, app_data_kb, app_data_files, per_device_app_data,
+                              org_id, seed, compression, output_dir):
+    """
+    This command will generate a GMM export archive with the same layout as export-gmm-app-details, the matching
+    device csv for install-gmm-app-to-iod --device-file, a matching IOT-OD snapshot for plan --snapshot and optionally
+    the app-data tarballs, so the import path can be tested with any number of devices without a real organization.
+
+    Example:
+
+        python migrate.py generate-synthetic-export --apps=50 --gateways=100000 --fan-out=4 --output-dir=./synthetic
+
+        python migrate.py plan --snapshot=./synthetic/iotod_snapshot.json --device-file=./synthetic/devices.csv ./synthetic/gmm_org_2414_synthetic.tar.gz
+
+    """
+    output_dir = output_dir or os.path.dirname(get_gmm_data_dir())
+    generator = synthetic_export.SyntheticExportGenerator(apps, gateways, fan_out, params, app_data_kb,
+                                                          app_data_files, per_device_app_data, org_id, seed,
+                                                          compression)
+    paths = generator.generate(output_dir)
+    print(f"Export: {paths['export']}\nDevice file: {paths['device_file']}\nIOT-OD snapshot: {paths['snapshot']}")
+
+
+@migrate.command('merge-reports', short_help='Merge the reports of the shards of a migration into one report')
+@click.option('-output', '--output', default=None, type=click.Path(),
+              help='Merged report file, jsonl when it ends with .jsonl and csv otherwise, default is '
+                   'merged_migration_report_<timestamp>.csv in the app migration data directory')
+@click.option('-all_rows', '--all-rows', default=False, type=bool,
+              help='Set this to True to keep every row instead of the latest row of every device and app')
+@click.option('-journal', '--journal', multiple=True, type=click.Path(exists=True),
+              help='Journal of a shard, can be given several times to list the devices which did not finish')
+@click.argument('report_files', nargs=-1, type=click.Path(exists=True), required=True)
+def merge_migration_reports(output, all_rows, journal, report_files):
+    """
+    This command will merge the csv or jsonl reports written by several install-gmm-app-to-iod processes, e.g. the
+    shards of a migration, into one report and print its summary. When a device has been migrated more than once only
+    its latest rows are kept.
+
+    Example:
+
+        python migrate.py merge-reports --output=./archive/merged_report.csv ./archive/shard_*_of_4/reports/*.csv
+
+        python migrate.py merge-reports --journal=./archive/shard_1_of_4/journal.jsonl ./archive/shard_1_of_4/reports/*.csv
+
+    """
+    output = output or os.path.join(os.path.dirname(get_gmm_data_dir()),
+                                    f"merged_migration_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    columns = [name for name, _ in REPORT_COLUMNS]
+    aggregates = merge_reports(report_files, output, columns, latest_only=not all_rows)
+    logger.info(f"{len(report_files)} reports have been merged in {output}")
+    print_report_table(output, columns[:len(REPORT_HEADER)], REPORT_HEADER)
+    print(f"\nDevices: {len(aggregates.devices)}, apps passed: {aggregates.passed}, apps failed: {aggregates.failed}")
+    if aggregates.by_error:
+        print(tabulate(aggregates.by_error.most_common(), ['Error', 'Apps'], tablefmt="pretty"))
+    unfinished = [(serial_number, entry['event'], entry['time'], journal_file) for journal_file in journal
+                  for serial_number, entry in read_journal(journal_file).items()
+                  if entry['event'] in (journal_events.STARTED, journal_events.TIMED_OUT)]
+    if unfinished:
+        print(f"\n{len(unfinished)} devices were started and did not finish:")
+        print(tabulate(unfinished, ['Serial Number', 'Event', 'Time', 'Journal'], tablefmt="pretty"))
+    print(f"Merged report: {output}")
+
+
+@migrate.command('queue-status', short_help='Show the depth and throughput of an installer work queue')
+@click.option('-window', '--window', default=300, type=int,
+              help='Seconds over which the recent throughput is measured, default is 300')
+@click.argument('work_queue_file', type=click.Path(exists=True))
+def queue_status(window, work_queue_file):
+    """
+    This command will show how many devices of a work queue shared by install-gmm-app-to-iod --work-queue processes
+    are pending, leased by every worker, done and failed, and the throughput of the workers.
+
+    Example:
+
+        python migrate.py queue-status ./archive/queue.db
+
+    """
+    work_queue = DeviceWorkQueue(work_queue_file, worker='queue-status')
+    try:
+        stats = work_queue.stats(window)
+    finally:
+        work_queue.close()
+    print(tabulate([(stats['pending'], stats['leased'], stats['done'], stats['failed'], stats['devices_per_minute'],
+                     stats['recent_devices_per_minute'])],
+                   ['Pending', 'Leased', 'Done', 'Failed', 'Devices/min', f'Last {window}s devices/min'],
+                   tablefmt="pretty"))
+    if stats['workers']:
+        print(tabulate(sorted(stats['workers'].items()), ['Worker', 'Leased devices'], tablefmt="pretty"))
 
 
 @migrate.command('export-gmm-app-details', short_help='Export all applications details with their configurations from GMM')
@@ -203,7 +1087,21 @@ def migrate_gmm_app(auth_type, ssl_verify, platform, continue_on_error, skip_dat
               help='GMM Organization ID')
 @click.option('-key', '--api-key', default=config.app_migration_vars.get('GMM_API_KEY'), type=str,
               help='GMM Api Access Key')
-def export_gmm_app_details(base_url, org_id, api_key):
+@click.option('-compression', '--compression', default=os.getenv('export_compression', archive.GZIP),
+              type=click.Choice(archive.COMPRESSIONS),
+              help='Compression of the exported archive, `gzip` is multi-threaded (uses pigz when installed) and '
+                   '`zstd` needs the zstandard module or the zstd tool, default is `gzip`')
+@click.option('-level', '--compression-level', default=os.getenv('export_compression_level'), type=int,
+              help='Compression level, defaults to 6 for gzip and 3 for zstd')
+@click.option('-threads', '--compression-threads', default=os.getenv('export_compression_threads'), type=int,
+              help='Number of compression threads, defaults to the number of cpus')
+@click.option('-trace_file', '--trace-file', default=os.getenv('trace_file', None), type=click.Path(),
+              help='Chrome trace json file where the timing of every export phase is written')
+@click.option('-dashboard', '--dashboard', default=os.getenv('dashboard', False), type=bool,
+              help='Set this to True to show a live dashboard of the request rate, stage queues and latency instead '
+                   'of the logs, which then only go to the log file')
+def export_gmm_app_details(base_url, org_id, api_key, compression, compression_level, compression_threads,
+                           trace_file, dashboard):
     """
     This command will export all applications details from the given GMM organization. Exported data includes the
     uploaded application details, details of applications installed on devices, templates and policies. This details
@@ -222,24 +1120,28 @@ def export_gmm_app_details(base_url, org_id, api_key):
 
         python migrate.py export-gmm-app-details --base-url=https://jokerdev.iotspdev.io/api/v2/ --org-id=2766 --api-key=435535ghsh
 
+        python migrate.py export-gmm-app-details --compression=zstd --compression-level=10
+
+        python migrate.py export-gmm-app-details --dashboard=True
+
     """
-    app_migration = AppMigration(iox_client_host=config.app_migration_vars.get('iox_client_host'),
-                                 iox_user=config.app_migration_vars.get('iox_user'),
-                                 iox_password=config.app_migration_vars.get('iox_password'),
-                                 ssh_key_path=config.app_migration_vars.get('ssh_key_path'),
-                                 api_server=config.app_migration_vars.get('base_url'),
-                                 port=config.app_migration_vars.get('port'),
-                                 api_user=config.app_migration_vars.get('api_user'),
-                                 api_password=config.app_migration_vars.get('api_password'),
-                                 api_prefix=config.app_migration_vars.get('api_prefix'),
-                                 auth_type=os.getenv('auth_type', 'GMM'),
-                                 platform=os.getenv('platform', 'linux'),
-                                 ssl_verify=os.getenv('ssl_verify', True),
-                                 gmm_api_server=base_url,
-                                 gmm_api_key=api_key,
-                                 gmm_org_id=org_id)
-    app_migration.export_gmm_app()
-    pass
+    app_migration = create_app_migration(auth_type=os.getenv('auth_type', 'GMM'),
+                                         platform=os.getenv('platform', 'linux'),
+                                         ssl_verify=os.getenv('ssl_verify', True),
+                                         gmm_api_server=base_url,
+                                         gmm_api_key=api_key,
+                                         gmm_org_id=org_id)
+    app_migration.tracer = Tracer(trace_file)
+    live_dashboard = LiveDashboard(metrics, 'export-gmm-app-details')
+    if dashboard:
+        live_dashboard.start()
+    try:
+        app_migration.export_gmm_app(compression=compression, compression_level=compression_level,
+                                     compression_threads=compression_threads)
+    finally:
+        live_dashboard.stop()
+        app_migration.tracer.close()
+        print(tabulate(app_migration.tracer.summary(), ['Phase', 'Count', 'Seconds', 'Share'], tablefmt="pretty"))
 
 # *************************************************************************************** #
 
@@ -0,0 +1,486 @@
+import heapq
+import json
+import math
+import os
+import time
+import concurrent.futures
+from collections import Counter
+from datetime import datetime
+
+from app_migration import AppMigration, format_gmm_app_config, is_migrated_app, same_app_config
+from iox.catalog import AppCatalog
+from iox.device_resolver import DeviceResolver
+from logs import log
+from utils.timing_store import TimingStore, device_class
+
+logger = log.get_logger("Migration Planner:: ")
+
+PLAN_VERSION = 1
+
+STEP_EXPORT_DATA = 'export_data'
+STEP_UNINSTALL = 'uninstall'
+STEP_DEPLOY = 'deploy'
+STEP_UPLOAD_DATA = 'upload_data'
+STEP_VERIFY = 'verify'
+
+# Fallback duration in seconds of each step when no historical timing is available
+DEFAULT_STEP_SECONDS = {
+    STEP_EXPORT_DATA: 30.0,
+    STEP_UNINSTALL: 60.0,
+    STEP_DEPLOY: 120.0,
+    STEP_UPLOAD_DATA: 30.0,
+    STEP_VERIFY: 30.0,
+}
+
+DEVICE_READY = 'ready'
+DEVICE_BLOCKED = 'blocked'
+DEVICE_SKIPPED = 'skipped'
+
+ORDER_FILE = 'file'
+ORDER_LONGEST_FIRST = 'longest-first'
+DEVICE_ORDERS = [ORDER_FILE, ORDER_LONGEST_FIRST]
+
+# Assumed app-data transfer rate when the size of an exported app-data file is known
+APP_DATA_BYTES_PER_SECOND = 1024 * 1024
+
+APP_INSTALL = 'install'
+APP_REINSTALL = 'reinstall'
+APP_SKIPPED = 'skipped'
+APP_UP_TO_DATE = 'up_to_date'
+
+
+class StepDurationEstimator:
+    """Estimates the duration of a migration step from historical timings.
+
+    The timings file is a json document with average step durations in seconds, optionally per application and per
+    device class, and the average transfer rate of the data steps in bytes per second:
+
+        {"steps": {"deploy": 95.0, "uninstall": 40.0},
+         "apps": {"my_app:1.0.2": {"deploy": 240.0}},
+         "device_classes": {"IR829": {"upload_data": 90.0}},
+         "bytes_per_second": {"upload_data": 65536.0}}
+
+    A `TimingStore` database (`.db` file) recorded by the previous runs can be given instead of a json file.
+
+    :param step_seconds: average duration of each step over all applications
+    :param app_step_seconds: average duration of each step per `<app_name>:<app_version>`
+    :param class_step_seconds: average duration of each step per device class
+    :param bytes_per_second: average transfer rate of each data step
+    """
+
+    def __init__(self, step_seconds=None, app_step_seconds=None, class_step_seconds=None, bytes_per_second=None):
+        self.step_seconds = dict(DEFAULT_STEP_SECONDS)
+        self.step_seconds.update(step_seconds or {})
+        self.app_step_seconds = app_step_seconds or {}
+        self.class_step_seconds = class_step_seconds or {}
+        self.bytes_per_second = bytes_per_second or {}
+
+    @classmethod
+    def from_timings(cls, timings):
+        return cls(timings.get('steps'), timings.get('apps'), timings.get('device_classes'),
+                   timings.get('bytes_per_second'))
+
+    @classmethod
+    def from_file(cls, timings_file):
+        if timings_file.endswith('.db'):
+            store = TimingStore(timings_file)
+            try:
+                return cls.from_timings(store.timings())
+            finally:
+                store.close()
+        with open(timings_file) as file:
+            return cls.from_timings(json.load(file))
+
+    def estimate(self, step, app_name=None, app_version=None, device_class=None):
+        """ Duration of a step, the timing of the app version is preferred to the one of the device class """
+        app_timings = self.app_step_seconds.get(f'{app_name}:{app_version}', {})
+        class_timings = self.class_step_seconds.get(device_class, {})
+        return float(app_timings.get(step, class_timings.get(step, self.step_seconds.get(step, 0.0))))
+
+    def transfer_rate(self, step, default=APP_DATA_BYTES_PER_SECOND):
+        """ Average bytes per second of a data step """
+        return self.bytes_per_second.get(step) or default
+
+
+class DeviceCostEstimator:
+    """Estimates how long the migration of a device will take from the GMM export, without any api call.
+
+    The cost of a device is the sum of the estimated steps of its apps: the GMM installations of the device plus the
+    apps IoT-OD reports on it when the inventory record is known. An app which is already on the device needs an
+    uninstall, and its app data is exported and uploaded again when the data is migrated. When an exported app-data
+    file of the app is already on disk its size is added as transfer time.
+
+    :param gmm_data_dir: directory where the GMM export has been extracted
+    :param estimator: step duration estimator
+    :param device_resolver: IoT-OD inventory index used to find the apps already on the devices, optional
+    :param app_data_root: directory holding the `<app name>` app-data directories
+    """
+
+    def __init__(self, gmm_data_dir, estimator=None, device_resolver=None, skip_data_migration=True,
+                 app_data_root=None, bytes_per_second=None):
+        self.gmm_data_dir = gmm_data_dir
+        self.estimator = estimator or StepDurationEstimator()
+        self.device_resolver = device_resolver
+        self.skip_data_migration = skip_data_migration
+        self.app_data_root = app_data_root
+        # The recorded upload rate is the slowest side of the transfer, the download is usually faster
+        self.bytes_per_second = bytes_per_second or self.estimator.transfer_rate(STEP_UPLOAD_DATA)
+
+    def gmm_apps(self, serial_number):
+        """ (name, version) of the apps installed on the device in GMM """
+        try:
+            with open(os.path.join(self.gmm_data_dir, 'devices', f'{serial_number}.json')) as file:
+                installations = json.load(file)
+        except (OSError, ValueError):
+            return []
+        return [(installation['fog_application']['name'], installation['fog_application']['version'])
+                for installation in installations if installation.get('fog_application')]
+
+    def app_data_size(self, app_name, serial_number):
+        if not self.app_data_root:
+            return 0
+        for file_name in (f'{app_name}-{serial_number}-datamount.tar.gz', f'{app_name}-datamount.tar.gz'):
+            try:
+                return os.path.getsize(os.path.join(self.app_data_root, app_name, file_name))
+            except OSError:
+                continue
+        return 0
+
+    def estimate(self, serial_number):
+        device = self.device_resolver.resolve(serial_number=serial_number) if self.device_resolver else None
+        on_device = {(AppMigration.format_app_name(app['name']), app['version'])
+                     for app in (device or {}).get('apps', [])}
+        klass = device_class((device or {}).get('deviceType') or (device or {}).get('model'))
+        seconds = 0.0
+        for app_name, app_version in set(self.gmm_apps(serial_number)) | on_device:
+            steps = [STEP_DEPLOY, STEP_VERIFY]
+            if (app_name, app_version) in on_device:
+                steps.append(STEP_UNINSTALL)
+                if not self.skip_data_migration:
+                    steps += [STEP_EXPORT_DATA, STEP_UPLOAD_DATA]
+                    # The data is downloaded from the device and uploaded back
+                    seconds += 2 * self.app_data_size(app_name, serial_number) / self.bytes_per_second
+            seconds += sum(self.estimator.estimate(step, app_name, app_version, klass) for step in steps)
+        return seconds
+
+
+class EtaPredictor:
+    """Predicts when a running migration ends from the estimated cost of the devices left.
+
+    The estimates of the devices are calibrated with the pace of the run: once some devices are done, the estimate of
+    the remaining devices is scaled by the wall time spent so far over the estimate of the devices done, which also
+    accounts for the parallel app imports and the devices migrated by other options of the run.
+
+    Example:
+
+        eta = EtaPredictor({serial_number(device): cost(device) for device in devices})
+        for device in devices:
+            migrate(device)
+            eta.finished(serial_number(device))
+            eta.log_progress()
+
+    :param estimates: estimated seconds of every device to migrate, by serial number
+    """
+
+    def __init__(self, estimates):
+        self.estimates = dict(estimates)
+        self.done = set()
+        self.done_seconds = 0.0
+        self.started = time.time()
+
+    def finished(self, serial_number):
+        if serial_number in self.estimates and serial_number not in self.done:
+            self.done.add(serial_number)
+            self.done_seconds += self.estimates[serial_number]
+
+    def remaining_seconds(self):
+        remaining = sum(self.estimates.values()) - self.done_seconds
+        if self.done_seconds > 0:
+            remaining *= (time.time() - self.started) / self.done_seconds
+        return max(0.0, remaining)
+
+    def log_progress(self):
+        remaining = self.remaining_seconds()
+        end = datetime.fromtimestamp(time.time() + remaining).strftime('%Y-%m-%d %H:%M')
+        logger.info(f"ETA: {len(self.done)} of {len(self.estimates)} devices done, {remaining / 3600:.2f} hours "
+                    f"left, finishing around {end}")
+
+
+def workers_needed(device_seconds, window_seconds, utilization=0.8):
+    """Number of installer workers migrating the devices within the window, with the longest first list schedule.
+
+    :param device_seconds: estimated seconds of every device
+    :param window_seconds: duration of the maintenance window
+    :param utilization: share of the window a worker spends on the devices, the rest absorbs the variance
+    :return: number of workers, None when a single device does not fit in the window
+    """
+    usable_seconds = window_seconds * utilization
+    if not device_seconds:
+        return 0
+    if max(device_seconds) > usable_seconds:
+        return None
+    workers = max(1, math.ceil(sum(device_seconds) / usable_seconds))
+    # The longest first schedule is within 4/3 of the optimum, check the makespan and add workers when needed
+    while True:
+        loads = [0.0] * workers
+        for seconds in sorted(device_seconds, reverse=True):
+            heapq.heappush(loads, heapq.heappop(loads) + seconds)
+        if max(loads) <= usable_seconds:
+            return workers
+        workers += 1
+
+
+def order_longest_first(devices, cost, serial_number=lambda device: device.get('serial_number')):
+    """Order the devices by decreasing estimated cost, the longest-processing-time-first list schedule.
+
+    Starting the longest devices first keeps a device with many apps or a lot of app data from starting last and
+    stretching the end of the run, and when the devices are handed to parallel workers in this order the makespan is
+    within 4/3 of the optimum.
+
+    :param devices: device details or IoT-OD device records
+    :param cost: callable returning the estimated seconds of a serial number
+    :param serial_number: callable returning the serial number of a device
+    :return: the ordered devices
+    """
+    costs = {id(device): cost(serial_number(device)) for device in devices}
+    ordered = sorted(devices, key=lambda device: costs[id(device)], reverse=True)
+    if ordered:
+        logger.info(f"Ordered {len(ordered)} devices longest first, estimated "
+                    f"{sum(costs.values()) / 3600:.2f} hours in total, longest device "
+                    f"{serial_number(ordered[0])} {costs[id(ordered[0])] / 60:.1f} minutes, shortest device "
+                    f"{serial_number(ordered[-1])} {costs[id(ordered[-1])] / 60:.1f} minutes")
+    return ordered
+
+
+class MigrationPlanner:
+    """Computes offline what `install-gmm-app-to-iod` will do for every device and how long it will take.
+
+    The decisions mirror `AppMigration.parse_device_info`, `AppMigration.parse_gmm_device_info` and
+    `AppMigration.import_app`, but they are taken from one snapshot of the IoT-OD catalog and device inventory
+    instead of one search request per app per device.
+
+    :param catalog: IoT-OD application catalog snapshot
+    :param inventory: list of IoT-OD device records fetched with the app details
+    :param gmm_data_dir: directory where the GMM export has been extracted
+    :param estimator: step duration estimator
+    """
+
+    def __init__(self, catalog: AppCatalog, inventory: list, gmm_data_dir: str, skip_data_migration=True,
+                 skip_managed_apps=True, continue_on_error=False, estimator=None, max_workers=8,
+                 skip_migrated_apps=True, skip_starting_app=False):
+        self.catalog = catalog
+        self.device_resolver = DeviceResolver(inventory)
+        self.gmm_data_dir = gmm_data_dir
+        self.skip_data_migration = skip_data_migration
+        self.skip_managed_apps = skip_managed_apps
+        self.continue_on_error = continue_on_error
+        self.estimator = estimator or StepDurationEstimator()
+        self.max_workers = max_workers
+        self.skip_migrated_apps = skip_migrated_apps
+        self.skip_starting_app = skip_starting_app
+
+    @staticmethod
+    def fetch_snapshot(app_migration: AppMigration, page_size=100, max_workers=8):
+        """ Fetch the IoT-OD catalog and device inventory with one parallel paginated pass each """
+        catalog = AppCatalog.from_api(app_migration.api, page_size, max_workers)
+        inventory = DeviceResolver.from_api(app_migration.api, max_workers=max_workers).devices
+        return catalog, inventory
+
+    @staticmethod
+    def save_snapshot(snapshot_file, catalog: AppCatalog, inventory: list):
+        with open(snapshot_file, 'w') as file:
+            json.dump({'created': datetime.now().isoformat(), 'catalog': catalog.to_dict(), 'devices': inventory},
+                      file)
+        logger.info(f"IoT-OD snapshot has been written in {snapshot_file}")
+
+    @staticmethod
+    def load_snapshot(snapshot_file):
+        with open(snapshot_file) as file:
+            snapshot = json.load(file)
+        logger.info(f"Loaded IoT-OD snapshot taken at {snapshot.get('created')} from {snapshot_file}")
+        return AppCatalog.from_dict(snapshot['catalog']), snapshot['devices']
+
+    def gmm_serial_numbers(self):
+        """ Serial numbers of all the devices present in the GMM export """
+        return [file_name[:-len('.json')] for file_name in
+                sorted(os.listdir(os.path.join(self.gmm_data_dir, 'devices'))) if file_name.endswith('.json')]
+
+    def plan(self, serial_numbers=None):
+        """Build the migration plan for the given serial numbers, by default for every device of the GMM export.
+
+        :return: dict which can be saved with `write_plan` and executed by `install-gmm-app-to-iod --plan`
+        """
+        serial_numbers = serial_numbers if serial_numbers is not None else self.gmm_serial_numbers()
+        logger.info(f"Planning the migration of {len(serial_numbers)} devices...")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            device_plans = list(executor.map(self.plan_device, serial_numbers))
+
+        # The executor repeats the managed/unmanaged lookups so keep the records of the GMM app names as well
+        app_names = {name for device_plan in device_plans for app in device_plan['apps']
+                     for name in (app['name'], app['gmm_app_name'])}
+        step_counts = Counter(step for device_plan in device_plans for app in device_plan['apps']
+                              for step in app['steps'])
+        return {
+            'version': PLAN_VERSION,
+            'created': datetime.now().isoformat(),
+            'options': {
+                'skip_data_import': self.skip_data_migration,
+                'skip_managed_app': self.skip_managed_apps,
+                'continue_on_error': self.continue_on_error,
+                'skip_starting_app': self.skip_starting_app,
+            },
+            'summary': {
+                'devices': len(device_plans),
+                'devices_by_status': dict(Counter(device_plan['status'] for device_plan in device_plans)),
+                'apps_by_action': dict(Counter(app['action'] for device_plan in device_plans
+                                               for app in device_plan['apps'])),
+                'steps': dict(step_counts),
+                'estimated_seconds': sum(device_plan['estimated_seconds'] for device_plan in device_plans),
+            },
+            'catalog': self.catalog.to_dict(app_names),
+            'devices': device_plans,
+        }
+
+    def plan_device(self, serial_number):
+        device_plan = {
+            'serial_number': serial_number,
+            'status': DEVICE_READY,
+            'reason': '',
+            'device': self.device_resolver.resolve(serial_number=serial_number),
+            'apps': [],
+            'estimated_seconds': 0.0,
+        }
+        if device_plan['device'] is None:
+            return self._block(device_plan, DEVICE_SKIPPED, "Device not found in IoT-OD")
+        gmm_device_file = os.path.join(self.gmm_data_dir, 'devices', f'{serial_number}.json')
+        if not os.path.isfile(gmm_device_file):
+            return self._block(device_plan, DEVICE_SKIPPED, "Device data file json not found in the GMM export")
+
+        # Applications reported by IoT-OD on the device, see AppMigration.parse_device_info
+        device_apps = []
+        for app in device_plan['device'].get('apps', []):
+            app_name = AppMigration.format_app_name(app['name'])
+            if self.catalog.is_unmanaged(app['name']) or not self.skip_managed_apps:
+                app_plan = self._app_plan(app_name, app['version'], app['name'], APP_INSTALL)
+                if not self.catalog.is_managed(app_name):
+                    self._skip_missing_app(device_plan, app_plan)
+                    if device_plan['status'] == DEVICE_BLOCKED:
+                        return device_plan
+                    continue
+                device_apps.append(app_plan)
+
+        # Applications installed in GMM, see AppMigration.parse_gmm_device_info
+        with open(gmm_device_file) as file:
+            gmm_device_info = json.load(file)
+        for data in gmm_device_info:
+            gmm_app = data.get('fog_application')
+            if not gmm_app:
+                continue
+            gmm_app_detail_file = gmm_app['name'] + '_V' + gmm_app['version'].replace('.', '_') + '.json'
+            if not os.path.isfile(os.path.join(self.gmm_data_dir, 'apps', gmm_app_detail_file)):
+                return self._block(device_plan, DEVICE_BLOCKED, f"Gmm data file {gmm_app_detail_file} not found")
+            app_plan = next((app_plan for app_plan in device_apps if app_plan['name'] == gmm_app['name'] and
+                             app_plan['version'] == gmm_app['version']), None)
+            if app_plan:
+                app_plan['action'] = APP_REINSTALL
+                continue
+            app_plan = self._app_plan(gmm_app['name'], gmm_app['version'],
+                                      f"{gmm_app['organization_id']}.{gmm_app['name']}.{gmm_app['id']}", APP_INSTALL)
+            app_plan['on_device'] = False
+            if not self.catalog.is_managed(app_plan['name']):
+                self._skip_missing_app(device_plan, app_plan)
+                if device_plan['status'] == DEVICE_BLOCKED:
+                    return device_plan
+                continue
+            migrated = self._is_migrated(device_plan['device'], app_plan, format_gmm_app_config(data)) \
+                if self.skip_migrated_apps else None
+            if migrated is not None:
+                app_plan['action'] = APP_UP_TO_DATE
+                app_plan['reason'] = "Already migrated" if migrated else "Version matches, config unchecked"
+                device_plan['apps'].append(app_plan)
+                continue
+            device_apps.append(app_plan)
+
+        for app_plan in device_apps:
+            app_plan['steps'] = self._app_steps(app_plan)
+            app_plan['estimated_seconds'] = sum(self.estimator.estimate(step, app_plan['name'], app_plan['version'])
+                                                for step in app_plan['steps'])
+        device_plan['apps'].extend(device_apps)
+        device_plan['estimated_seconds'] = sum(app_plan['estimated_seconds'] for app_plan in device_plan['apps'])
+        return device_plan
+
+    def _app_steps(self, app_plan):
+        steps = []
+        if not self.skip_data_migration and app_plan['on_device']:
+            steps.append(STEP_EXPORT_DATA)
+        if app_plan['action'] == APP_REINSTALL:
+            steps.append(STEP_UNINSTALL)
+        steps.append(STEP_DEPLOY)
+        if not self.skip_data_migration and app_plan['on_device']:
+            steps.append(STEP_UPLOAD_DATA)
+        steps.append(STEP_VERIFY)
+        return steps
+
+    @staticmethod
+    def _app_plan(app_name, app_version, gmm_app_name, action):
+        return {
+            'name': app_name,
+            'version': app_version,
+            'gmm_app_name': gmm_app_name,
+            'action': action,
+            'on_device': True,
+            'steps': [],
+            'reason': '',
+            'estimated_seconds': 0.0,
+        }
+
+    def _is_migrated(self, device, app_plan, gmm_app_config):
+        """Tells if the app is already migrated on the device with the predicate of `AppMigration.find_migrated_app`.
+
+        The installer also compares the config the device reports for the app, which is only in the snapshot when the
+        device record has it.
+
+        :return: None when the app has to be migrated, True when it is migrated with the GMM app config and False when
+            the version matches but the config could not be checked
+        """
+        managed_app = self.catalog.find_app(app_plan['name'])
+        managed_app_id = managed_app['appId'] if managed_app else None
+        config_unchecked = False
+        for app in device.get('apps', []):
+            if not is_migrated_app(app, app_plan['name'], app_plan['version'], managed_app_id,
+                                   self.skip_starting_app):
+                continue
+            if app.get('config') is None:
+                config_unchecked = True
+            elif same_app_config(app['config'], gmm_app_config):
+                return True
+        return False if config_unchecked else None
+
+    def _skip_missing_app(self, device_plan, app_plan):
+        app_plan['action'] = APP_SKIPPED
+        app_plan['reason'] = f"Application with name {app_plan['name']} is not present in IOT-OD"
+        device_plan['apps'].append(app_plan)
+        if not self.continue_on_error:
+            self._block(device_plan, DEVICE_BLOCKED, app_plan['reason'])
+
+    @staticmethod
+    def _block(device_plan, status, reason):
+        logger.warning(f"Device {device_plan['serial_number']} is {status}: {reason}")
+        device_plan['status'] = status
+        device_plan['reason'] = reason
+        device_plan['estimated_seconds'] = 0.0
+        return device_plan
+
+
+def write_plan(plan, plan_file):
+    with open(plan_file, 'w') as file:
+        json.dump(plan, file, indent=2)
+    logger.info(f"Migration plan has been written in {plan_file}")
+
+
+def load_plan(plan_file):
+    with open(plan_file) as file:
+        plan = json.load(file)
+    if plan.get('version') != PLAN_VERSION:
+        raise Exception(f"Unsupported migration plan version {plan.get('version')} in {plan_file}")
+    return plan
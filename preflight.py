@@ -0,0 +1,128 @@
+import concurrent.futures
+import csv
+import json
+import socket
+import time
+
+from logs import log
+
+logger = log.get_logger("Preflight:: ")
+
+READY = 'ready'
+NOT_READY = 'not_ready'
+
+# IoT-OD statuses of a device the installer can deploy to
+READY_DEVICE_STATUSES = ('DISCOVERED',)
+# Port of the IOx local manager, checked when the inventory has no port for the device
+DEFAULT_DEVICE_PORT = 8443
+
+
+def tcp_connect_seconds(host, port, timeout):
+    """ Seconds to open a TCP connection to `host:port`, raises OSError when it can not be opened within `timeout` """
+    start = time.perf_counter()
+    with socket.create_connection((host, int(port)), timeout=timeout):
+        return time.perf_counter() - start
+
+
+class DevicePreflight:
+    """Checks upfront that the target devices can be migrated, so the installer only schedules the devices which can
+    succeed instead of finding the unreachable gateways after minutes of job waits.
+
+    A device is ready when it is in the IoT-OD inventory with one of the `ready_statuses` and, with `tcp_check`, when
+    a TCP connection to its `ipAddress:port` opens within `connect_timeout` seconds. The statuses come from one
+    inventory pull, the `DeviceResolver`, and the TCP checks run on `max_workers` threads.
+
+    Example:
+
+        preflight = DevicePreflight(DeviceResolver.from_api(api), tcp_check=True)
+        ready, not_ready = preflight.partition(devices, serial_number)
+
+    :param device_resolver: `DeviceResolver` of the IoT-OD device inventory
+    :param ready_statuses: IoT-OD device statuses considered ready
+    :param tcp_check: also open a TCP connection to every device which passed the status check
+    :param connect_timeout: seconds to wait for a TCP connection
+    :param max_workers: number of TCP checks running at the same time
+    """
+
+    def __init__(self, device_resolver, ready_statuses=READY_DEVICE_STATUSES, tcp_check=False, connect_timeout=3.0,
+                 max_workers=64):
+        self.device_resolver = device_resolver
+        self.ready_statuses = {status.upper() for status in ready_statuses}
+        self.tcp_check = tcp_check
+        self.connect_timeout = connect_timeout
+        self.max_workers = max_workers
+
+    def resolve(self, device_detail):
+        """ Inventory record of a device detail of the device file or of an IoT-OD device record """
+        return self.device_resolver.resolve(
+            serial_number=device_detail.get('serial_number') or device_detail.get('serialNumber'),
+            device_ip=device_detail.get('device_ip') or device_detail.get('ipAddress'), port=device_detail.get('port'))
+
+    def check_status(self, serial_number, device_detail):
+        """ Result of the inventory check of one device, `NOT_READY` with the reason when it failed """
+        record = self.resolve(device_detail)
+        result = {'serial_number': serial_number, 'status': READY, 'reason': '', 'device_status': None,
+                  'address': None, 'connect_ms': None}
+        if record is None:
+            result.update(status=NOT_READY, reason="Device not found in IoT-OD")
+            return result, None
+        result['device_status'] = record.get('status')
+        result['address'] = f"{record.get('ipAddress')}:{record.get('port') or DEFAULT_DEVICE_PORT}"
+        if (record.get('status') or '').upper() not in self.ready_statuses:
+            result.update(status=NOT_READY, reason=f"Device status is {record.get('status')}")
+        elif self.tcp_check and not record.get('ipAddress'):
+            result.update(status=NOT_READY, reason="Device has no ip address in IoT-OD")
+        return result, record
+
+    def check_connection(self, result, record):
+        try:
+            seconds = tcp_connect_seconds(record['ipAddress'], record.get('port') or DEFAULT_DEVICE_PORT,
+                                          self.connect_timeout)
+            result['connect_ms'] = round(seconds * 1000, 1)
+        except (OSError, ValueError) as err:
+            result.update(status=NOT_READY, reason=f"No TCP connection to {result['address']}: {err}")
+        return result
+
+    def check(self, devices, key):
+        """ Check the devices and return one result per device, in the order of the devices
+
+        :param devices: device details of the device file or IoT-OD device records
+        :param key: callable returning the serial number of a device detail
+        """
+        checks = [self.check_status(key(device_detail), device_detail) for device_detail in devices]
+        results = [result for result, _ in checks]
+        if self.tcp_check:
+            reachable = [(result, record) for result, record in checks if result['status'] == READY]
+            logger.info(f"Opening a TCP connection to {len(reachable)} devices with a timeout of "
+                        f"{self.connect_timeout} seconds...")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                       thread_name_prefix='preflight') as executor:
+                list(executor.map(lambda check: self.check_connection(*check), reachable))
+        return results
+
+    def partition(self, devices, key):
+        """ Split the devices into the ready device details and the results of the devices which are not ready """
+        devices = list(devices)
+        results = self.check(devices, key)
+        ready = [device_detail for device_detail, result in zip(devices, results) if result['status'] == READY]
+        not_ready = [result for result in results if result['status'] != READY]
+        logger.info(f"Preflight: {len(ready)} devices ready, {len(not_ready)} devices not ready")
+        for result in not_ready:
+            logger.warning(f"Device {result['serial_number']} is not ready: {result['reason']}")
+        return ready, not_ready
+
+
+def write_ready_device_file(device_file, serial_numbers):
+    """ Write a serial number device file of the ready devices, read by `install-gmm-app-to-iod --device-file` """
+    with open(device_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['serial_number'])
+        for serial_number in serial_numbers:
+            writer.writerow([serial_number])
+
+
+def write_preflight_report(report_file, results):
+    summary = {READY: sum(result['status'] == READY for result in results)}
+    summary[NOT_READY] = len(results) - summary[READY]
+    with open(report_file, 'w') as file:
+        json.dump({'summary': summary, 'devices': results}, file, indent=2)
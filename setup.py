@@ -11,7 +11,8 @@ setup(
         "Bug Tracker": "https://cto-github.cisco.com/IOTNM/gmm-iotoc-migration",
     },
     packages=find_packages(),
-    py_modules=['migrate', 'app_migration'],
+    py_modules=['migrate', 'app_migration', 'migration_planner', 'benchmark',
+                'synthetic_export', 'wave_scheduler', 'verification_sweep', 'preflight'],
     include_package_data=True,
     install_requires=[
         'Click',
@@ -22,6 +23,9 @@ setup(
         'scp==0.13.3',
         'urllib3==1.26.4'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     entry_points={
         'console_scripts': [
             'migrate=migrate:migrate',
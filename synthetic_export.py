@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+import os
+import random
+import tarfile
+from datetime import datetime
+
+from logs import log
+from utils import archive
+
+logger = log.get_logger("Synthetic Export:: ")
+
+EXPORT_DIR_NAME = 'gmm_app_details'
+APP_VERSION = '1.0.0'
+ORG_ID = 2414
+POLICY_COUNT = 3
+
+
+def app_name(app_index):
+    return f'synthetic_app_{app_index}'
+
+
+def serial_number(gateway_index):
+    return f'SYN{gateway_index:08d}'
+
+
+def synthetic_app_params(app_index, params=20, value_size=16):
+    """ GMM app specific params, spread over 5 sections, with values of `value_size` characters """
+    return [{'section': f'section_{param % 5}', 'key': f'key_{param}',
+             'value': f'{app_index}_{param}_'.ljust(value_size, 'x')} for param in range(params)]
+
+
+def synthetic_app_detail(app_index, params=20, interfaces=2, org_id=ORG_ID):
+    """ GMM app details record, as written in `apps/<name>_V<version>.json` by `export_gmm_app` """
+    return {
+        'id': app_index + 1,
+        'name': app_name(app_index),
+        'version': APP_VERSION,
+        'organization_id': org_id,
+        'app_specific_params': synthetic_app_params(app_index, params),
+        'resources': {
+            'resource_profile': 'custom',
+            'resource_cpu': 200,
+            'resource_memory': 128,
+            'app_interfaces': [{'interface_name': f'eth{interface}', 'network_name': 'iox-nat0',
+                                'port_map_mode': '1to1',
+                                'tcp': [{'host_port': 8000 + port, 'container_port': 80 + port} for port in range(4)],
+                                'udp': [{'host_port': 9000 + port, 'container_port': 90 + port} for port in range(2)]}
+                               for interface in range(interfaces)],
+        },
+    }
+
+
+def synthetic_installation(gateway_index, app_index, params=20, org_id=ORG_ID):
+    """ GMM fog installation detail of one app on one gateway, as collected in `devices/<serial>.json` """
+    return {
+        'id': gateway_index * 1000 + app_index,
+        'gate_way': {'uuid': serial_number(gateway_index), 'name': f'gw-{gateway_index}'},
+        'fog_application': {'id': app_index + 1, 'name': app_name(app_index), 'version': APP_VERSION,
+                            'organization_id': org_id},
+        'fog_director_state': 'RUNNING',
+        'app_specific_params': synthetic_app_params(app_index + gateway_index, params),
+        'resources': {'resource_profile': 'custom', 'resource_cpu': 200, 'resource_memory': 128},
+    }
+
+
+def synthetic_catalog_app(app_index):
+    """ IoT-OD managed app record matching the synthetic GMM app """
+    return {
+        'name': app_name(app_index),
+        'appId': f'synthetic-app-{app_index}',
+        'appType': 'DOCKER',
+        'version': APP_VERSION,
+        'descriptor': {'app': {'resources': {'profile': 'c1.small', 'cpu': 100, 'memory': 64}}},
+    }
+
+
+def synthetic_inventory_device(gateway_index):
+    """ IoT-OD device record of a migrated synthetic gateway """
+    return {
+        'deviceId': f'synthetic-device-{gateway_index}',
+        'serialNumber': serial_number(gateway_index),
+        'ipAddress': f'10.{gateway_index // 65536 % 256}.{gateway_index // 256 % 256}.{gateway_index % 256}',
+        'port': 8443,
+        'hostname': f'gw-{gateway_index}',
+        'status': 'DISCOVERED',
+        'apps': [],
+    }
+
+
+def write_app_data_tar(file_name, files, file_size):
+    """ App-data tarball as downloaded from a device, with `files` random files under `appdata/` """
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with tarfile.open(file_name, 'w:gz') as tar:
+        for index in range(files):
+            info = tarfile.TarInfo(f'appdata/data_{index}.bin')
+            info.size = file_size
+            tar.addfile(info, io.BytesIO(os.urandom(file_size)))
+
+
+class SyntheticExportGenerator:
+    """Builds a GMM export archive of any size with the layout `export_gmm_app` produces, plus the inputs needed to
+    run the installer on it without a real GMM organization.
+
+    Written in `output_dir`:
+
+        gmm_org_<org id>_synthetic<extension>   the export archive (apps, devices, templates, policies)
+        devices.csv                            the serial numbers, as read by `read_device_serial_no`
+        iotod_snapshot.json                    matching IoT-OD catalog and inventory for `plan --snapshot`
+        <app name>/<app data file name>        app-data tarballs, as written by `export_app_data`
+
+    Every gateway gets `fan_out` distinct apps picked with the seeded random generator, so the same options always
+    build the same export.
+
+    :param apps: number of GMM apps
+    :param gateways: number of gateways
+    :param fan_out: number of apps installed on every gateway
+    :param params: number of app specific params of every app and installation
+    :param app_data_kb: size in KB of every app-data tarball content, 0 to not write app data
+    :param app_data_files: number of files in every app-data tarball
+    :param per_device_app_data: write one app-data tarball per app per gateway, named like the grouped installer
+        expects, instead of one per app
+    """
+
+    def __init__(self, apps=10, gateways=100, fan_out=3, params=20, app_data_kb=0, app_data_files=4,
+                 per_device_app_data=False, org_id=ORG_ID, seed=0, compression=archive.GZIP):
+        if fan_out > apps:
+            raise ValueError(f"The fan out {fan_out} can not be larger than the number of apps {apps}")
+        self.apps = apps
+        self.gateways = gateways
+        self.fan_out = fan_out
+        self.params = params
+        self.app_data_kb = app_data_kb
+        self.app_data_files = app_data_files
+        self.per_device_app_data = per_device_app_data
+        self.org_id = org_id
+        self.seed = seed
+        self.compression = compression
+
+    def gateway_apps(self, gateway_index):
+        """ Indexes of the apps installed on a gateway """
+        return sorted(random.Random(self.seed * 1000003 + gateway_index).sample(range(self.apps), self.fan_out))
+
+    def generate(self, output_dir):
+        """ Write the export and its companion files
+
+        :return: dict of the written paths
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        logger.info(f"Generating a synthetic GMM export of {self.apps} apps on {self.gateways} gateways with "
+                    f"{self.fan_out} apps per gateway in {output_dir}...")
+        tar_file_name = os.path.join(output_dir, f'gmm_org_{self.org_id}_synthetic'
+                                                 f'{archive.FILE_EXTENSIONS[self.compression]}')
+        summary_file_name = os.path.join(output_dir, 'gmm_app_details.json.part')
+        with archive.StreamingTarWriter(tar_file_name, self.compression) as tar, \
+                open(summary_file_name, 'w') as summary_file:
+            for app_index in range(self.apps):
+                tar.add_json(f'{EXPORT_DIR_NAME}/apps/{app_name(app_index)}_V{APP_VERSION.replace(".", "_")}.json',
+                             synthetic_app_detail(app_index, self.params, org_id=self.org_id))
+
+            # The installations of all gateways are also collected in gmm_app_details.json, stream it to disk
+            # instead of keeping every installation in memory
+            summary_file.write('{')
+            for gateway_index in range(self.gateways):
+                installations = [synthetic_installation(gateway_index, app_index, self.params, self.org_id)
+                                 for app_index in self.gateway_apps(gateway_index)]
+                tar.add_json(f'{EXPORT_DIR_NAME}/devices/{serial_number(gateway_index)}.json', installations)
+                summary_file.write(('' if gateway_index == 0 else ', ') +
+                                   f'{json.dumps(serial_number(gateway_index))}: {json.dumps(installations)}')
+                if gateway_index and gateway_index % 10000 == 0:
+                    logger.info(f"{gateway_index} gateways generated")
+            summary_file.write('}')
+            summary_file.close()
+            tar.add(summary_file_name, f'{EXPORT_DIR_NAME}/gmm_app_details.json')
+
+            for app_index in range(self.apps):
+                tar.add_json(f'{EXPORT_DIR_NAME}/templates/template_{app_index + 1}.json',
+                             {'id': app_index + 1, 'name': f'{app_name(app_index)}_template',
+                              'fog_application_id': app_index + 1,
+                              'app_specific_params': synthetic_app_params(app_index, self.params)})
+            for policy_index in range(POLICY_COUNT):
+                tar.add_json(f'{EXPORT_DIR_NAME}/policies/policy_{policy_index + 1}.json',
+                             {'id': policy_index + 1, 'name': f'synthetic_policy_{policy_index + 1}',
+                              'retries': 3, 'retry_interval_minutes': 5})
+        os.remove(summary_file_name)
+
+        device_file_name = os.path.join(output_dir, 'devices.csv')
+        with open(device_file_name, 'w', newline='') as device_file:
+            writer = csv.writer(device_file)
+            writer.writerow(['serial_number'])
+            for gateway_index in range(self.gateways):
+                writer.writerow([serial_number(gateway_index)])
+
+        snapshot_file_name = os.path.join(output_dir, 'iotod_snapshot.json')
+        with open(snapshot_file_name, 'w') as snapshot_file:
+            json.dump({'created': datetime.now().isoformat(),
+                       'catalog': {'apps': {app_name(app_index): [synthetic_catalog_app(app_index)]
+                                            for app_index in range(self.apps)}},
+                       'devices': [synthetic_inventory_device(gateway_index)
+                                   for gateway_index in range(self.gateways)]}, snapshot_file)
+
+        app_data_count = self.write_app_data(output_dir) if self.app_data_kb else 0
+        logger.info(f"Synthetic GMM export has been written in {tar_file_name} with {app_data_count} app-data files")
+        return {'export': tar_file_name, 'device_file': device_file_name, 'snapshot': snapshot_file_name}
+
+    def write_app_data(self, output_dir):
+        file_size = max(1, self.app_data_kb * 1024 // max(1, self.app_data_files))
+        count = 0
+        if self.per_device_app_data:
+            for gateway_index in range(self.gateways):
+                for app_index in self.gateway_apps(gateway_index):
+                    name = app_name(app_index)
+                    write_app_data_tar(os.path.join(output_dir, name,
+                                                    f'{name}-{serial_number(gateway_index)}-datamount.tar.gz'),
+                                       self.app_data_files, file_size)
+                    count += 1
+        else:
+            for app_index in range(self.apps):
+                name = app_name(app_index)
+                write_app_data_tar(os.path.join(output_dir, name, f'{name}-datamount.tar.gz'), self.app_data_files,
+                                   file_size)
+                count += 1
+        return count
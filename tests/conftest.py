@@ -0,0 +1,9 @@
+import tempfile
+
+from logs import log
+
+
+def pytest_configure(config):
+    # The loggers are created when the tested modules are imported, point them at a temporary file before that so the
+    # tests do not write migration.log in the working directory
+    log.set_log_file(tempfile.NamedTemporaryFile(prefix='migration_', suffix='.log', delete=False).name)
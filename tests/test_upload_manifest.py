@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+from app_migration import AppMigration, Application, Device
+from utils.manifest import UploadManifestStore
+
+
+class FakeApi:
+    def __init__(self):
+        self.deploys = []
+        self.uploads = []
+        self.searches = []
+
+    def get_default_policy(self):
+        return [{'id': 1}]
+
+    def search_app_details(self, name):
+        self.searches.append(name)
+        return {'data': [{'name': name, 'appId': 'managed-' + name, 'appType': 'DOCKER',
+                          'descriptor': {'app': {'resources': {'cpu': 5}}}}]}
+
+    def deploy_app(self, app_id, app_version, payload):
+        self.deploys.append(app_id)
+        return {'jobId': f'job-{len(self.deploys)}'}
+
+    def get_job_details(self, job_id):
+        return {'status': 'COMPLETED'}
+
+    def get_app_details_from_device(self, device_id, app_id, app_version):
+        return {'status': 'RUNNING'}
+
+    def upload_app_data(self, device_id, app_id, app_version, file_name, **kwargs):
+        self.uploads.append(os.path.basename(file_name))
+
+
+@pytest.fixture
+def migration(tmp_path, monkeypatch):
+    monkeypatch.setenv('APP_MIGRATION_DATA_DIR', str(tmp_path / 'data'))
+    app_migration = AppMigration(None, None, None, None, 'https://iod', None, None)
+    app_migration.api = FakeApi()
+    app_migration.skip_data_migration = False
+    app_migration.device = Device('device-1', '10.0.0.1', 8443, 'FOC1', 'gateway', 'DISCOVERED', 'profile')
+    return app_migration
+
+
+@pytest.fixture
+def app_data(tmp_path):
+    app_data_path = tmp_path / 'appdata'
+    (app_data_path / 'db').mkdir(parents=True)
+    (app_data_path / 'config.json').write_text('{"interval": 10}')
+    (app_data_path / 'db' / 'data.sqlite').write_bytes(b'rows' * 1000)
+    return str(app_data_path)
+
+
+def new_app():
+    app = Application('gmm-1', '5.sensor.1', 'sensor', 'docker', '1.0', 'RUNNING')
+    app.app_config = {'section': {'key': 'value'}}
+    app.resource_config = {'cpu': 1}
+    return app
+
+
+def test_second_upload_to_the_same_deployment_skips_unchanged_files(migration, app_data):
+    app = new_app()
+    app.imported_app_id = 'managed-sensor'
+    migration.upload_manifests.start('device-1', 'managed-sensor', '1.0', {'job_id': 'job-1'})
+    migration.upload_application_data(app, app_data)
+    assert sorted(migration.api.uploads) == ['config.json', 'data.sqlite']
+
+    with open(os.path.join(app_data, 'config.json'), 'w') as file:
+        file.write('{"interval": 20}')
+    migration.api.uploads.clear()
+    migration.upload_manifests.start('device-1', 'managed-sensor', '1.0', {'job_id': 'job-1'})
+    migration.upload_application_data(app, app_data)
+    assert migration.api.uploads == ['config.json']
+
+
+def test_new_deployment_uploads_every_file_again(migration, app_data):
+    app = new_app()
+    app.imported_app_id = 'managed-sensor'
+    migration.upload_manifests.start('device-1', 'managed-sensor', '1.0', {'job_id': 'job-1'})
+    migration.upload_application_data(app, app_data)
+    migration.api.uploads.clear()
+    migration.upload_manifests.start('device-1', 'managed-sensor', '1.0', {'job_id': 'job-2'})
+    migration.upload_application_data(app, app_data)
+    assert sorted(migration.api.uploads) == ['config.json', 'data.sqlite']
+
+
+def test_rerun_of_an_unfinished_upload_resumes_without_deploying(migration, app_data, monkeypatch):
+    monkeypatch.setattr(migration, 'get_app_data_path', lambda app: app_data)
+    monkeypatch.setattr(migration, 'track_app_operational_status', lambda app, wait_timeout: 'RUNNING')
+    uploads = []
+
+    def fail_second_upload(device_id, app_id, app_version, file_name, **kwargs):
+        if uploads:
+            raise ConnectionError('link down')
+        uploads.append(os.path.basename(file_name))
+
+    migration.api.upload_app_data = fail_second_upload
+    with pytest.raises(ConnectionError):
+        migration.import_application(new_app())
+    assert migration.api.deploys == ['managed-sensor']
+
+    migration.api.upload_app_data = FakeApi.upload_app_data.__get__(migration.api)
+    app = new_app()
+    migration.import_application(app)
+    assert migration.api.deploys == ['managed-sensor']
+    assert len(migration.api.uploads) == 1
+    assert sorted(uploads + migration.api.uploads) == ['config.json', 'data.sqlite']
+    assert app.deploy_status == 'Passed'
+
+    # A finished upload is not resumed, the next run deploys the app again
+    migration.api.uploads.clear()
+    migration.import_application(new_app())
+    assert migration.api.deploys == ['managed-sensor', 'managed-sensor']
+    assert sorted(migration.api.uploads) == ['config.json', 'data.sqlite']
+
+
+def test_app_without_data_is_deployed_without_manifest(migration, monkeypatch):
+    monkeypatch.setattr(migration, 'get_app_data_path', lambda app: None)
+    monkeypatch.setattr(migration, 'track_app_operational_status', lambda app, wait_timeout: 'RUNNING')
+    migration.resource_descriptors.get('sensor', '1.0')
+    migration.api.searches.clear()
+    app = new_app()
+    migration.import_application(app)
+    assert app.deploy_status == 'Passed'
+    assert not migration.upload_manifests.has_manifests('device-1')
+    # The managed app is searched once, to deploy it
+    assert migration.api.searches == ['sensor']
+
+
+def test_deployment_is_forgotten_once_the_upload_is_complete(tmp_path):
+    manifests = UploadManifestStore(str(tmp_path))
+    manifests.start('device-1', 'app', '1.0', {'job_id': 'job-1'})
+    manifests.record('device-1', 'app', '1.0', 'config.json', {'sha256': 'abc', 'size': 3})
+    assert manifests.deployment('device-1', 'app', '1.0') == {'job_id': 'job-1'}
+    manifests.complete('device-1', 'app', '1.0')
+    assert manifests.deployment('device-1', 'app', '1.0') is None
+    assert manifests.load('device-1', 'app', '1.0') == {'config.json': {'sha256': 'abc', 'size': 3}}
@@ -0,0 +1,296 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+import concurrent.futures
+from collections import deque
+
+from logs import log
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional, `pip install zstandard` to enable the in-process codec
+    zstandard = None
+
+logger = log.get_logger("Archive:: ")
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+COMPRESSIONS = (GZIP, ZSTD)
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+FILE_EXTENSIONS = {GZIP: '.tar.gz', ZSTD: '.tar.zst'}
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Size of the independently compressed gzip members written by ParallelGzipWriter
+GZIP_BLOCK_SIZE = 1024 * 1024
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """File-like object which compresses the written bytes with several threads.
+
+    The input is cut into blocks of `block_size` bytes and each block is compressed as an independent gzip member on
+    a thread pool (zlib releases the GIL while compressing). The members are written to the output in order, which
+    gives a valid multi-member gzip file that `tar`, `gzip`, `pigz` and the python `gzip` module read transparently.
+
+    :param fileobj: binary file object where the compressed stream is written
+    :param level: gzip compression level from 1 to 9
+    :param threads: number of compression threads, defaults to the cpu count
+    :param block_size: number of uncompressed bytes per gzip member
+    """
+
+    def __init__(self, fileobj, level=DEFAULT_LEVELS[GZIP], threads=None, block_size=GZIP_BLOCK_SIZE):
+        super().__init__()
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.block_size = block_size
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(gzip.compress, block, self.level))
+        # Bound the memory used by in-flight blocks to a couple of blocks per thread
+        while len(self._pending) > 2 * self.threads:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+            self.fileobj.flush()
+        finally:
+            self._executor.shutdown()
+            super().close()
+
+
+class ProcessPipeWriter(io.RawIOBase):
+    """File-like object which pipes the written bytes into an external compressor such as `pigz` or `zstd`."""
+
+    def __init__(self, command, fileobj):
+        super().__init__()
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=fileobj)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.process.stdin.close()
+            if self.process.wait():
+                raise IOError(f"Compression command {' '.join(self.command)} failed with exit code "
+                              f"{self.process.returncode}")
+        finally:
+            super().close()
+
+
+class ProcessPipeReader(io.RawIOBase):
+    """File-like object which reads the output of an external decompressor such as `pigz -d` or `zstd -d`."""
+
+    def __init__(self, command, fileobj):
+        super().__init__()
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=fileobj, stdout=subprocess.PIPE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.process.stdout.readinto(buffer)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.process.stdout.close()
+            if self.process.wait():
+                raise IOError(f"Decompression command {' '.join(self.command)} failed with exit code "
+                              f"{self.process.returncode}")
+        finally:
+            super().close()
+
+
+def get_compression_stream(fileobj, compression=GZIP, level=None, threads=None):
+    """Returns a writable file object which compresses everything written into `fileobj`.
+
+    gzip uses `pigz` when it is installed and falls back to the in-process ParallelGzipWriter. zstd uses the
+    `zstandard` module when it is installed and falls back to the `zstd` command line tool.
+
+    :param fileobj: binary file object where the compressed stream is written
+    :param compression: `gzip` or `zstd`
+    :param level: compression level, defaults to the codec default
+    :param threads: number of compression threads, defaults to the cpu count
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression {compression}! Supported values are {', '.join(COMPRESSIONS)}")
+    level = level or DEFAULT_LEVELS[compression]
+    threads = threads or os.cpu_count() or 1
+    if compression == GZIP:
+        if shutil.which('pigz'):
+            logger.info(f"Compressing with pigz using {threads} threads at level {level}")
+            return ProcessPipeWriter(['pigz', '-c', f'-{level}', '-p', str(threads)], fileobj)
+        logger.info(f"Compressing with parallel gzip using {threads} threads at level {level}")
+        return ParallelGzipWriter(fileobj, level=level, threads=threads)
+
+    if zstandard is not None:
+        logger.info(f"Compressing with zstandard using {threads} threads at level {level}")
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+        return compressor.stream_writer(fileobj, closefd=False)
+    if shutil.which('zstd'):
+        logger.info(f"Compressing with zstd using {threads} threads at level {level}")
+        return ProcessPipeWriter(['zstd', '-q', '-c', f'-{level}', f'-T{threads}'], fileobj)
+    raise Exception("zstd compression needs either the `zstandard` python module or the `zstd` command line tool!")
+
+
+def get_decompression_stream(fileobj, compression):
+    """Returns a readable file object which decompresses `fileobj` with the fastest available decoder."""
+    if compression == ZSTD:
+        if zstandard is not None:
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+        if shutil.which('zstd'):
+            return ProcessPipeReader(['zstd', '-q', '-d', '-c'], fileobj)
+        raise Exception("zstd decompression needs either the `zstandard` python module or the `zstd` command line tool!")
+    if compression == GZIP:
+        if shutil.which('pigz'):
+            return ProcessPipeReader(['pigz', '-d', '-c'], fileobj)
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    return fileobj
+
+
+def detect_compression(file_name):
+    """ Detect the compression of an archive from its magic bytes, returns None for an uncompressed tar """
+    with open(file_name, 'rb') as file:
+        magic = file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return GZIP
+    if magic.startswith(ZSTD_MAGIC):
+        return ZSTD
+    return None
+
+
+class StreamingTarWriter:
+    """Writes a compressed tar archive member by member while the records are being produced.
+
+    Example:
+
+        with StreamingTarWriter('gmm_org_1.tar.zst', compression='zstd', level=10) as tar:
+            tar.add_json('gmm_app_details/apps/app_V1_0.json', app_detail)
+
+    :param output_filename: path of the archive to create
+    :param compression: `gzip` or `zstd`
+    :param level: compression level, defaults to the codec default
+    :param threads: number of compression threads, defaults to the cpu count
+    """
+
+    def __init__(self, output_filename, compression=GZIP, level=None, threads=None):
+        self.output_filename = output_filename
+        self.compression = compression
+        self._file = open(output_filename, 'wb')
+        try:
+            self._stream = get_compression_stream(self._file, compression, level, threads)
+            self._tar = tarfile.open(fileobj=self._stream, mode='w|')
+        except Exception:
+            self._file.close()
+            raise
+        self._directories = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _add_parent_dirs(self, arcname):
+        parent = os.path.dirname(arcname)
+        if not parent or parent in self._directories:
+            return
+        self._add_parent_dirs(parent)
+        info = tarfile.TarInfo(parent)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = int(time.time())
+        self._tar.addfile(info)
+        self._directories.add(parent)
+
+    def add_bytes(self, arcname, data: bytes):
+        """ Add a regular file member with the given content """
+        self._add_parent_dirs(arcname)
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def add_json(self, arcname, data):
+        """ Serialise `data` as json and add it as a member """
+        self.add_bytes(arcname, json.dumps(data).encode('utf-8'))
+
+    def add(self, path, arcname=None):
+        """ Add a file or directory from disk """
+        arcname = arcname or os.path.basename(path)
+        self._add_parent_dirs(arcname)
+        self._tar.add(path, arcname=arcname)
+
+    def close(self):
+        try:
+            try:
+                self._tar.close()
+            finally:
+                self._stream.close()
+        finally:
+            self._file.close()
+
+
+def extract_tarfile(tar_file_name, output_path):
+    """Extract a gzip, zstd or plain tar archive into `output_path`.
+
+    The compression is detected from the file content and the archive is read as a stream through the matching fast
+    decoder, so a `.tar.zst` export and a multi-member parallel gzip export are both supported.
+
+    :return: number of extracted members
+    """
+    compression = detect_compression(tar_file_name)
+    logger.info(f"Extracting {tar_file_name} ({compression or 'uncompressed'}) to {output_path}")
+    member_count = 0
+    with open(tar_file_name, 'rb') as file:
+        stream = get_decompression_stream(file, compression)
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                for member in tar:
+                    if hasattr(tarfile, 'data_filter'):
+                        tar.extract(member, output_path, filter='data')
+                    else:
+                        tar.extract(member, output_path)
+                    member_count += 1
+        finally:
+            stream.close()
+    logger.info(f"Extracted {member_count} members from {tar_file_name}")
+    return member_count
@@ -0,0 +1,134 @@
+import threading
+import time
+import weakref
+
+from logs import log
+
+logger = log.get_logger("Bandwidth:: ")
+
+# Default app-data transfer caps in kilobits per second by device model prefix. The IR800 and IR1100 gateways are
+# mostly on cellular uplinks which time out when an upload takes the whole link, the other models are not capped.
+DEFAULT_MODEL_CAPS_KBPS = {
+    'IR807': 256,
+    'IR809': 256,
+    'IR829': 512,
+    'IR11': 1024,
+}
+
+# Chunk size of the throttled streamed downloads
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+def kbps_to_bytes(kbps):
+    return kbps * 1000 / 8 if kbps else None
+
+
+class TokenBucket:
+    """Thread-safe token bucket pacing a byte stream to `rate` bytes per second with bursts of up to `burst` bytes.
+
+    A transfer larger than the tokens left takes them on credit, so `reserve` never splits a chunk and the next
+    callers wait until the debt is paid back.
+
+    :param rate: bytes per second
+    :param burst: bucket size in bytes, one second of transfer by default
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """ Take `size` bytes from the bucket and return the seconds to wait before sending them """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= size
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class Throttle:
+    """ Callable pacing the chunks of one transfer with all the given buckets, the slowest one wins """
+
+    def __init__(self, buckets):
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+
+    def __call__(self, size):
+        if size and self.buckets:
+            delay = max(bucket.reserve(size) for bucket in self.buckets)
+            if delay > 0:
+                time.sleep(delay)
+
+
+class ThrottledReader:
+    """File-like wrapper of a request body pacing every read with a `Throttle`.
+
+    The `len` attribute of the wrapped body, used by requests for the content length, is kept so a wrapped
+    `MultipartEncoder` is still streamed.
+    """
+
+    def __init__(self, stream, throttle):
+        self.stream = stream
+        self.throttle = throttle
+
+    @property
+    def len(self):
+        return self.stream.len
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.throttle(len(chunk))
+        return chunk
+
+
+class BandwidthShaper:
+    """Caps the app-data transfers per device and over all the devices.
+
+    The cap of a device is chosen from its model with the longest matching prefix of `model_caps_kbps`, the devices of
+    other or unknown models get `default_device_kbps`. The transfers of the same device, e.g. the uploads of apps
+    imported in parallel, share the bucket of the device, and all the transfers share the global bucket.
+
+    Example:
+
+        shaper = BandwidthShaper(total_kbps=50000, default_device_kbps=2048)
+        api.upload_app_data(device.device_id, app_id, app_version, file, throttle=shaper.throttle_for(device))
+
+    :param total_kbps: cap of all the transfers together in kilobits per second, None for no cap
+    :param default_device_kbps: cap of the devices whose model has no cap, None for no cap
+    :param model_caps_kbps: caps by device model prefix, the `DEFAULT_MODEL_CAPS_KBPS` by default
+    """
+
+    def __init__(self, total_kbps=None, default_device_kbps=None, model_caps_kbps=None):
+        self.total_kbps = total_kbps
+        self.default_device_kbps = default_device_kbps
+        self.model_caps_kbps = {model.upper(): kbps for model, kbps in
+                                (DEFAULT_MODEL_CAPS_KBPS if model_caps_kbps is None else model_caps_kbps).items()}
+        self._total_bucket = TokenBucket(kbps_to_bytes(total_kbps)) if total_kbps else None
+        # Buckets of the devices with a transfer in progress, a bucket goes away with the last throttle using it
+        self._device_buckets = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def device_kbps(self, model):
+        """ Cap of a device model in kilobits per second, None for no cap """
+        model = (model or '').upper()
+        prefixes = [prefix for prefix in self.model_caps_kbps if model and model.startswith(prefix)]
+        return self.model_caps_kbps[max(prefixes, key=len)] if prefixes else self.default_device_kbps
+
+    def throttle_for(self, device):
+        """ Throttle of the transfers to and from a `Device` """
+        kbps = self.device_kbps(device.model)
+        bucket = None
+        if kbps:
+            with self._lock:
+                bucket = self._device_buckets.get(device.device_id)
+                if bucket is None:
+                    bucket = self._device_buckets[device.device_id] = TokenBucket(kbps_to_bytes(kbps))
+        return Throttle([bucket, self._total_bucket])
+
+    def describe(self):
+        caps = ', '.join(f'{model}*: {kbps} kbps' for model, kbps in sorted(self.model_caps_kbps.items()))
+        return (f"total {self.total_kbps or 'unlimited'} kbps, per device {caps}, other models "
+                f"{self.default_device_kbps or 'unlimited'} kbps")
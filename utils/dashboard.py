@@ -0,0 +1,142 @@
+import atexit
+import sys
+import threading
+import time
+
+from logs import log
+
+logger = log.get_logger("Dashboard:: ")
+# Logger of the lines printed while the dashboard is drawn, its console handler is muted then
+console_logger = log.get_logger("Console:: ")
+
+# Move the cursor to the start of the line `n` lines up, and clear the screen below the cursor
+CURSOR_UP = '\x1b[{}F'
+CLEAR_BELOW = '\x1b[J'
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+class _LogWriter:
+    """ stdout replacement while the dashboard is drawn, the printed lines go to the log file """
+
+    def __init__(self, file_logger):
+        self.file_logger = file_logger
+        self._buffer = ''
+
+    def write(self, text):
+        self._buffer += text
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            if line.strip():
+                self.file_logger.info(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class LiveDashboard:
+    """Compact live view of a running command, redrawn in place on the terminal from the `RunMetrics` counters.
+
+    While the dashboard is shown the logs and the prints only go to the log file. On a terminal which is not a tty,
+    e.g. when the output is redirected to a file, the dashboard stays off and the logs are shown as usual.
+
+    Example:
+
+        with LiveDashboard(metrics, 'install-gmm-app-to-iod'):
+            migrate(devices)
+
+    :param metrics: `RunMetrics` of the run
+    :param title: first line of the dashboard
+    :param interval: seconds between two redraws
+    :param stream: terminal to draw on, the original stdout by default
+    """
+
+    def __init__(self, metrics, title, interval=1.0, stream=None):
+        self.metrics = metrics
+        self.title = title
+        self.interval = interval
+        self.stream = stream or sys.__stdout__
+        self.active = False
+        self._lines = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stdout = None
+
+    def render(self):
+        """ Lines of the dashboard """
+        metrics = self.metrics
+        total = f'/{metrics.devices_total}' if metrics.devices_total is not None else ''
+        p95 = metrics.latency_percentile(0.95)
+        lines = [
+            f"{self.title} - running for {format_duration(time.time() - metrics.started)}",
+            f"Devices: {metrics.devices_done}{total} done, {metrics.devices_failed} failed, "
+            f"{metrics.devices_in_flight} in flight, {metrics.devices_deferred} deferred"
+            f" | ETA {format_duration(metrics.eta_seconds())}",
+            f"API: {metrics.requests} requests, {metrics.requests_per_second():.1f} req/s, p95 latency "
+            f"{f'{p95 * 1000:.0f} ms' if p95 is not None else '-'}, {metrics.request_errors} errors",
+        ]
+        stages = metrics.stages()
+        if stages:
+            width = max(len(name) for name, _, _, _ in stages)
+            lines.append(f"{'Stage'.ljust(width)}  {'In flight':>9}  {'Done':>7}  {'Avg (s)':>8}")
+            for name, in_flight, done, average in stages:
+                lines.append(f"{name.ljust(width)}  {in_flight:>9}  {done:>7}  "
+                             f"{f'{average:.1f}' if average is not None else '-':>8}")
+        return lines
+
+    def draw(self):
+        lines = self.render()
+        output = (CURSOR_UP.format(self._lines) if self._lines else '') + CLEAR_BELOW + '\n'.join(lines) + '\n'
+        self.stream.write(output)
+        self.stream.flush()
+        self._lines = len(lines)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.draw()
+            except Exception as err:
+                logger.warning(f"Could not draw the dashboard: {err}")
+
+    def start(self):
+        """ Hide the console logs and start redrawing the dashboard, nothing is changed when not on a tty """
+        if self.active:
+            return self
+        if not self.stream.isatty():
+            logger.info("Not a terminal, showing the logs instead of the dashboard")
+            return self
+        logger.info(f"Dashboard started, the logs are written to {log.LOG_FILE}")
+        log.set_console_enabled(False)
+        self._stdout = sys.stdout
+        sys.stdout = _LogWriter(console_logger)
+        self.active = True
+        self.draw()
+        self._thread = threading.Thread(target=self._run, name='dashboard', daemon=True)
+        self._thread.start()
+        # Give the console back even when the command ends with an error
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """ Draw the dashboard a last time and show the console logs again """
+        if not self.active:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.draw()
+        sys.stdout = self._stdout
+        log.set_console_enabled(True)
+        self.active = False
+        atexit.unregister(self.stop)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,114 @@
+import heapq
+import threading
+import time
+
+from logs import log
+
+logger = log.get_logger("Deadline:: ")
+
+
+class DeviceTimeoutError(TimeoutError):
+    """ Raised by the polls and steps of a device migration once the time budget of the device is spent """
+
+
+class Deadline:
+    """Time budget of the migration of one device, checked cooperatively by its polls and steps.
+
+    The polls wait with `wait` instead of sleeping, so they stop as soon as the budget is spent or the deadline is
+    cancelled from another thread, and the blocking calls are bounded with `remaining`.
+
+    :param seconds: time budget, starting now
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+
+    def remaining(self):
+        """ Seconds left in the budget, 0 once it is spent or cancelled """
+        if self._cancelled.is_set():
+            return 0.0
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cancel(self):
+        """ Spend the budget now, the waiting polls raise `DeviceTimeoutError` """
+        self._cancelled.set()
+
+    def check(self, step=''):
+        """ Raise `DeviceTimeoutError` when the budget is spent """
+        if self.expired():
+            raise DeviceTimeoutError(f"Device time budget of {self.seconds} seconds exceeded" +
+                                     (f" during {step}" if step else ''))
+
+    def wait(self, seconds, step=''):
+        """ Sleep up to `seconds` and raise `DeviceTimeoutError` when the budget is spent in the meantime """
+        self.check(step)
+        if self._cancelled.wait(min(seconds, self.remaining())) or self.expired():
+            self.check(step)
+
+
+class DeferredRetryQueue:
+    """Devices which timed out, retried once the main run is over with an exponential backoff.
+
+    A device deferred after its attempt `n` is retried `backoff_seconds * 2 ** (n - 1)` seconds later, capped to
+    `max_backoff_seconds`, and it is given up after `max_attempts` attempts.
+
+    Example:
+
+        retry_queue = DeferredRetryQueue(max_attempts=3, backoff_seconds=60)
+        for device in devices:
+            if migrate(device) == TIMED_OUT:
+                retry_queue.defer(serial_number(device), device, attempt=1)
+        retry_queue.drain(lambda device, attempt: migrate(device))
+
+    :param max_attempts: number of attempts of a device, including the first one
+    :param backoff_seconds: wait before the first retry of a device
+    :param max_backoff_seconds: upper bound of the wait before a retry
+    """
+
+    def __init__(self, max_attempts=3, backoff_seconds=60, max_backoff_seconds=900):
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        # Heap of (time the retry is due, insertion order, key, item, next attempt)
+        self._heap = []
+        self._keys = set()
+        self._order = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def defer(self, key, item, attempt):
+        """ Schedule the retry of an item which failed its attempt `attempt`
+
+        :return: False when the item used all its attempts and is not retried
+        """
+        if attempt >= self.max_attempts:
+            return False
+        delay = min(self.backoff_seconds * 2 ** (attempt - 1), self.max_backoff_seconds)
+        heapq.heappush(self._heap, (time.monotonic() + delay, self._order, key, item, attempt + 1))
+        self._order += 1
+        self._keys.add(key)
+        logger.info(f"Retrying {key} in {delay:.0f} seconds, attempt {attempt + 1} of {self.max_attempts}")
+        return True
+
+    def drain(self, retry):
+        """ Call `retry(item, attempt)` for every deferred item once it is due, until no item is left
+
+        `retry` may defer the item again for a later attempt.
+        """
+        while self._heap:
+            due, _, key, item, attempt = heapq.heappop(self._heap)
+            self._keys.discard(key)
+            delay = due - time.monotonic()
+            if delay > 0:
+                logger.info(f"Waiting {delay:.0f} seconds before retrying {key}, {len(self._heap)} more deferred")
+                time.sleep(delay)
+            retry(item, attempt)
@@ -0,0 +1,51 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+STARTED = 'started'
+FINISHED = 'finished'
+SKIPPED = 'skipped'
+# The device exceeded its time budget and waits for a retry later in the run
+TIMED_OUT = 'timed_out'
+
+
+class DeviceJournal:
+    """Append-only json lines journal of the devices handled by one installer process.
+
+    A device whose last line is `started` was in progress when the process stopped, and a device whose last line is
+    `timed_out` was waiting for its retry.
+
+    :param file_name: journal file, lines are appended to an existing journal
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        self._file = open(file_name, 'a')
+
+    def record(self, serial_number, event, **fields):
+        line = json.dumps(dict(fields, time=datetime.now().isoformat(timespec='seconds'), serial_number=serial_number,
+                               event=event))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_journal(file_name):
+    """ Last event of every device of a journal, as a dict of serial number to the journal entry """
+    devices = {}
+    with open(file_name) as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line may be cut if the process died while writing it
+                continue
+            devices[entry['serial_number']] = entry
+    return devices
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+
+from logs import log
+
+logger = log.get_logger("Manifest:: ")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_name):
+    """ sha256 hex digest of a file read in chunks """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(root_dir):
+    """Content-addressed manifest of a directory tree.
+
+    :param root_dir: directory to scan, e.g. the extracted `appdata` directory of an application
+
+    :return: dict of `/` separated relative path to `{'sha256': ..., 'size': ...}`
+    """
+    manifest = {}
+    for dir_path, _, file_names in os.walk(root_dir):
+        for file_name in file_names:
+            full_path = os.path.join(dir_path, file_name)
+            relative_path = os.path.relpath(full_path, root_dir).replace('\\', '/')
+            manifest[relative_path] = {'sha256': file_digest(full_path), 'size': os.path.getsize(full_path)}
+    return manifest
+
+
+class UploadManifestStore:
+    """Remembers which app-data files have already been uploaded to an application on a device.
+
+    The manifest of a target starts with the deployment its files were uploaded to, and every successful upload is
+    appended as one json line to `<root_dir>/<device_id>/<app_id>_<version>.jsonl`. A new deployment starts with empty
+    app data so `start` resets the manifest when the deployment changes, while a retry or a rerun of an unfinished
+    upload to the same deployment only sends the files that are missing or have changed.
+
+    Example:
+
+        manifests.start(device_id, app_id, app_version, {'job_id': job_id})
+        uploaded = manifests.load(device_id, app_id, app_version)
+        manifests.record(device_id, app_id, app_version, 'data/db.sqlite', {'sha256': ..., 'size': ...})
+        manifests.complete(device_id, app_id, app_version)
+
+    :param root_dir: directory where the upload manifests are kept
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def _path(self, device_id, app_id, app_version):
+        return os.path.join(self.root_dir, str(device_id), f'{app_id}_{app_version}.jsonl')
+
+    def _entries(self, device_id, app_id, app_version):
+        try:
+            with open(self._path(device_id, app_id, app_version)) as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # The last line may be cut if the process died while writing it
+                        continue
+        except FileNotFoundError:
+            return
+
+    def _append(self, device_id, app_id, app_version, entry):
+        path = self._path(device_id, app_id, app_version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+    def has_manifests(self, device_id):
+        """ Whether an upload to the device was ever started, checked before looking up the ids of its targets """
+        return os.path.isdir(os.path.join(self.root_dir, str(device_id)))
+
+    def load(self, device_id, app_id, app_version):
+        """ Returns the uploaded files of the target as a dict of relative path to `{'sha256': ..., 'size': ...}` """
+        return {entry['path']: {'sha256': entry['sha256'], 'size': entry['size']}
+                for entry in self._entries(device_id, app_id, app_version) if 'path' in entry}
+
+    def deployment(self, device_id, app_id, app_version):
+        """ Returns the deployment of the target whose upload is not complete, None when there is none """
+        deployment = None
+        for entry in self._entries(device_id, app_id, app_version):
+            if 'deployment' in entry:
+                deployment = entry['deployment']
+            elif entry.get('complete'):
+                deployment = None
+        return deployment
+
+    def start(self, device_id, app_id, app_version, deployment):
+        """ Start the upload to a deployment of the target, the manifest is reset when the deployment changed
+
+        :param deployment: json serializable id of the deployment, e.g. the deploy job id and the deployed config
+        """
+        entries = list(self._entries(device_id, app_id, app_version))
+        if entries and entries[0].get('deployment') == deployment:
+            return
+        self.reset(device_id, app_id, app_version)
+        self._append(device_id, app_id, app_version, {'deployment': deployment})
+
+    def record(self, device_id, app_id, app_version, relative_path, entry):
+        self._append(device_id, app_id, app_version,
+                     {'path': relative_path, 'sha256': entry['sha256'], 'size': entry['size']})
+
+    def complete(self, device_id, app_id, app_version):
+        """ Mark the upload of the target as finished, the next deployment of the app starts a new manifest """
+        self._append(device_id, app_id, app_version, {'complete': True})
+
+    def reset(self, device_id, app_id, app_version):
+        try:
+            os.remove(self._path(device_id, app_id, app_version))
+        except FileNotFoundError:
+            pass
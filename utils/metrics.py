@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import Counter, deque
+
+# Seconds of requests counted in the request rate
+RATE_WINDOW_SECONDS = 60
+# Number of the latest request latencies kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class RunMetrics:
+    """In-process counters of a running command, read by the live dashboard.
+
+    The devices are counted by the installer, the stages by `Tracer.span` and the api requests by
+    `ApiConnection.do_request`, so the counters cost a lock and an addition and are always on.
+
+    :param rate_window: seconds of requests counted in `requests_per_second`
+    :param latency_samples: number of the latest request latencies kept for `latency_percentile`
+    """
+
+    def __init__(self, rate_window=RATE_WINDOW_SECONDS, latency_samples=LATENCY_SAMPLES):
+        self.rate_window = rate_window
+        self.started = time.time()
+        # Number of devices of the run, None when unknown
+        self.devices_total = None
+        self.devices_in_flight = 0
+        self.devices_done = 0
+        self.devices_failed = 0
+        self.devices_deferred = 0
+        # Optional callable returning the seconds left, by default estimated from the device rate
+        self.eta = None
+        self.stages_in_flight = Counter()
+        self.stages_done = Counter()
+        self.stage_seconds = Counter()
+        self.requests = 0
+        self.request_errors = 0
+        self._request_times = deque()
+        self._latencies = deque(maxlen=latency_samples)
+        self._lock = threading.Lock()
+
+    def device_started(self, count=1):
+        with self._lock:
+            self.devices_in_flight += count
+
+    def device_finished(self, failed=False, count=1):
+        with self._lock:
+            self.devices_in_flight -= count
+            self.devices_done += count
+            if failed:
+                self.devices_failed += count
+
+    def device_deferred(self):
+        """ A device left for a later retry, it is counted again when the retry starts """
+        with self._lock:
+            self.devices_in_flight -= 1
+            self.devices_deferred += 1
+
+    def stage_started(self, name):
+        with self._lock:
+            self.stages_in_flight[name] += 1
+
+    def stage_finished(self, name, seconds):
+        with self._lock:
+            self.stages_in_flight[name] -= 1
+            self.stages_done[name] += 1
+            self.stage_seconds[name] += seconds
+
+    def record_request(self, seconds, failed=False):
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.request_errors += 1
+            self._request_times.append(now)
+            self._latencies.append(seconds)
+            self._expire_requests(now)
+
+    def _expire_requests(self, now):
+        while self._request_times and self._request_times[0] < now - self.rate_window:
+            self._request_times.popleft()
+
+    def requests_per_second(self):
+        now = time.time()
+        with self._lock:
+            self._expire_requests(now)
+            return len(self._request_times) / max(1.0, min(self.rate_window, now - self.started))
+
+    def latency_percentile(self, percentile=0.95):
+        """ Latency in seconds of the latest requests at the given percentile, None before the first request """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
+    def eta_seconds(self):
+        """ Seconds left in the run, None when it can not be estimated yet """
+        if self.eta is not None:
+            return self.eta()
+        if not self.devices_total or not self.devices_done:
+            return None
+        elapsed = time.time() - self.started
+        return max(0, self.devices_total - self.devices_done) * elapsed / self.devices_done
+
+    def stages(self):
+        """ (name, in flight, done, average seconds) of every stage seen, in the order they were first started """
+        with self._lock:
+            return [(name, self.stages_in_flight[name], self.stages_done[name],
+                     self.stage_seconds[name] / self.stages_done[name] if self.stages_done[name] else None)
+                    for name in self.stages_in_flight]
+
+
+# Counters of the current process
+metrics = RunMetrics()
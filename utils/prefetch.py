@@ -0,0 +1,112 @@
+import concurrent.futures
+import threading
+
+from logs import log
+
+logger = log.get_logger("Prefetch:: ")
+
+
+class AppDataPrefetcher:
+    """Exports the app data of the next devices in background threads while the current device is migrated, so the
+    app-data downloads overlap with the uninstall and deploy job waits.
+
+    The upcoming devices are loaded on the calling thread with `resolve` and their app data is exported by
+    `workers` threads with `export`. No new export starts while the app data prefetched and not yet released takes
+    more than `max_bytes` on disk, so the budget is exceeded by at most the exports already running.
+
+    Example:
+
+        prefetcher = AppDataPrefetcher(resolve, export, release, serial_number, lookahead=2)
+        for index, device_detail in enumerate(devices):
+            prefetcher.prefetch(devices[index + 1:])
+            device = prefetcher.take(device_detail) or load_and_export(device_detail)
+            migrate(device)
+            prefetcher.release(device)
+        prefetcher.close()
+
+    :param resolve: callable loading a device detail into a `Device` without exporting its app data, None when the
+        device can not be migrated
+    :param export: callable exporting the app data of a `Device` and returning the number of bytes written
+    :param release: callable deleting the app data of a `Device` once it has been migrated
+    :param key: callable returning the serial number of a device detail
+    :param lookahead: number of upcoming devices prefetched
+    :param max_bytes: disk budget of the prefetched app data
+    :param workers: number of app-data exports running at the same time
+    """
+
+    def __init__(self, resolve, export, release, key, lookahead=2, max_bytes=2 * 1024 ** 3, workers=2):
+        self.resolve = resolve
+        self.export = export
+        self.release_device = release
+        self.key = key
+        self.lookahead = lookahead
+        self.max_bytes = max_bytes
+        self.bytes_on_disk = 0
+        # Serial number to (device, export future) of the devices prefetched and not taken yet
+        self._prefetched = {}
+        # Serial number to the bytes exported of the devices taken and not released yet
+        self._taken = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                               thread_name_prefix='app-data-prefetch')
+
+    def _exported(self, future):
+        if not future.cancelled() and future.exception() is None:
+            with self._lock:
+                self.bytes_on_disk += future.result()
+
+    def prefetch(self, upcoming):
+        """ Start the app-data export of the first `lookahead` upcoming device details which are not prefetched """
+        for device_detail in list(upcoming)[:self.lookahead]:
+            serial_number = self.key(device_detail)
+            if serial_number in self._prefetched or serial_number in self._taken:
+                continue
+            with self._lock:
+                if self.bytes_on_disk >= self.max_bytes:
+                    logger.info(f"Prefetched app data uses {self.bytes_on_disk / 1024 ** 2:.0f} MB of the "
+                                f"{self.max_bytes / 1024 ** 2:.0f} MB budget, waiting before prefetching more devices")
+                    return
+            try:
+                device = self.resolve(device_detail)
+            except Exception as err:
+                logger.warning(f"Could not load the device {serial_number} to prefetch its app data: {err}")
+                device = None
+            future = None
+            if device is not None:
+                logger.info(f"Prefetching the app data of the device {serial_number}...")
+                future = self._executor.submit(self.export, device)
+                future.add_done_callback(self._exported)
+            self._prefetched[serial_number] = (device, future)
+
+    def take(self, device_detail):
+        """ Wait for the prefetched app data of a device and return its `Device`, None when it was not prefetched """
+        serial_number = self.key(device_detail)
+        device, future = self._prefetched.pop(serial_number, (None, None))
+        if future is None:
+            return None
+        try:
+            self._taken[serial_number] = future.result()
+        except Exception as err:
+            logger.warning(f"Prefetch of the app data of the device {serial_number} failed: {err}")
+            return None
+        return device
+
+    def release(self, device):
+        """ Delete the app data of a migrated device which was prefetched and give its size back to the budget """
+        if device is None or device.serial_number not in self._taken:
+            return
+        size_bytes = self._taken.pop(device.serial_number)
+        self.release_device(device)
+        with self._lock:
+            self.bytes_on_disk -= size_bytes
+
+    def close(self):
+        """ Stop the exports not started yet and delete the app data of the devices which were never taken """
+        for device, future in self._prefetched.values():
+            if future is not None:
+                future.cancel()
+        self._executor.shutdown(wait=True)
+        for device, future in self._prefetched.values():
+            if future is not None and not future.cancelled():
+                self.release_device(device)
+        self._prefetched.clear()
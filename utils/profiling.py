@@ -0,0 +1,201 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from logs import log
+
+logger = log.get_logger("Profiler:: ")
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+PROFILERS = [CPROFILE, SAMPLE]
+
+
+def current_rss():
+    """ Resident set size of this process in bytes, None when it can not be read on this platform """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def open_fd_count():
+    """ Number of open file descriptors of this process, None when it can not be read on this platform """
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    try:
+        import psutil
+        process = psutil.Process()
+        return process.num_handles() if os.name == 'nt' else process.num_fds()
+    except ImportError:
+        return None
+
+
+class ResourceSampler(threading.Thread):
+    """Background thread recording the RSS and the number of open file descriptors of the process.
+
+    :param interval: seconds between two samples
+    """
+
+    def __init__(self, interval=1.0):
+        super().__init__(name='resource-sampler', daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+
+    def run(self):
+        start = time.time()
+        while True:
+            self.samples.append((round(time.time() - start, 3), current_rss(), open_fd_count()))
+            if self._stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def write_csv(self, file_name):
+        with open(file_name, 'w') as file:
+            file.write('elapsed_seconds,rss_bytes,open_fds\n')
+            for elapsed, rss, fds in self.samples:
+                file.write(f"{elapsed},{'' if rss is None else rss},{'' if fds is None else fds}\n")
+
+    def summary(self):
+        rss = [sample[1] for sample in self.samples if sample[1] is not None]
+        fds = [sample[2] for sample in self.samples if sample[2] is not None]
+        return {
+            'samples': len(self.samples),
+            'peak_rss_mb': round(max(rss) / 1024 / 1024, 1) if rss else None,
+            'final_rss_mb': round(rss[-1] / 1024 / 1024, 1) if rss else None,
+            'peak_open_fds': max(fds) if fds else None,
+            'final_open_fds': fds[-1] if fds else None,
+        }
+
+
+class StackSampler(threading.Thread):
+    """Sampling profiler of one thread, it records the full stack every `interval` seconds.
+
+    The stacks are written in the collapsed format (`frame;frame;frame count`) read by flamegraph.pl and
+    https://www.speedscope.app, and the overhead does not depend on the number of python calls like cProfile does.
+
+    :param thread_id: identifier of the thread to sample, by default the calling thread
+    :param interval: seconds between two samples
+    """
+
+    def __init__(self, thread_id=None, interval=0.01):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def write_collapsed(self, file_name):
+        with open(file_name, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+    def top(self, limit=30):
+        """ Text table of the functions with the most samples, on top of the stack (self) and anywhere (total) """
+        self_samples, total_samples = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_samples[frames[-1]] += count
+            for frame in set(frames):
+                total_samples[frame] += count
+        samples = sum(self.stacks.values()) or 1
+        lines = [f"{samples} samples every {self.interval * 1000:.0f} ms", f"{'self %':>8} {'total %':>8}  function"]
+        for frame, count in self_samples.most_common(limit):
+            lines.append(f"{count * 100 / samples:8.1f} {total_samples[frame] * 100 / samples:8.1f}  {frame}")
+        return '\n'.join(lines)
+
+
+class CommandProfiler:
+    """Profiles a whole command run and writes the results in `output_dir`.
+
+    Files written, all prefixed with `<name>_<timestamp>`:
+
+        .pstats     cProfile statistics, open with `python -m pstats`, snakeviz or flameprof (cprofile mode)
+        .collapsed  collapsed stacks for flamegraph.pl or speedscope (sample mode)
+        .txt        the top hot functions
+        .resources.csv  RSS and open file descriptors over the run
+
+    :param name: name of the profiled command, used in the file names
+    :param output_dir: directory where the profile files are written
+    :param mode: `cprofile` for deterministic profiling or `sample` for the low overhead sampling profiler
+    :param top: number of functions in the hot function summary
+    :param resource_interval: seconds between two RSS and open file descriptor samples
+    """
+
+    def __init__(self, name, output_dir, mode=CPROFILE, top=30, resource_interval=1.0):
+        self.mode = mode
+        self.top = top
+        os.makedirs(output_dir, exist_ok=True)
+        self.prefix = os.path.join(output_dir, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}")
+        self.resource_sampler = ResourceSampler(resource_interval)
+        self.profile = cProfile.Profile() if mode == CPROFILE else None
+        self.stack_sampler = StackSampler() if mode == SAMPLE else None
+        self._start = None
+
+    def start(self):
+        logger.info(f"Profiling the command with {self.mode}, results will be written in {self.prefix}.*")
+        self._start = time.time()
+        self.resource_sampler.start()
+        if self.profile:
+            self.profile.enable()
+        else:
+            self.stack_sampler.start()
+
+    def stop(self):
+        """ Stop profiling, write the result files and return the hot function summary """
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(self.prefix + '.pstats')
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(self.top)
+            hot_functions = stream.getvalue()
+        else:
+            self.stack_sampler.stop()
+            self.stack_sampler.write_collapsed(self.prefix + '.collapsed')
+            hot_functions = self.stack_sampler.top(self.top)
+        self.resource_sampler.stop()
+        self.resource_sampler.write_csv(self.prefix + '.resources.csv')
+
+        resources = self.resource_sampler.summary()
+        summary = (f"Run time: {time.time() - self._start:.1f} seconds, peak RSS: {resources['peak_rss_mb']} MB, "
+                   f"final RSS: {resources['final_rss_mb']} MB, peak open files: {resources['peak_open_fds']}, "
+                   f"final open files: {resources['final_open_fds']}\n\n{hot_functions}")
+        with open(self.prefix + '.txt', 'w') as file:
+            file.write(summary)
+        logger.info(f"Profile has been written in {self.prefix}.*")
+        return summary
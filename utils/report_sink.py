@@ -0,0 +1,176 @@
+import csv
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from logs import log
+
+logger = log.get_logger("Report:: ")
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FLUSH_INTERVAL = 5
+
+
+class RunningAggregates:
+    """ Counters of the migration results which are kept up to date while the rows are written """
+
+    def __init__(self):
+        self.devices = set()
+        self.by_status = Counter()
+        self.by_error = Counter()
+        self.by_app = defaultdict(Counter)
+
+    def add(self, row):
+        self.devices.add(row['serial_number'])
+        status = row.get('deploy_status') or 'Unknown'
+        self.by_status[status] += 1
+        self.by_app[f"{row['app_name']}:{row['app_version']}"][status] += 1
+        if row.get('error', '').strip():
+            self.by_error[row['error'].strip()] += 1
+
+    @property
+    def passed(self):
+        return self.by_status['Passed']
+
+    @property
+    def failed(self):
+        return self.by_status['Failed']
+
+    def snapshot(self):
+        return {
+            'devices': len(self.devices),
+            'apps': sum(self.by_status.values()),
+            'passed': self.passed,
+            'failed': self.failed,
+            'by_status': dict(self.by_status),
+            'by_error': dict(self.by_error),
+            'by_app': {app: dict(counts) for app, counts in self.by_app.items()},
+        }
+
+
+class ReportSink:
+    """Writes every migration result row to a csv or jsonl file as soon as it is known.
+
+    The file is flushed at the end of every device and at least every `flush_interval` seconds, so a crash loses at
+    most the rows of the device in progress and the file can be followed while the migration runs.
+
+    :param file_name: report file, the format is `jsonl` when the file name ends with `.jsonl` and `csv` otherwise
+    :param columns: column names of the rows
+    :param flush_interval: maximum number of seconds between two flushes
+    """
+
+    def __init__(self, file_name, columns, flush_interval=FLUSH_INTERVAL):
+        self.file_name = file_name
+        self.columns = ['timestamp'] + list(columns)
+        self.format = JSONL if file_name.endswith('.jsonl') else CSV
+        self.flush_interval = flush_interval
+        self.aggregates = RunningAggregates()
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        directory = os.path.dirname(os.path.abspath(file_name))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(file_name, 'w', newline='')
+        if self.format == CSV:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.columns)
+            self._writer.writeheader()
+        logger.info(f"Writing the migration report rows to {file_name}")
+
+    def write(self, row):
+        row = dict(row)
+        # Rows copied from another report keep their own timestamp
+        row.setdefault('timestamp', datetime.now().isoformat(timespec='seconds'))
+        with self._lock:
+            if self.format == CSV:
+                self._writer.writerow({column: row.get(column) for column in self.columns})
+            else:
+                self._file.write(json.dumps({column: row.get(column) for column in self.columns}) + '\n')
+            self.aggregates.add(row)
+            if time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_flush = time.time()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._flush()
+                self._file.close()
+
+    def log_progress(self):
+        logger.info(f"Progress: {len(self.aggregates.devices)} devices, {self.aggregates.passed} apps passed, "
+                    f"{self.aggregates.failed} apps failed")
+
+
+def read_report(file_name):
+    """ Iterate the rows of a csv or jsonl report file as dicts without loading the whole file """
+    with open(file_name, newline='') as file:
+        if file_name.endswith('.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def print_report_table(file_name, columns, header):
+    """Print a report file as a table in the tabulate `pretty` style.
+
+    The file is read twice, once to compute the column widths and once to print the rows, so the table of a run with
+    hundreds of thousands of rows is printed without holding the rows in memory.
+    """
+    widths = [len(title) for title in header]
+    for row in read_report(file_name):
+        for index, column in enumerate(columns):
+            widths[index] = max(widths[index], len(str(row.get(column) or '')))
+    separator = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+
+    def format_line(values):
+        return '|' + '|'.join(f' {str(value):^{width}} ' for value, width in zip(values, widths)) + '|'
+
+    print(separator)
+    print(format_line(header))
+    print(separator)
+    for row in read_report(file_name):
+        print(format_line([row.get(column) or '' for column in columns]))
+    print(separator)
+
+
+def merge_reports(input_files, output_file, columns, latest_only=True):
+    """Combine the report files of several installer processes, e.g. the shards of a migration, into one report.
+
+    :param input_files: csv or jsonl report files
+    :param output_file: merged report file, jsonl when the name ends with `.jsonl` and csv otherwise
+    :param columns: column names of the merged report
+    :param latest_only: keep only the most recent row of every device and app, so the rows of a device which was
+        migrated again replace the ones of the failed attempt
+
+    :return: `RunningAggregates` of the merged rows
+    """
+    if latest_only:
+        latest = {}
+        for file_name in input_files:
+            for row in read_report(file_name):
+                key = (row.get('serial_number'), row.get('app_name'), row.get('app_version'))
+                if key not in latest or (row.get('timestamp') or '') >= (latest[key].get('timestamp') or ''):
+                    latest[key] = row
+        rows = latest.values()
+    else:
+        rows = (row for file_name in input_files for row in read_report(file_name))
+    sink = ReportSink(output_file, columns)
+    try:
+        for row in rows:
+            sink.write(row)
+    finally:
+        sink.close()
+    return sink.aggregates
@@ -0,0 +1,114 @@
+import sys
+from array import array
+from collections import Counter, defaultdict
+
+STRING = 'str'
+
+
+class StringColumn:
+    """Dictionary encoded string column, every distinct value is stored once and the rows keep a small integer code."""
+
+    def __init__(self):
+        self.codes = array('I')
+        self.values = []
+        self._index = {}
+
+    def append(self, value):
+        value = '' if value is None else str(value)
+        code = self._index.get(value)
+        if code is None:
+            code = len(self.values)
+            value = sys.intern(value)
+            self.values.append(value)
+            self._index[value] = code
+        self.codes.append(code)
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        values = self.values
+        return (values[code] for code in self.codes)
+
+
+class NumberColumn:
+    """ Numeric column backed by an `array` of the given typecode """
+
+    def __init__(self, typecode='d'):
+        self.data = array(typecode)
+
+    def append(self, value):
+        self.data.append(value if value is not None else 0)
+
+    def __getitem__(self, row):
+        return self.data[row]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+
+class ResultStore:
+    """Compact columnar table for the per device and per app migration results.
+
+    Example:
+
+        results = ResultStore([('serial_number', 'str'), ('app_name', 'str'), ('duration', 'd')])
+        results.append('FOC123', 'my_app', 12.5)
+        results.count_by('app_name')
+
+    :param columns: list of (column name, kind) where kind is `str` or an `array` typecode such as `d` or `l`
+    """
+
+    def __init__(self, columns):
+        self.column_names = [name for name, _ in columns]
+        self.columns = {name: StringColumn() if kind == STRING else NumberColumn(kind) for name, kind in columns}
+
+    def __len__(self):
+        return len(self.columns[self.column_names[0]]) if self.column_names else 0
+
+    def __iter__(self):
+        return self.rows()
+
+    def append(self, *values, **named_values):
+        """ Append one row given either positionally in column order or by column name """
+        if values and named_values:
+            raise ValueError("Give the row values either positionally or by name")
+        if values:
+            if len(values) != len(self.column_names):
+                raise ValueError(f"Expected {len(self.column_names)} values but got {len(values)}")
+            named_values = dict(zip(self.column_names, values))
+        for name in self.column_names:
+            self.columns[name].append(named_values.get(name))
+
+    def column(self, name):
+        return list(self.columns[name])
+
+    def rows(self, *names):
+        """ Iterate the rows as tuples of the given columns, by default all columns """
+        columns = [self.columns[name] for name in (names or self.column_names)]
+        return zip(*columns)
+
+    def where(self, **equals):
+        """ Iterate the rows as dicts whose columns have the given values """
+        for row in range(len(self)):
+            if all(self.columns[name][row] == value for name, value in equals.items()):
+                yield {name: self.columns[name][row] for name in self.column_names}
+
+    def count_by(self, *names):
+        """ Number of rows for each distinct value (tuple of values for several columns) """
+        if len(names) == 1:
+            return Counter(self.columns[names[0]])
+        return Counter(self.rows(*names))
+
+    def sum_by(self, name, value_name):
+        """ Sum of the numeric column `value_name` for each distinct value of the column `name` """
+        totals = defaultdict(float)
+        for key, value in zip(self.columns[name], self.columns[value_name]):
+            totals[key] += value
+        return dict(totals)
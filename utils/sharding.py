@@ -0,0 +1,27 @@
+import hashlib
+import re
+
+
+def parse_shard(shard):
+    """Parse a `i/N` shard specification, `i` counts from 1 to `N`.
+
+    :return: (i, N)
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', shard or '')
+    if not match:
+        raise ValueError(f"Invalid shard {shard!r}, expected i/N such as 1/4")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {shard!r}, i must be between 1 and N")
+    return index, count
+
+
+def shard_of(key, count):
+    """ Shard, from 1 to `count`, of a key such as a serial number, the same on every host and python version """
+    digest = hashlib.sha1(str(key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def select_shard(items, index, count, key):
+    """ Items whose `key(item)` falls in the shard `index` of `count` disjoint shards """
+    return [item for item in items if shard_of(key(item), count) == index]
@@ -0,0 +1,122 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from logs import log
+
+logger = log.get_logger("Timing Store:: ")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS step_timings (
+    run_id TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    serial_number TEXT,
+    device_class TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    app_version TEXT NOT NULL,
+    step TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS step_timings_step ON step_timings (step, app_name, app_version);
+CREATE TABLE IF NOT EXISTS device_timings (
+    run_id TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    serial_number TEXT,
+    device_class TEXT NOT NULL,
+    apps INTEGER NOT NULL,
+    seconds REAL NOT NULL
+);
+"""
+
+UNKNOWN_DEVICE_CLASS = 'unknown'
+
+
+def device_class(model):
+    """ Device class of a hardware model, its family without the variant suffix, e.g. IR829 for IR829M-2LTE-EA-BK9 """
+    match = re.match(r'[A-Za-z]+\d+', model or '')
+    return match.group().upper() if match else UNKNOWN_DEVICE_CLASS
+
+
+class TimingStore:
+    """Local SQLite database of the step durations of the past runs, by app, app version and device class.
+
+    Every migrated device adds one row per step of its passed apps, with the bytes moved by the data steps, and one
+    row with the total of its steps. The averages feed the `StepDurationEstimator` of the planner, the ETA of the
+    running migrations and the capacity planning.
+
+    Example:
+
+        store = TimingStore('timings.db')
+        store.record_device(device)
+        estimator = StepDurationEstimator.from_timings(store.timings())
+
+    :param file_name: SQLite database, created when missing, can be shared by the installer processes of a host
+    :param run_id: id of the rows recorded by this process, a new one by default
+    """
+
+    def __init__(self, file_name, run_id=None):
+        self.file_name = file_name
+        self.run_id = run_id or uuid.uuid4().hex
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        self._db = sqlite3.connect(file_name, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def record_device(self, device):
+        """ Record the step durations of the passed apps of a migrated `Device` """
+        now = time.time()
+        klass = device_class(device.model)
+        step_rows = []
+        for app in device.applications:
+            if app.deploy_status != "Passed" or not app.phase_seconds:
+                continue
+            phase_bytes = app.phase_bytes or {}
+            step_rows.extend((self.run_id, now, device.serial_number, klass, app.app_name, app.app_version, step,
+                              seconds, phase_bytes.get(step)) for step, seconds in app.phase_seconds.items())
+        if not step_rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany('INSERT INTO step_timings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', step_rows)
+            self._db.execute('INSERT INTO device_timings VALUES (?, ?, ?, ?, ?, ?)',
+                             (self.run_id, now, device.serial_number, klass,
+                              len({row[4:6] for row in step_rows}), sum(row[7] for row in step_rows)))
+
+    def timings(self, since_days=None):
+        """ Average step durations in the timings file format of `StepDurationEstimator`, with the transfer rates
+
+        :param since_days: only use the rows recorded in the last days, by default all the rows
+        """
+        since = time.time() - since_days * 86400 if since_days else 0
+        with self._lock:
+            steps = self._db.execute('SELECT step, AVG(seconds) FROM step_timings WHERE recorded >= ? GROUP BY step',
+                                     (since,)).fetchall()
+            apps = self._db.execute('SELECT app_name, app_version, step, AVG(seconds) FROM step_timings '
+                                    'WHERE recorded >= ? GROUP BY app_name, app_version, step', (since,)).fetchall()
+            classes = self._db.execute('SELECT device_class, step, AVG(seconds) FROM step_timings '
+                                       'WHERE recorded >= ? GROUP BY device_class, step', (since,)).fetchall()
+            rates = self._db.execute('SELECT step, SUM(bytes) / SUM(seconds) FROM step_timings '
+                                     'WHERE recorded >= ? AND bytes > 0 AND seconds > 0 GROUP BY step',
+                                     (since,)).fetchall()
+        timings = {'steps': dict(steps), 'apps': {}, 'device_classes': {}, 'bytes_per_second': dict(rates)}
+        for app_name, app_version, step, seconds in apps:
+            timings['apps'].setdefault(f'{app_name}:{app_version}', {})[step] = seconds
+        for klass, step, seconds in classes:
+            timings['device_classes'].setdefault(klass, {})[step] = seconds
+        return timings
+
+    def device_stats(self, since_days=None):
+        """ Number of devices recorded and the mean and longest total of their step durations in seconds """
+        since = time.time() - since_days * 86400 if since_days else 0
+        with self._lock:
+            count, mean, longest = self._db.execute('SELECT COUNT(*), AVG(seconds), MAX(seconds) FROM device_timings '
+                                                    'WHERE recorded >= ?', (since,)).fetchone()
+        return {'devices': count, 'mean_seconds': mean, 'max_seconds': longest}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
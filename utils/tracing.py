@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from logs import log
+from utils.metrics import metrics
+
+logger = log.get_logger("Tracing:: ")
+
+
+class Span:
+    __slots__ = ('name', 'attributes', 'start', 'duration')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = 0.0
+
+
+class Tracer:
+    """Times the phases of a migration and writes them as complete events of the Chrome trace format.
+
+    The trace file is a json array which is written one event at a time, it can be opened in `chrome://tracing` or
+    https://ui.perfetto.dev even when the run was interrupted before the array was closed. Without a trace file the
+    spans are only timed and summed in `totals`.
+
+    Example:
+
+        tracer = Tracer('migration.trace.json')
+        with tracer.span('deploy', serial_number='FOC123', app_name='my_app'):
+            ...
+        tracer.close()
+
+    :param trace_file: file where the events are written, None to only keep the totals
+    """
+
+    def __init__(self, trace_file=None):
+        self.trace_file = trace_file
+        # Number of spans and total seconds per span name
+        self.totals = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._first_event = True
+        if trace_file:
+            os.makedirs(os.path.dirname(os.path.abspath(trace_file)), exist_ok=True)
+            self._file = open(trace_file, 'w')
+            self._file.write('[\n')
+            logger.info(f"Writing the phase timings trace to {trace_file}")
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """ Time the enclosed block, the span is recorded with an `error` attribute when the block raises """
+        span = Span(name, attributes)
+        tick = time.perf_counter()
+        metrics.stage_started(name)
+        try:
+            yield span
+        except BaseException as err:
+            span.attributes['error'] = type(err).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - tick
+            metrics.stage_finished(name, span.duration)
+            self._record(span)
+
+    def _record(self, span):
+        with self._lock:
+            count, seconds = self.totals.get(span.name, (0, 0.0))
+            self.totals[span.name] = (count + 1, seconds + span.duration)
+            if self._file is None or self._file.closed:
+                return
+            event = {'name': span.name, 'cat': 'migration', 'ph': 'X', 'ts': int(span.start * 1e6),
+                     'dur': int(span.duration * 1e6), 'pid': os.getpid(), 'tid': threading.get_ident(),
+                     'args': span.attributes}
+            self._file.write(('' if self._first_event else ',\n') + json.dumps(event, default=str))
+            self._first_event = False
+            self._file.flush()
+
+    def summary(self):
+        """ Returns (name, count, total seconds, share of the traced time) sorted by the total time, longest first """
+        traced_seconds = sum(seconds for _, seconds in self.totals.values()) or 1.0
+        return [(name, count, round(seconds, 3), round(seconds / traced_seconds, 3)) for name, (count, seconds) in
+                sorted(self.totals.items(), key=lambda item: item[1][1], reverse=True)]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and not self._file.closed:
+                self._file.write('\n]\n')
+                self._file.close()
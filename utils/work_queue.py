@@ -0,0 +1,221 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from logs import log
+
+logger = log.get_logger("Work Queue:: ")
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    serial_number TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    detail TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    passed INTEGER,
+    failed INTEGER,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS devices_status ON devices (status, position);
+"""
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}_{os.getpid()}'
+
+
+class DeviceWorkQueue:
+    """Device queue in a SQLite file that several installer processes pull devices from.
+
+    A device is leased to one worker for `lease_seconds`. The worker renews its leases while it migrates the devices
+    (see `start_heartbeat`) and completes them when they are done, so the devices of a crashed worker are leased again
+    to another worker once their lease expired, at most `max_attempts` times.
+
+    Example:
+
+        queue = DeviceWorkQueue('queue.db')
+        queue.enqueue(devices, serial_number)
+        queue.start_heartbeat()
+        while True:
+            batch = queue.lease_next(10)
+            if not batch:
+                break
+            for device in batch:
+                migrate(device)
+                queue.complete(serial_number(device))
+        queue.close()
+
+    :param file_name: SQLite database, created when missing and shared by all the workers
+    :param worker: name of this worker, by default `<hostname>_<pid>`
+    :param lease_seconds: seconds a leased device is reserved to the worker without a renewal
+    :param max_attempts: number of leases of a device before it is given up
+    """
+
+    def __init__(self, file_name, worker=None, lease_seconds=600, max_attempts=3):
+        self.file_name = file_name
+        self.worker = worker or default_worker_name()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._stopped = threading.Event()
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        # Autocommit mode, the transactions which must be atomic across processes are opened explicitly
+        self._db = sqlite3.connect(file_name, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def _transaction(self, statements):
+        """ Run `statements(cursor)` in a write transaction, which locks the queue for the other workers """
+        with self._lock:
+            cursor = self._db.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(cursor)
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+            return result
+
+    def enqueue(self, devices, key):
+        """ Add the devices which are not in the queue yet, keeping their order
+
+        :param devices: json serializable device details
+        :param key: callable returning the serial number of a device detail
+        :return: number of devices added
+        """
+        def insert(cursor):
+            position = cursor.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM devices').fetchone()[0]
+            added = 0
+            for device in devices:
+                cursor.execute('INSERT OR IGNORE INTO devices (serial_number, position, detail, status) '
+                               'VALUES (?, ?, ?, ?)', (key(device), position, json.dumps(device), PENDING))
+                added += cursor.rowcount
+                position += 1
+            return added
+
+        added = self._transaction(insert)
+        logger.info(f"{added} devices added to the work queue {self.file_name}")
+        return added
+
+    def lease(self, count=1):
+        """ Lease the next `count` pending devices, or devices whose lease expired, to this worker
+
+        :return: list of the device details, empty when there is nothing left to lease
+        """
+        def take(cursor):
+            now = time.time()
+            rows = cursor.execute(
+                'SELECT serial_number, detail, status, worker FROM devices '
+                'WHERE (status = ? OR (status = ? AND lease_expires < ?)) AND attempts < ? '
+                'ORDER BY position LIMIT ?', (PENDING, LEASED, now, self.max_attempts, count)).fetchall()
+            for serial_number, _, status, worker in rows:
+                if status == LEASED:
+                    logger.warning(f"Lease of the device {serial_number} by {worker} expired, leasing it again")
+                cursor.execute('UPDATE devices SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 '
+                               'WHERE serial_number = ?', (LEASED, self.worker, now + self.lease_seconds,
+                                                           serial_number))
+            # Expired leases which used all their attempts will never be completed
+            cursor.execute('UPDATE devices SET status = ?, finished = ? WHERE status = ? AND lease_expires < ? '
+                           'AND attempts >= ?', (FAILED, now, LEASED, now, self.max_attempts))
+            return [json.loads(detail) for _, detail, _, _ in rows]
+
+        return self._transaction(take)
+
+    def next_lease_expiry(self):
+        """ Earliest expiry time of the devices leased by the other workers, None when they hold no device """
+        with self._lock:
+            return self._db.execute('SELECT MIN(lease_expires) FROM devices WHERE status = ? AND worker != ?',
+                                    (LEASED, self.worker)).fetchone()[0]
+
+    def lease_next(self, count=1):
+        """ Lease the next `count` devices, waiting for the leases of the other workers to expire when no device is
+        pending, so the devices of a worker which crashed are still migrated
+
+        :return: list of the device details, empty once no device is pending or leased by another worker
+        """
+        while True:
+            devices = self.lease(count)
+            if devices:
+                return devices
+            expires = self.next_lease_expiry()
+            if expires is None:
+                return []
+            delay = min(max(0.0, expires - time.time()), self.lease_seconds) + 1
+            logger.info(f"No pending device, waiting {delay:.0f} seconds for the leases of the other workers")
+            time.sleep(delay)
+
+    def renew(self):
+        """ Extend the leases of all the devices held by this worker """
+        with self._lock:
+            self._db.execute('UPDATE devices SET lease_expires = ? WHERE status = ? AND worker = ?',
+                             (time.time() + self.lease_seconds, LEASED, self.worker))
+
+    def complete(self, serial_number, passed=None, failed=None, status=DONE):
+        """ Mark a leased device as finished, a device whose lease was taken over by another worker is left alone """
+        with self._lock:
+            self._db.execute('UPDATE devices SET status = ?, passed = ?, failed = ?, finished = ?, '
+                             'lease_expires = NULL WHERE serial_number = ? AND worker = ? AND status = ?',
+                             (status, passed, failed, time.time(), serial_number, self.worker, LEASED))
+
+    def stats(self, window_seconds=300):
+        """ Queue depth by status and the throughput in devices per minute, overall and over the last window """
+        with self._lock:
+            by_status = dict(self._db.execute('SELECT status, COUNT(*) FROM devices GROUP BY status').fetchall())
+            first, last, finished = self._db.execute(
+                'SELECT MIN(finished), MAX(finished), COUNT(*) FROM devices WHERE finished IS NOT NULL').fetchone()
+            recent = self._db.execute('SELECT COUNT(*) FROM devices WHERE finished >= ?',
+                                      (time.time() - window_seconds,)).fetchone()[0]
+            workers = self._db.execute('SELECT worker, COUNT(*) FROM devices WHERE status = ? GROUP BY worker',
+                                       (LEASED,)).fetchall()
+        elapsed = (last - first) if finished > 1 else 0
+        # A run younger than the window is measured over its own duration
+        recent_seconds = min(window_seconds, time.time() - first) if finished else window_seconds
+        return {
+            'pending': by_status.get(PENDING, 0),
+            'leased': by_status.get(LEASED, 0),
+            'done': by_status.get(DONE, 0),
+            'failed': by_status.get(FAILED, 0),
+            'devices_per_minute': round(finished * 60 / elapsed, 2) if elapsed else None,
+            'recent_devices_per_minute': round(recent * 60 / recent_seconds, 2) if recent_seconds > 0 else None,
+            'workers': dict(workers),
+        }
+
+    def log_progress(self):
+        stats = self.stats()
+        remaining = stats['pending'] + stats['leased']
+        rate = stats['recent_devices_per_minute'] or stats['devices_per_minute']
+        logger.info(f"Work queue: {stats['pending']} pending, {stats['leased']} leased by {len(stats['workers'])} "
+                    f"workers, {stats['done']} done, {stats['failed']} failed, {rate or 0} devices/min"
+                    + (f", about {remaining / rate:.0f} minutes left" if rate else ''))
+
+    def start_heartbeat(self):
+        """ Renew the leases of this worker in a background thread every third of the lease duration """
+        def beat():
+            while not self._stopped.wait(self.lease_seconds / 3):
+                try:
+                    self.renew()
+                except sqlite3.Error as err:
+                    logger.warning(f"Could not renew the leases of {self.worker}: {err}")
+
+        self._heartbeat = threading.Thread(target=beat, name='work-queue-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def close(self):
+        self._stopped.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,147 @@
+import concurrent.futures
+import time
+from collections import OrderedDict
+
+from app_migration import PHASE_VERIFY
+from iox.catalog import fetch_all_pages
+from logs import log
+
+logger = log.get_logger("Verification Sweep:: ")
+
+# Operational states of a deployed app which are not final yet, see AppMigration.track_app_operational_status
+TRANSIENT_STATES = {'DEPLOYED', 'UNKNOWN', None}
+
+
+class VerificationSweep:
+    """Verifies the operational status of the deployed apps in bulk instead of polling every app after its deploy.
+
+    The devices are added once their apps are deployed and the installer moves on to the next device. Every
+    `interval` seconds one sweep reads the apps of all the devices waiting for a verification: with one paginated
+    pass over the IoT-OD device inventory when more than `per_device_threshold` devices are waiting and they are at
+    least `inventory_fraction` of the inventory, with one app listing request per device otherwise, `max_workers` at a
+    time. A device is handed to `on_device_verified` once all its apps reached a
+    final state or `wait_timeout` seconds passed since it was added.
+
+    The sweeps run on the thread calling `add`, `poll` and `finish`, so the results are reported on that thread.
+
+    :param api_connection: IoT-OD `ApiConnection`
+    :param on_device_verified: callable taking the verified `Device`
+    :param interval: minimum seconds between two sweeps
+    :param wait_timeout: seconds after which an app which is not in a final state is reported as `DEPLOY_FAILED`
+    :param per_device_threshold: number of waiting devices above which the whole inventory may be listed
+    :param inventory_fraction: share of the inventory the waiting devices must reach for the whole inventory to be
+        listed, so a few waiting devices do not pull every page of a large inventory
+    :param page_size: number of devices requested per page of the inventory
+    :param max_workers: number of requests sent in parallel
+    """
+
+    def __init__(self, api_connection, on_device_verified, interval=30, wait_timeout=300, per_device_threshold=20,
+                 inventory_fraction=0.1, page_size=1000, max_workers=8):
+        self.api = api_connection
+        self.on_device_verified = on_device_verified
+        self.interval = interval
+        self.wait_timeout = wait_timeout
+        self.per_device_threshold = per_device_threshold
+        self.inventory_fraction = inventory_fraction
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.sweeps = 0
+        # Number of devices of the IoT-OD inventory, read once and updated by every inventory pass
+        self.inventory_size = None
+        # Serial number to (device, apps waiting for their status, time the device was added)
+        self._pending = OrderedDict()
+        self._last_sweep = 0.0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, device, apps):
+        """ Wait for the operational status of the given apps of a device, then report the device """
+        if not apps:
+            self.on_device_verified(device)
+        else:
+            self._pending[device.serial_number] = (device, list(apps), time.time())
+        self.poll()
+
+    def poll(self):
+        """ Run a sweep when the last one is older than the interval """
+        if self._pending and time.time() - self._last_sweep >= self.interval:
+            self.sweep()
+
+    def use_inventory(self, waiting):
+        """ Whether listing the whole inventory is cheaper than one app listing per waiting device """
+        if waiting <= self.per_device_threshold:
+            return False
+        if self.inventory_size is None:
+            response = self.api.list_devices(offset=0, limit=1) or {}
+            self.inventory_size = response.get('totalCount')
+            if self.inventory_size is None:
+                # Unknown size, the first inventory pass counts it
+                return True
+        return waiting >= self.inventory_fraction * self.inventory_size
+
+    def fetch_device_apps(self):
+        """ App records of the waiting devices, by device id """
+        device_ids = [device.device_id for device, _, _ in self._pending.values()]
+        if self.use_inventory(len(device_ids)):
+            inventory = fetch_all_pages(self.api.list_devices, self.page_size, self.max_workers)
+            self.inventory_size = len(inventory)
+            return {device['deviceId']: device.get('apps') or [] for device in inventory}
+
+        def device_apps(device_id):
+            try:
+                return (self.api.get_unmanaged_apps_on_device(device_id) or {}).get('data', [])
+            except Exception as err:
+                logger.warning(f"Could not list the apps of the device {device_id}: {err}")
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(device_ids, executor.map(device_apps, device_ids)))
+
+    def sweep(self):
+        """ Read the status of the waiting apps and report the devices whose apps are all in a final state """
+        self._last_sweep = time.time()
+        self.sweeps += 1
+        try:
+            device_apps = self.fetch_device_apps()
+        except Exception as err:
+            logger.warning(f"Verification sweep failed, retrying at the next sweep: {err}")
+            device_apps = {}
+        now = time.time()
+        verified = []
+        for serial_number, (device, apps, added) in list(self._pending.items()):
+            records = device_apps.get(device.device_id) or []
+            waiting = []
+            for app in apps:
+                record = next((record for record in records if record.get('appId') == app.imported_app_id and
+                               record.get('version', app.app_version) == app.app_version), None)
+                state = (record or {}).get('operationalStatus', (record or {}).get('status'))
+                if state not in TRANSIENT_STATES:
+                    app.operational_status = record.get('status')
+                    if record.get('status') != "RUNNING":
+                        app.deploy_status_msg = record.get('message', '')
+                elif now - added >= self.wait_timeout:
+                    app.operational_status = 'DEPLOY_FAILED'
+                    app.deploy_status_msg = (record or {}).get('message') or \
+                        f"Not in a final state after {self.wait_timeout} seconds"
+                else:
+                    waiting.append(app)
+                    continue
+                if app.phase_seconds is None:
+                    app.phase_seconds = {}
+                app.phase_seconds[PHASE_VERIFY] = app.phase_seconds.get(PHASE_VERIFY, 0.0) + now - added
+            if waiting:
+                self._pending[serial_number] = (device, waiting, added)
+            else:
+                del self._pending[serial_number]
+                verified.append(device)
+        logger.info(f"Verification sweep {self.sweeps}: {len(verified)} devices verified, {len(self._pending)} "
+                    f"devices waiting")
+        for device in verified:
+            self.on_device_verified(device)
+
+    def finish(self):
+        """ Sweep until every waiting device has been reported """
+        while self._pending:
+            time.sleep(max(0.0, self._last_sweep + self.interval - time.time()))
+            self.sweep()
@@ -0,0 +1,186 @@
+import statistics
+from time import sleep
+
+from logs import log
+
+logger = log.get_logger("Wave Scheduler:: ")
+
+GROW = 'grow'
+HOLD = 'hold'
+SHRINK = 'shrink'
+PAUSE = 'pause'
+ABORT = 'abort'
+
+
+class WaveResult:
+    """Outcome of one wave, the input of the next wave size decision.
+
+    :param passed: number of apps installed successfully
+    :param failed: number of apps which failed
+    :param job_seconds: durations of the uninstall and deploy jobs of the wave
+    :param backlog: number of IoT-OD jobs still running after the wave, None when unknown
+    """
+
+    def __init__(self, passed=0, failed=0, job_seconds=None, backlog=None):
+        self.passed = passed
+        self.failed = failed
+        self.job_seconds = job_seconds or []
+        self.backlog = backlog
+
+    @classmethod
+    def from_devices(cls, devices, job_phases=('uninstall', 'deploy'), backlog=None):
+        """ Collect the result of the apps of the given `Device` instances once they have been migrated """
+        result = cls(backlog=backlog)
+        for device in devices:
+            for app in device.applications:
+                if app.deploy_status == 'Passed':
+                    result.passed += 1
+                elif app.deploy_status == 'Failed':
+                    result.failed += 1
+                for phase in job_phases:
+                    if app.phase_seconds and phase in app.phase_seconds:
+                        result.job_seconds.append(app.phase_seconds[phase])
+        return result
+
+    @property
+    def error_rate(self):
+        total = self.passed + self.failed
+        return self.failed / total if total else 0.0
+
+    @property
+    def median_job_seconds(self):
+        return statistics.median(self.job_seconds) if self.job_seconds else None
+
+
+class WaveScheduler:
+    """Hands out the devices to migrate in waves whose size adapts to the health of the run.
+
+    The first wave is a small canary and its median job duration is the latency baseline. After every wave:
+
+    - the next wave grows by `growth` while the error rate is at most `max_error_rate`, the median job duration stays
+      under `max_latency_factor` times the baseline and the IoT-OD job backlog is under `max_backlog`
+    - it shrinks by `shrink` as soon as one of them is exceeded
+    - the run pauses `pause_seconds` and restarts with a canary sized wave when the error rate reaches
+      `pause_error_rate`, and it is aborted after `max_pauses` consecutive pauses
+
+    Example:
+
+        scheduler = WaveScheduler(devices, canary_size=5, max_wave_size=200)
+        for wave in scheduler.waves():
+            migrated_devices = migrate(wave)
+            scheduler.record(WaveResult.from_devices(migrated_devices))
+
+    :param devices: devices to migrate, in the order they should be migrated
+    :param canary_size: size of the first wave
+    :param max_wave_size: upper bound of the wave size
+    :param backlog_probe: callable returning the number of running IoT-OD jobs, None to ignore the backlog
+    """
+
+    def __init__(self, devices, canary_size=5, max_wave_size=200, growth=2.0, shrink=0.5, max_error_rate=0.05,
+                 pause_error_rate=0.5, max_latency_factor=2.0, max_backlog=None, pause_seconds=300, max_pauses=3,
+                 backlog_probe=None):
+        self.devices = list(devices)
+        self.canary_size = max(1, canary_size)
+        self.max_wave_size = max(self.canary_size, max_wave_size)
+        self.growth = growth
+        self.shrink = shrink
+        self.max_error_rate = max_error_rate
+        self.pause_error_rate = pause_error_rate
+        self.max_latency_factor = max_latency_factor
+        self.max_backlog = max_backlog
+        self.pause_seconds = pause_seconds
+        self.max_pauses = max_pauses
+        self.backlog_probe = backlog_probe
+        self.wave_size = self.canary_size
+        self.baseline_job_seconds = None
+        self.consecutive_pauses = 0
+        self.aborted = False
+        # One entry per wave with its size, results and the decision taken after it
+        self.history = []
+        self._position = 0
+
+    @property
+    def remaining(self):
+        return len(self.devices) - self._position
+
+    def waves(self):
+        """ Yield the waves of devices, `record` must be called with the result of a wave before the next one """
+        while self._position < len(self.devices) and not self.aborted:
+            wave = self.devices[self._position:self._position + self.wave_size]
+            self._position += len(wave)
+            logger.info(f"Wave {len(self.history) + 1}: migrating {len(wave)} devices, "
+                        f"{self.remaining} devices remaining")
+            expected_waves = len(self.history) + 1
+            yield wave
+            if len(self.history) < expected_waves:
+                raise RuntimeError("WaveScheduler.record was not called with the result of the wave")
+        if self.aborted and self.remaining:
+            logger.error(f"Wave scheduling aborted, {self.remaining} devices have not been migrated")
+
+    def probe_backlog(self):
+        if self.backlog_probe is None:
+            return None
+        try:
+            return self.backlog_probe()
+        except Exception as err:
+            logger.warning(f"Could not read the IoT-OD job backlog: {err}")
+            return None
+
+    def record(self, result: WaveResult):
+        """ Take the size decision for the next wave from the result of the wave that just finished """
+        if result.backlog is None:
+            result.backlog = self.probe_backlog()
+        wave_size = self.wave_size
+        decision, reason = self.decide(result)
+        if decision == GROW:
+            self.wave_size = min(self.max_wave_size, max(wave_size + 1, int(wave_size * self.growth)))
+        elif decision == SHRINK:
+            self.wave_size = max(1, int(wave_size * self.shrink))
+        elif decision in (PAUSE, ABORT):
+            self.wave_size = self.canary_size
+        self.history.append({
+            'wave': len(self.history) + 1,
+            'size': wave_size,
+            'passed': result.passed,
+            'failed': result.failed,
+            'error_rate': round(result.error_rate, 3),
+            'median_job_seconds': result.median_job_seconds,
+            'backlog': result.backlog,
+            'decision': decision,
+            'reason': reason,
+            'next_size': self.wave_size,
+        })
+        log_method = logger.info if decision in (GROW, HOLD) else logger.warning
+        log_method(f"Wave {len(self.history)} of {wave_size} devices: {result.passed} apps passed, {result.failed} "
+                   f"failed ({result.error_rate:.1%}), median job {result.median_job_seconds or 0:.1f}s, backlog "
+                   f"{result.backlog if result.backlog is not None else 'unknown'} -> {decision} ({reason}), next "
+                   f"wave {self.wave_size} devices")
+        if decision == PAUSE:
+            logger.warning(f"Pausing for {self.pause_seconds} seconds before the next wave...")
+            sleep(self.pause_seconds)
+        elif decision == ABORT:
+            self.aborted = True
+
+    def decide(self, result: WaveResult):
+        """ Returns the decision for the next wave and the reason of it """
+        if self.baseline_job_seconds is None and result.median_job_seconds:
+            self.baseline_job_seconds = result.median_job_seconds
+
+        if result.passed + result.failed and result.error_rate >= self.pause_error_rate:
+            self.consecutive_pauses += 1
+            if self.consecutive_pauses > self.max_pauses:
+                return ABORT, f"error rate {result.error_rate:.1%} after {self.max_pauses} pauses"
+            return PAUSE, f"error rate {result.error_rate:.1%} >= {self.pause_error_rate:.1%}"
+        self.consecutive_pauses = 0
+
+        if result.error_rate > self.max_error_rate:
+            return SHRINK, f"error rate {result.error_rate:.1%} > {self.max_error_rate:.1%}"
+        if self.max_backlog is not None and result.backlog is not None and result.backlog > self.max_backlog:
+            return SHRINK, f"job backlog {result.backlog} > {self.max_backlog}"
+        if self.baseline_job_seconds and result.median_job_seconds and \
+                result.median_job_seconds > self.baseline_job_seconds * self.max_latency_factor:
+            return SHRINK, (f"median job {result.median_job_seconds:.1f}s > {self.max_latency_factor} x baseline "
+                            f"{self.baseline_job_seconds:.1f}s")
+        if self.wave_size >= self.max_wave_size:
+            return HOLD, "healthy, at the maximum wave size"
+        return GROW, "healthy"